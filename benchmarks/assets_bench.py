@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Audit a synthetic, gzipped asset export with --assets.
+
+Peak memory should not grow with the number of projects.
+
+usage: python benchmarks/assets_bench.py [PROJECTS...]
+"""
+
+import gzip
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import fakeapi
+
+
+def write_export(path, org):
+    count = 0
+    with gzip.open(path, 'wb') as f:
+        for project in org.projects:
+            assets = [('compute.googleapis.com/Firewall',
+                       org.firewall(project, i))
+                      for i in range(org.firewalls)]
+            assets += [('sqladmin.googleapis.com/Instance',
+                        org.sql(project, i)) for i in range(org.instances)]
+            for i in range(org.buckets):
+                bucket = org.bucket(project, i)
+                bucket['acl'] = [org.acl(bucket['name'], j)
+                                 for j in range(org.acls)]
+                bucket['defaultObjectAcl'] = bucket['acl']
+                bucket['projectNumber'] = project
+                assets.append(('storage.googleapis.com/Bucket', bucket))
+
+            for asset_type, data in assets:
+                f.write(json.dumps({'asset_type': asset_type,
+                                    'resource': {'data': data}}) + '\n')
+                count += 1
+    return count
+
+
+def child(path):
+    from gcp_audit import gcp_audit
+
+    fd, output = tempfile.mkstemp()
+    os.close(fd)
+    sys.argv = ['gcp-audit', '--assets', path, '-f', 'jsonl', '-o', output]
+    sys.stdout = open(os.devnull, 'w')
+
+    start = time.time()
+    gcp_audit.main()
+    elapsed = time.time() - start
+    os.remove(output)
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    sys.stderr.write('%f %d\n' % (elapsed, rss))
+
+
+def main():
+    sizes = [int(n) for n in sys.argv[1:]] or [100, 1000, 10000]
+
+    print '%8s %10s %10s %12s %10s' % ('projects', 'assets', 'seconds',
+                                       'assets/s', 'peak MB')
+    for nprojects in sizes:
+        fd, path = tempfile.mkstemp(suffix='.json.gz')
+        os.close(fd)
+        try:
+            count = write_export(path, fakeapi.Org(projects=nprojects))
+            proc = subprocess.Popen([sys.executable, __file__, 'child', path],
+                                    stderr=subprocess.PIPE)
+            _, err = proc.communicate()
+            if proc.returncode:
+                sys.exit(err)
+            elapsed, rss = err.split()[-2:]
+        finally:
+            os.remove(path)
+
+        print '%8d %10d %10.2f %12.0f %10.1f' % (
+            nprojects, count, float(elapsed), count / float(elapsed),
+            int(rss) / 1024.0)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['child']:
+        child(sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Compare per-object and columnar evaluation of the firewall rules.
+
+usage: python benchmarks/columnar_bench.py [OBJECTS] [DISTINCT]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import fakeapi
+from gcp_audit import gcp_audit
+
+
+def timed(func, *args, **kwargs):
+    start = time.time()
+    res = func(*args, **kwargs)
+    return res, time.time() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    distinct = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    org = fakeapi.Org()
+    objects = [org.firewall('project-%04d' % (i / distinct), i % distinct)
+               for i in range(count)]
+
+    expected, slow = timed(gcp_audit.evaluate_rules, 'firewalls', objects)
+    print '%d firewalls, %d matches' % (count, len(expected))
+    print '%-16s %6.2fs %9.0f objects/s' % ('per object:', slow,
+                                            count / slow)
+
+    for size in (64, 256, 1024, 4096):
+        found, elapsed = timed(gcp_audit.evaluate_batches, 'firewalls',
+                               objects, size)
+        if found != expected:
+            sys.exit('columnar evaluation found %d matches, per object %d'
+                     % (len(found), len(expected)))
+        print '%-16s %6.2fs %9.0f objects/s (%.1fx)' % (
+            'columnar %d:' % size, elapsed, count / elapsed, slow / elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Time the bundled correlation rules on one large project.
+
+The objects of the project are spread over a number of networks, and
+joined through the per-join indexes of the Correlator, and with nested
+loops over every pair of objects, which is what the indexes save.
+
+usage: python benchmarks/correlate_bench.py [OBJECTS] [NETWORKS]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import fakeapi
+from gcp_audit import gcp_audit
+
+PROJECT = 'project-0000'
+
+
+def listings(count, networks):
+    """Split count objects into 30% firewalls, 40% instances, 10% CloudSQL
+    instances and 20% IAM bindings.
+    """
+    org = fakeapi.Org(firewalls=count * 3 / 10)
+
+    def network(i):
+        return u'projects/%s/global/networks/net-%d' % (PROJECT,
+                                                        i % networks)
+
+    firewalls = []
+    for i in range(count * 3 / 10):
+        obj = org.firewall(PROJECT, i)
+        obj[u'network'] = network(i)
+        firewalls.append(obj)
+
+    instances = []
+    for i in range(count * 4 / 10):
+        obj = org.vm(PROJECT, i)
+        obj[u'networkInterfaces'][0][u'network'] = network(i)
+        obj[u'serviceAccounts'][0][u'email'] = u'sa-%d@example.com' % (
+            i % 100)
+        instances.append(obj)
+
+    sql = []
+    for i in range(count / 10):
+        obj = org.sql(PROJECT, i)
+        obj[u'settings'][u'ipConfiguration'][u'privateNetwork'] = network(i)
+        sql.append(obj)
+
+    roles = [u'roles/owner', u'roles/editor', u'roles/viewer']
+    iam = [{u'kind': u'cloudresourcemanager#policyBinding',
+            u'project': PROJECT,
+            u'member': u'serviceAccount:sa-%d@example.com' % i,
+            u'role': roles[i % len(roles)]}
+           for i in range(count * 2 / 10)]
+
+    return {'firewalls': firewalls, 'instances': instances, 'cloudsql': sql,
+            'iam': iam}
+
+
+def nested_loops(correlator, listings):
+    """Join every pair of objects, like Correlator.correlate."""
+    found = set()
+    for rule, (check, match, joins) in correlator.rules:
+        for obj in listings[check]:
+            if not match(obj):
+                continue
+            for join in joins:
+                keys = set(join.keys(obj))
+                related = [other for other in listings[join.check]
+                           if join.match(other) and
+                           keys.intersection(join.related_keys(other))]
+                if bool(related) != join.exists:
+                    break
+            else:
+                found.add((id(obj), rule['name']))
+    return found
+
+
+def timed(func, *args):
+    start = time.time()
+    res = func(*args)
+    return res, time.time() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    networks = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    objects = listings(count, networks)
+    correlator = gcp_audit.get_index('correlations')
+    print '%d objects in %d networks: %s' % (
+        sum(map(len, objects.values())), networks,
+        ', '.join('%d %s' % (len(v), k) for k, v in sorted(objects.items())))
+
+    found, fast = timed(correlator.correlate, objects)
+    expected, slow = timed(nested_loops, correlator, objects)
+    pairs = set((id(obj[u'object']), rule['name'])
+                for obj, rules in found for rule in rules)
+    if pairs != expected:
+        sys.exit('indexes found %d findings, nested loops %d'
+                 % (len(pairs), len(expected)))
+
+    print 'nested loops: %7.2fs, %d findings' % (slow, len(expected))
+    print 'indexes:      %7.2fs (%.0fx)' % (fast, slow / fast)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Compare the threads and async engines against a local HTTP server.
+
+Every run is a separate process, since the async engine monkey-patches
+the standard library for good.
+
+usage: python benchmarks/engine_bench.py [PROJECTS] [BUCKETS] [LATENCY]
+"""
+
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import fakeapi
+import fakeserver
+
+RUNS = [
+    # engine, workers, max in-flight, batch size
+    ('threads', 1, 0, 100),
+    ('threads', 8, 0, 100),
+    ('threads', 32, 0, 100),
+    ('async', 32, 100, 100),
+    ('threads', 8, 0, 1),
+    ('threads', 32, 0, 1),
+    ('async', 32, 100, 1),
+    ('async', 100, 500, 1),
+]
+
+
+def child(url, engine, workers, inflight, batch_size, output):
+    """Run gcp-audit once against the server at url."""
+    from gcp_audit import gcp_audit
+
+    fakeserver.use_server(url)
+    sys.argv = ['gcp-audit', '-o', output, '-w', workers,
+                '--engine', engine, '--max-inflight', inflight,
+                '--batch-size', batch_size]
+    sys.stdout = open(os.devnull, 'w')
+
+    start = time.time()
+    gcp_audit.main()
+    sys.stderr.write('%f\n' % (time.time() - start))
+
+
+def run(url, engine, workers, inflight, batch_size):
+    fd, output = tempfile.mkstemp()
+    os.close(fd)
+    fakeserver.reset(url)
+
+    proc = subprocess.Popen([sys.executable, __file__, 'child', url, engine,
+                             str(workers), str(inflight or 1),
+                             str(batch_size), output],
+                            stderr=subprocess.PIPE)
+    _, err = proc.communicate()
+    if proc.returncode:
+        sys.exit(err)
+    elapsed = float(err.split()[-1])
+
+    with open(output) as f:
+        # timestamps differ between runs, the findings must not
+        results = re.sub(r'(?m)^.*?: Project: ', '', f.read())
+    os.remove(output)
+    return elapsed, fakeserver.requests(url), results
+
+
+def main():
+    nprojects = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    buckets = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+
+    org = fakeapi.Org(projects=nprojects, buckets=buckets)
+    server, url = fakeserver.start(org, latency)
+
+    print '%d projects with %d buckets, %.0fms per request' % \
+        (nprojects, buckets, latency * 1000)
+    print '%8s %8s %9s %6s %10s %10s' % ('engine', 'workers', 'inflight',
+                                        'batch', 'seconds', 'requests')
+
+    baseline = None
+    try:
+        for engine, workers, inflight, batch_size in RUNS:
+            elapsed, requests, results = run(url, engine, workers, inflight,
+                                             batch_size)
+            if baseline is None:
+                baseline = results
+            elif results != baseline:
+                sys.exit('results of the %s engine with %d workers differ'
+                         % (engine, workers))
+
+            print '%8s %8d %9s %6d %10.2f %10d' % (
+                engine, workers, inflight or '-', batch_size, elapsed,
+                requests)
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['child']:
+        child(*sys.argv[2:])
+    else:
+        main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""An in-process stand-in for the discovery based service objects.
+
+`create_service` can be swapped in for `gcp_audit.util.gcp.create_service`,
+so the collectors run unchanged against synthetic data, with a fixed
+latency added to every request.
+"""
+
+import threading
+import time
+import urllib
+
+
+class Org(object):
+    """A synthetic organization, shaped like the objects in filter_test.
+
+    Objects are generated on demand from their project and index, so
+    large orgs take no memory.
+    """
+
+    ZONES = [u'europe-west1-b', u'europe-west1-c', u'us-east1-b']
+
+    def __init__(self, projects=10, firewalls=5, buckets=5, instances=2,
+                 page_size=100, acls=3, uniform=0, vms=4):
+        self.projects = ['project-%04d' % i for i in range(projects)]
+        self.firewalls = firewalls
+        self.buckets = buckets
+        # Cloud SQL instances, and compute instances
+        self.instances = instances
+        self.vms = vms
+        self.page_size = page_size
+        self.acls = acls
+        # the last `uniform` buckets of each project use uniform
+        # bucket-level access
+        self.uniform = uniform
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def firewall(self, project, i):
+        obj = {u'kind': u'compute#firewall',
+               u'name': u'fw-%d' % i,
+               u'network': u'https://www.googleapis.com/compute/v1/projects/'
+                           u'%s/global/networks/default' % project,
+               u'sourceRanges': [u'0.0.0.0/0' if i % 3 == 0
+                                 else u'10.%d.0.0/16' % i],
+               u'allowed': [{u'IPProtocol': u'tcp',
+                             u'ports': [u'%d' % (22 + i), u'3306']
+                             if i % 2 else [u'1000-2000']}],
+               u'id': u'%d' % (1000 + i),
+               u'creationTimestamp': u'2017-05-03T04:47:32.052-07:00',
+               u'description': u'Synthetic firewall %d' % i,
+               u'selfLink': u'https://www.googleapis.com/compute/v1/projects/'
+                            u'%s/global/firewalls/fw-%d' % (project, i)}
+        if i % 4:
+            obj[u'targetTags'] = [u'tag-%d' % i]
+        if i % 7 == 5:
+            obj[u'allowed'] = [{u'IPProtocol': u'icmp'}]
+        if i % 11 == 10:
+            obj[u'sourceRanges'] = []
+        return obj
+
+    def bucket(self, project, i, full=False):
+        name = u'%s-b%d' % (project, i)
+        uniform = self.is_uniform(name)
+        obj = {u'kind': u'storage#bucket', u'name': name, u'id': name,
+               u'iamConfiguration': {
+                   u'uniformBucketLevelAccess': {u'enabled': uniform},
+                   u'bucketPolicyOnly': {u'enabled': uniform}}}
+        # ACLs are left out of the full projection for buckets the
+        # caller is not an OWNER of
+        if full and not uniform and i % 10 != 9:
+            obj[u'acl'] = obj[u'defaultObjectAcl'] = \
+                [self.acl(name, j) for j in range(self.acls)]
+        return obj
+
+    def is_uniform(self, bucket):
+        return int(bucket.rsplit('-b', 1)[1]) >= self.buckets - self.uniform
+
+    def policy(self, bucket):
+        i = int(bucket.rsplit('-b', 1)[1])
+        bindings = [{u'role': u'roles/storage.legacyBucketOwner',
+                     u'members': [u'projectOwner:project-owners-1']},
+                    {u'role': u'roles/storage.objectViewer',
+                     u'members': [u'allUsers']}]
+        if i % 2:
+            bindings.append({u'role': u'roles/storage.objectAdmin',
+                             u'members': [u'allUsers',
+                                          u'group:admins@example.com']})
+        return {u'kind': u'storage#policy', u'resourceId': u'projects/_/'
+                u'buckets/%s' % bucket, u'bindings': bindings,
+                u'etag': u'CAE='}
+
+    def acl(self, bucket, i):
+        return {u'kind': u'storage#bucketAccessControl', u'bucket': bucket,
+                u'entity': u'allUsers' if i % 2 else u'project-owners-1',
+                u'role': u'OWNER' if i % 5 == 0 else u'READER',
+                u'id': u'%s/%d' % (bucket, i)}
+
+    def sql(self, project, i):
+        networks = [{u'value': u'0.0.0.0/0' if i % 2 else u'1.2.3.4/32'}]
+        config = {u'ipv4Enabled': True,
+                  u'authorizedNetworks': networks if i % 3 else []}
+        # every other instance also has a private IP in the default network
+        if i % 2:
+            config[u'privateNetwork'] = u'projects/%s/global/networks/' \
+                u'default' % project
+        return {u'kind': u'sql#instance', u'name': u'sql-%d' % i,
+                u'project': project,
+                u'region': u'europe-west1',
+                u'backendType': u'SECOND_GEN',
+                u'databaseVersion': u'MYSQL_5_7',
+                u'state': u'RUNNABLE',
+                u'ipAddresses': [{u'type': u'PRIMARY',
+                                  u'ipAddress': u'10.0.%d.%d' % (i / 256,
+                                                                 i % 256)}],
+                u'settings': {
+                    u'kind': u'sql#settings',
+                    u'tier': u'db-n1-standard-1',
+                    u'dataDiskType': u'PD_HDD',
+                    u'backupConfiguration': {u'enabled': True,
+                                             u'binaryLogEnabled': True,
+                                             u'startTime': u'07:00'},
+                    u'ipConfiguration': config}}
+
+    def vm(self, project, i):
+        zone = self.ZONES[i % len(self.ZONES)]
+        prefix = u'https://www.googleapis.com/compute/v1/projects/%s/' \
+            % project
+        interface = {u'network': prefix + u'global/networks/default',
+                     u'networkIP': u'10.1.%d.%d' % (i / 256, i % 256),
+                     u'accessConfigs': []}
+        # every other instance has an external IP
+        if i % 2 == 0:
+            interface[u'accessConfigs'].append(
+                {u'type': u'ONE_TO_ONE_NAT', u'name': u'External NAT',
+                 u'natIP': u'35.0.%d.%d' % (i / 256, i % 256)})
+        return {u'kind': u'compute#instance', u'name': u'vm-%d' % i,
+                u'id': u'%d' % (5000 + i), u'status': u'RUNNING',
+                u'zone': prefix + u'zones/' + zone,
+                u'tags': {u'items': [u'tag-%d' % (i % max(self.firewalls,
+                                                          1))]},
+                u'networkInterfaces': [interface],
+                u'serviceAccounts': [{
+                    u'email': u'%s@example.com' % project,
+                    u'scopes': [u'https://www.googleapis.com/auth/'
+                                u'cloud-platform']}],
+                u'selfLink': prefix + u'zones/%s/instances/vm-%d' % (zone, i)}
+
+    def aggregate(self, instances):
+        """Group a page of instances by zone, like aggregatedList."""
+        res = dict((u'zones/%s' % zone, {u'warning': {
+            u'code': u'NO_RESULTS_ON_PAGE',
+            u'message': u'There are no results for scope on this page.'}})
+            for zone in self.ZONES)
+        for instance in instances:
+            zone = u'zones/%s' % instance[u'zone'].rsplit(u'/', 1)[1]
+            if u'instances' not in res[zone]:
+                res[zone] = {u'instances': []}
+            res[zone][u'instances'].append(instance)
+        return res
+
+    def project_policy(self, project):
+        i = self.projects.index(project) if project in self.projects else 0
+        bindings = [{u'role': u'roles/owner',
+                     u'members': [u'user:owner@example.com']}]
+        if i % 3 == 0:
+            bindings.append({u'role': u'roles/editor',
+                             u'members': [u'domain:example.com',
+                                          u'group:devs@example.com']})
+        if i % 5 == 0:
+            bindings.append({u'role': u'roles/viewer',
+                             u'members': [u'allAuthenticatedUsers']})
+        if i % 2 == 0:
+            # the account the instances run as
+            bindings.append({u'role': u'roles/editor',
+                             u'members': [u'serviceAccount:%s@example.com'
+                                          % project]})
+        return {u'version': 1, u'etag': u'BwE=', u'bindings': bindings}
+
+    def items(self, method, params):
+        project = params.get('project')
+        bucket = params.get('bucket')
+
+        if method == 'firewalls.list':
+            return [self.firewall(project, i) for i in range(self.firewalls)]
+        elif method == 'buckets.list':
+            full = params.get('projection') == 'full'
+            return [self.bucket(project, i, full)
+                    for i in range(self.buckets)]
+        elif method in ('bucketAccessControls.list',
+                        'defaultObjectAccessControls.list'):
+            if self.is_uniform(bucket):
+                # the API answers with an error, see fakeserver
+                return []
+            return [self.acl(bucket, i) for i in range(self.acls)]
+        elif method == 'instances.list':
+            return [self.sql(project, i) for i in range(self.instances)]
+        elif method == 'instances.aggregatedList':
+            return [self.vm(project, i) for i in range(self.vms)]
+        raise ValueError(method)
+
+
+class Request(object):
+
+    def __init__(self, service, method, params):
+        self.service = service
+        self.method = method
+        self.params = params
+        self.methodId = method
+        self.uri = 'fake:///%s?%s' % (method,
+                                      urllib.urlencode(sorted(params.items())))
+
+    def execute(self):
+        org = self.service.org
+        with org.lock:
+            org.requests += 1
+        time.sleep(self.service.latency)
+
+        if self.method == 'buckets.getIamPolicy':
+            return org.policy(self.params['bucket'])
+        if self.method == 'projects.getIamPolicy':
+            return org.project_policy(self.params['resource'])
+        items = org.items(self.method, self.params)
+        start = int(self.params.get('pageToken') or 0)
+        resp = {'items': items[start:start + org.page_size]}
+        if self.method.endswith('.aggregatedList'):
+            resp['items'] = org.aggregate(resp['items'])
+        if start + org.page_size < len(items):
+            resp['nextPageToken'] = str(start + org.page_size)
+        return resp
+
+
+class Batch(object):
+
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        org = self.service.org
+        with org.lock:
+            org.requests += 1
+        time.sleep(self.service.latency)
+        for request_id, request in self.requests:
+            if request.method == 'buckets.getIamPolicy':
+                resp = org.policy(request.params['bucket'])
+            else:
+                resp = {'items': org.items(request.method, request.params)}
+            self.callback(request_id, resp, None)
+
+
+class Collection(object):
+
+    def __init__(self, service, name):
+        self.service = service
+        self.name = name
+
+    def list(self, **params):
+        return Request(self.service, '%s.list' % self.name, params)
+
+    def getIamPolicy(self, **params):
+        return Request(self.service, '%s.getIamPolicy' % self.name, params)
+
+    def aggregatedList(self, **params):
+        return Request(self.service, '%s.aggregatedList' % self.name, params)
+
+    def list_next(self, previous_request, previous_response):
+        if 'nextPageToken' not in previous_response:
+            return None
+        params = dict(previous_request.params,
+                      pageToken=previous_response['nextPageToken'])
+        return Request(self.service, previous_request.method, params)
+
+    aggregatedList_next = list_next
+
+
+class Service(object):
+
+    def __init__(self, org, latency):
+        self.org = org
+        self.latency = latency
+
+    def new_batch_http_request(self, callback=None):
+        return Batch(self, callback)
+
+    def __getattr__(self, name):
+        return lambda: Collection(self, name)
+
+
+def service_factory(org, latency=0.01):
+    def create_service(service, version='v1'):
+        return Service(org, latency)
+    return create_service
@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""A local HTTP server speaking just enough of the Google APIs.
+
+It serves discovery documents for the APIs gcp-audit uses, whose rootUrl
+points back at the server, and answers their list and batch requests
+with the synthetic data of a fakeapi.Org. Unlike fakeapi, requests go
+through googleapiclient, httplib2 and real sockets, so the server can be
+used to measure the I/O side of gcp-audit.
+
+Every request is delayed by a fixed latency, and a share of them can be
+answered with errors, to exercise the retries.
+
+The server runs in a child process; see start().
+"""
+
+import BaseHTTPServer
+import SocketServer
+import json
+import multiprocessing
+import random
+import re
+import threading
+import time
+import urllib
+import urlparse
+
+from email.parser import Parser
+
+# (service, version): (servicePath, {collection: (path, parameters)})
+APIS = {
+    ('compute', 'v1'): ('compute/v1/projects/', {
+        'firewalls': ('{project}/global/firewalls', ['project']),
+        'instances': ('{project}/zones/{zone}/instances',
+                      ['project', 'zone']),
+    }),
+    ('storage', 'v1'): ('storage/v1/', {
+        'buckets': ('b', ['project']),
+        'bucketAccessControls': ('b/{bucket}/acl', ['bucket']),
+        'defaultObjectAccessControls': ('b/{bucket}/defaultObjectAcl',
+                                        ['bucket']),
+    }),
+    ('sqladmin', 'v1beta4'): ('sql/v1beta4/', {
+        'instances': ('projects/{project}/instances', ['project']),
+    }),
+    ('cloudresourcemanager', 'v1beta1'): ('v1beta1/', {
+        'projects': ('projects', []),
+    }),
+}
+
+# optional query parameters of list methods, by collection
+OPTIONAL = {
+    'buckets': ['projection'],
+}
+
+# (service, version, collection): {method: (HTTP method, path,
+# parameters)}, for the methods besides list
+METHODS = {
+    ('storage', 'v1', 'buckets'): {
+        'getIamPolicy': ('GET', 'b/{bucket}/iam', ['bucket']),
+    },
+    ('compute', 'v1', 'instances'): {
+        'aggregatedList': ('GET', '{project}/aggregated/instances',
+                           ['project']),
+    },
+    ('cloudresourcemanager', 'v1beta1', 'projects'): {
+        'getIamPolicy': ('POST', 'projects/{resource}:getIamPolicy',
+                         ['resource']),
+    },
+}
+
+# methods besides list that are paginated
+PAGED = ('aggregatedList',)
+
+PAGE_PARAMETERS = {
+    'pageToken': {'type': 'string', 'location': 'query'},
+    'maxResults': {'type': 'integer', 'location': 'query'},
+    'pageSize': {'type': 'integer', 'location': 'query'},
+}
+
+
+class Anonymous(object):
+    """Credentials that leave requests to the server unauthenticated."""
+
+    def authorize(self, http):
+        return http
+
+
+def use_server(url):
+    """Point gcp-audit at the server at url, in this process."""
+    from gcp_audit.util import gcp
+
+    gcp.get_credentials = lambda: (None, Anonymous())
+    # googleapiclient fetches discovery documents from googleapis.com
+    for service, version in APIS:
+        gcp._documents[(service, version)] = json.load(urllib.urlopen(
+            '%sdiscovery/v1/apis/%s/%s/rest' % (url, service, version)))
+
+
+def discovery_document(root, service, version):
+    service_path, collections = APIS[(service, version)]
+    resources = {}
+    schemas = {}
+
+    for collection, (path, required) in collections.items():
+        parameters = dict(PAGE_PARAMETERS)
+        parameters.update(_parameters(path, required))
+        for param in OPTIONAL.get(collection, []):
+            parameters[param] = {'type': 'string', 'location': 'query'}
+
+        schema = '%sList' % collection
+        schemas[schema] = {'id': schema, 'type': 'object', 'properties': {
+            'items': {'type': 'array', 'items': {'type': 'object'}},
+            'nextPageToken': {'type': 'string'},
+        }}
+        methods = {'list': {
+            'id': '%s.%s.list' % (service, collection),
+            'path': path,
+            'httpMethod': 'GET',
+            'parameters': parameters,
+            'parameterOrder': required,
+            'response': {'$ref': schema},
+        }}
+        resources[collection] = {'methods': methods}
+
+        others = METHODS.get((service, version, collection), {})
+        for method, (http_method, path, required) in others.items():
+            parameters = _parameters(path, required)
+            desc = methods[method] = {
+                'id': '%s.%s.%s' % (service, collection, method),
+                'path': path,
+                'httpMethod': http_method,
+                'parameters': parameters,
+                'parameterOrder': required,
+                'response': {'$ref': 'Object'},
+            }
+            if method in PAGED:
+                parameters.update(PAGE_PARAMETERS)
+                desc['response'] = {'$ref': schema}
+            if http_method == 'POST':
+                desc['request'] = {'$ref': 'Object'}
+        if others:
+            schemas['Object'] = {'id': 'Object', 'type': 'object'}
+
+    return {
+        'kind': 'discovery#restDescription',
+        'discoveryVersion': 'v1',
+        'id': '%s:%s' % (service, version),
+        'name': service,
+        'version': version,
+        'protocol': 'rest',
+        'rootUrl': root,
+        'servicePath': service_path,
+        'batchPath': 'batch',
+        'parameters': {},
+        'schemas': schemas,
+        'resources': resources,
+    }
+
+
+def _parameters(path, required):
+    res = {}
+    for param in required:
+        location = 'path' if '{%s}' % param in path else 'query'
+        res[param] = {'type': 'string', 'required': True,
+                      'location': location}
+    return res
+
+
+def routes():
+    """Compile the paths of all methods to regular expressions."""
+    res = []
+    for (service, version), (service_path, collections) in APIS.items():
+        for collection, (path, _) in collections.items():
+            methods = [('list', path)] + [
+                (method, p) for method, (_, p, _)
+                in METHODS.get((service, version, collection), {}).items()]
+            for method, p in methods:
+                pattern = re.sub(r'\\{(\w+)\\}', r'(?P<\1>[^/]+)',
+                                 re.escape('/' + service_path + p))
+                res.append((re.compile(pattern + '$'),
+                            '%s.%s' % (collection, method)))
+    return res
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # keep-alive, so that clients can reuse their connections
+    protocol_version = 'HTTP/1.1'
+    # send each response in one packet
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, code, body, content_type='application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse.urlparse(self.path)
+
+        match = re.match(r'/discovery/v1/apis/(\w+)/(\w+)/rest$', url.path)
+        if match:
+            root = 'http://%s:%d/' % server.server_address
+            doc = discovery_document(root, *match.groups())
+            return self.send(200, json.dumps(doc))
+
+        if url.path == '/stats':
+            return self.send(200, json.dumps({'requests':
+                                              server.requests.value}))
+
+        server.count()
+        time.sleep(server.latency)
+        if server.fail():
+            return self.send(*server.error())
+        code, body = server.list(self.path)
+        self.send(code, body)
+
+    def do_POST(self):
+        server = self.server
+        if self.path == '/stats':
+            server.requests.value = 0
+            return self.send(200, '{}')
+
+        server.count()
+        time.sleep(server.latency)
+        if server.fail():
+            return self.send(*server.error())
+
+        if not self.path.endswith('/batch'):
+            self.rfile.read(int(self.headers.getheader('Content-Length')
+                                or 0))
+            return self.send(*server.list(self.path))
+
+        length = int(self.headers.getheader('Content-Length'))
+        message = Parser().parsestr('Content-Type: %s\r\n\r\n%s' % (
+            self.headers.getheader('Content-Type'),
+            self.rfile.read(length)))
+
+        boundary = 'batch_boundary'
+        parts = []
+        for part in message.get_payload():
+            path = part.get_payload().split('\n', 1)[0].split(' ')[1]
+            code, body = server.error() if server.fail() \
+                else server.list(path)
+            parts.append('--%s\r\nContent-Type: application/http\r\n'
+                         'Content-ID: <response-%s>\r\n\r\n'
+                         'HTTP/1.1 %d OK\r\n'
+                         'Content-Type: application/json\r\n'
+                         'Content-Length: %d\r\n\r\n%s\r\n' %
+                         (boundary, part['Content-ID'][1:-1], code,
+                          len(body), body))
+        parts.append('--%s--\r\n' % boundary)
+
+        self.send(200, ''.join(parts),
+                  'multipart/mixed; boundary=%s' % boundary)
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, org, latency, requests, errors=0.0, port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port),
+                                           Handler)
+        self.org = org
+        self.latency = latency
+        self.requests = requests
+        self.errors = errors
+        self.routes = routes()
+        # the same requests fail on every run
+        self.random = random.Random(0)
+        self.lock = threading.Lock()
+
+    def count(self):
+        with self.requests.get_lock():
+            self.requests.value += 1
+
+    def fail(self):
+        """Whether to answer the next request with an error."""
+        if not self.errors:
+            return False
+        with self.lock:
+            return self.random.random() < self.errors
+
+    def error(self):
+        return 503, json.dumps({'error': {'code': 503,
+                                          'message': 'Backend Error'}})
+
+    def list(self, path):
+        url = urlparse.urlparse(path)
+        params = dict(urlparse.parse_qsl(url.query))
+
+        for pattern, method in self.routes:
+            match = pattern.match(url.path)
+            if match:
+                break
+        else:
+            return 404, json.dumps({'error': {'code': 404,
+                                              'message': 'Not Found'}})
+
+        params.update((k, urllib.unquote(v))
+                      for k, v in match.groupdict().items())
+        if method == 'buckets.getIamPolicy':
+            return 200, json.dumps(self.org.policy(params['bucket']))
+        if method == 'projects.getIamPolicy':
+            return 200, json.dumps(self.org.project_policy(
+                params['resource']))
+        if method.endswith('AccessControls.list') and \
+                self.org.is_uniform(params['bucket']):
+            return 400, json.dumps({'error': {
+                'code': 400,
+                'message': 'Cannot get legacy ACL for a bucket that has '
+                           'uniform bucket-level access.'}})
+        if method == 'projects.list':
+            key = 'projects'
+            items = [{u'projectId': p} for p in self.org.projects]
+        else:
+            key = 'items'
+            items = self.org.items(method, params)
+
+        start = int(params.get('pageToken') or 0)
+        resp = {key: items[start:start + self.org.page_size]}
+        if method.endswith('.aggregatedList'):
+            resp[key] = self.org.aggregate(resp[key])
+        if start + self.org.page_size < len(items):
+            resp['nextPageToken'] = str(start + self.org.page_size)
+        return 200, json.dumps(resp)
+
+
+def _serve(org, latency, requests, errors, ready):
+    server = Server(org, latency, requests, errors)
+    ready.send(server.server_address[1])
+    server.serve_forever()
+
+
+def start(org, latency=0.01, errors=0.0):
+    """Start a server for `org` in a child process.
+
+    A share `errors` of the requests, and of the parts of batch requests,
+    fail with 503. Returns (process, url), where url is the root of the
+    server.
+    """
+    requests = multiprocessing.Value('i', 0)
+    ready, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_serve,
+                                      args=(org, latency, requests, errors,
+                                            child))
+    process.daemon = True
+    process.start()
+    return process, 'http://127.0.0.1:%d/' % ready.recv()
+
+
+def requests(url):
+    """Return the number of API requests served so far."""
+    return json.load(urllib.urlopen(url + 'stats'))['requests']
+
+
+def reset(url):
+    urllib.urlopen(url + 'stats', '').read()
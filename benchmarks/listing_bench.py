@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Compare parsing a whole listing page with streaming its items.
+
+A synthetic page of firewalls is written to a temporary file, like a
+cached response, and read in a child process by each method, so that
+every method gets a peak RSS of its own. Parsing the whole page takes
+about ten times its size in memory, so mind the size you ask for.
+
+usage: python benchmarks/listing_bench.py [MEGABYTES]
+"""
+
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import fakeapi
+from gcp_audit.util import jsonstream
+
+
+def whole(path):
+    with open(path, 'rb') as f:
+        return json.load(f).get('items', [])
+
+
+def streamed(path):
+    with open(path, 'rb') as f:
+        for item in jsonstream.iter_items(f):
+            yield item
+
+
+METHODS = [('whole page', whole), ('streamed', streamed)]
+
+
+def child(method, path):
+    func = dict(METHODS)[method]
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.time()
+    count = 0
+    for item in func(path):
+        count += 1
+    elapsed = time.time() - start
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print count, elapsed, (rss - before) / 1024.0
+
+
+def write_page(path, megabytes):
+    org = fakeapi.Org()
+    with open(path, 'wb') as f:
+        f.write('{"kind": "compute#firewallList", "items": [')
+        i = 0
+        while f.tell() < megabytes << 20:
+            if i:
+                f.write(', ')
+            json.dump(org.firewall('project-%04d' % (i / 1000), i % 1000), f)
+            i += 1
+        f.write('], "nextPageToken": "token"}')
+
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+
+    try:
+        write_page(path, megabytes)
+        print '%d MB listing' % (os.path.getsize(path) >> 20)
+        print '%-12s %9s %9s %12s %9s' % ('method', 'items', 'seconds',
+                                          'items/s', 'RSS MB')
+        for method, _ in METHODS:
+            out = subprocess.check_output([sys.executable, __file__, 'child',
+                                           method, path])
+            count, elapsed, rss = out.split()
+            print '%-12s %9s %9.2f %12.0f %9.1f' % (
+                method, count, float(elapsed), int(count) / float(elapsed),
+                float(rss))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['child']:
+        child(*sys.argv[2:])
+    else:
+        main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Compare rule evaluation with and without the rule memo on firewalls.
+
+The firewalls of an org tend to be copies of each other that differ in
+their name, id and selfLink. The memo is measured on such copies, with
+the bundled rules and with a few hundred synthetic rules on top of them,
+and on firewalls that all differ in the keys the rules read, which is
+its worst case.
+
+usage: python benchmarks/memo_bench.py [OBJECTS] [DISTINCT] [EXTRA_RULES]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import fakeapi
+from gcp_audit import gcp_audit
+from gcp_audit.util.memo import RuleMemo
+from gcp_audit.util.ruleindex import RuleIndex
+
+
+def evaluate(index, objects):
+    return sum(len(gcp_audit.match_object(index, obj)) for obj in objects)
+
+
+def timed(func, *args):
+    start = time.time()
+    res = func(*args)
+    return res, time.time() - start
+
+
+def compare(title, rules, objects):
+    expected, slow = timed(evaluate, RuleIndex(rules), objects)
+    memo = RuleMemo(RuleIndex(rules), 'firewalls')
+    found, fast = timed(evaluate, memo, objects)
+    if found != expected:
+        sys.exit('memoized rules found %d matches, plain %d'
+                 % (found, expected))
+
+    print title
+    print 'plain:       %6.2fs %9.0f objects/s, %d matches' % (
+        slow, len(objects) / slow, found)
+    print 'memoized:    %6.2fs %9.0f objects/s (%.1fx), %d results kept' % (
+        fast, len(objects) / fast, slow / fast,
+        len(memo.recent) + len(memo.old))
+    print
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    distinct = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    extra = int(sys.argv[3]) if len(sys.argv) > 3 else 300
+
+    org = fakeapi.Org()
+    objects = [org.firewall('project-%04d' % (i / distinct), i % distinct)
+               for i in range(count)]
+    rules = gcp_audit.get_rules('firewalls')
+    synthetic = [(rule, gcp_audit.compile_rule(rule))
+                 for rule in synthetic_rules(extra)]
+
+    compare('%d firewalls, %d rules' % (count, len(rules)), rules, objects)
+    compare('%d firewalls, %d rules' % (count / 10, len(rules + synthetic)),
+            rules + synthetic, objects[:count / 10])
+
+    for i, obj in enumerate(objects):
+        obj['sourceRanges'] = ['10.%d.%d.0/24' % (i >> 8 & 255, i & 255),
+                               '0.0.0.0/0']
+    compare('%d distinct firewalls, %d rules' % (count, len(rules)), rules,
+            objects)
+
+
+def synthetic_rules(count):
+    rules = []
+    for i in range(count):
+        f = {'allowed': [{'IPProtocol': 'tcp', 'ports': '%d' % (1000 + i)}]}
+        if i % 2:
+            f = {'description': '.*team %d$' % i}
+        rules.append({'name': 'synthetic %d' % i,
+                      'filters': [{'matchtype': 'regex', 'filter': f}]})
+    return rules
+
+
+if __name__ == '__main__':
+    main()
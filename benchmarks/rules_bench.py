@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Compare interpreted, compiled and indexed rule evaluation on firewalls.
+
+The indexed run is repeated with a few hundred synthetic rules on top of
+the bundled ones, most of which can be ruled out from the object's keys
+and exact values alone.
+
+usage: python benchmarks/rules_bench.py [OBJECTS] [EXTRA_RULES]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import fakeapi
+from gcp_audit import gcp_audit
+from gcp_audit.util.ruleindex import RuleIndex
+
+
+def interpreted(rules, objects):
+    matches = 0
+    for obj in objects:
+        for rule in rules:
+            if gcp_audit.apply_rule_filters(obj, rule['filters'],
+                                            rule.get('filtercondition',
+                                                     'and')):
+                matches += 1
+    return matches
+
+
+def compiled(rules, objects):
+    matches = 0
+    for obj in objects:
+        for rule, match in rules:
+            if match(obj):
+                matches += 1
+    return matches
+
+
+def indexed(index, objects):
+    matches = 0
+    for obj in objects:
+        for rule, match in index.candidates(obj):
+            if match(obj):
+                matches += 1
+    return matches
+
+
+def synthetic_rules(count):
+    rules = []
+    for i in range(count):
+        if i % 2:
+            f = {'name': 'fw-%d' % i,
+                 'allowed': [{'IPProtocol': 'tcp', 'ports': '22'}]}
+        else:
+            f = {'description': 'managed by team %d' % i}
+        rules.append({'name': 'synthetic %d' % i,
+                      'filters': [{'matchtype': 'exact', 'filter': f}]})
+    return rules
+
+
+def timed(func, *args):
+    start = time.time()
+    res = func(*args)
+    return res, time.time() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    org = fakeapi.Org()
+    objects = [org.firewall('project-0000', i % 1000) for i in range(count)]
+
+    expected, slow = timed(interpreted, gcp_audit.loadrules('firewalls'),
+                           objects)
+    found, fast = timed(compiled, gcp_audit.get_rules('firewalls'), objects)
+    if found != expected:
+        sys.exit('compiled rules found %d matches, interpreted %d'
+                 % (found, expected))
+
+    print '%d firewalls, %d matches' % (count, found)
+    print 'interpreted: %6.2fs %9.0f objects/s' % (slow, count / slow)
+    print 'compiled:    %6.2fs %9.0f objects/s (%.1fx)' % (fast, count / fast,
+                                                          slow / fast)
+
+    found, elapsed = timed(indexed, gcp_audit.get_index('firewalls'),
+                           objects)
+    print 'indexed:     %6.2fs %9.0f objects/s (%.1fx)' % (
+        elapsed, count / elapsed, slow / elapsed)
+
+    extra = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    rules = gcp_audit.get_rules('firewalls') + \
+        [(rule, gcp_audit.compile_rule(rule))
+         for rule in synthetic_rules(extra)]
+    objects = objects[:count / 10]
+
+    print
+    print '%d firewalls, %d rules' % (len(objects), len(rules))
+    expected, slow = timed(compiled, rules, objects)
+    found, fast = timed(indexed, RuleIndex(rules), objects)
+    if found != expected:
+        sys.exit('indexed rules found %d matches, compiled %d'
+                 % (found, expected))
+    print 'compiled:    %6.2fs %9.0f objects/s' % (slow, len(objects) / slow)
+    print 'indexed:     %6.2fs %9.0f objects/s (%.1fx)' % (
+        fast, len(objects) / fast, slow / fast)
+
+
+if __name__ == '__main__':
+    main()
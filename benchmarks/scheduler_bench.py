@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Measure how main() scales with --workers against the fake API.
+
+usage: python benchmarks/scheduler_bench.py [PROJECTS] [LATENCY]
+"""
+
+import os
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import fakeapi
+from gcp_audit import gcp_audit
+from gcp_audit.util import gcp
+
+
+def run(projects, workers):
+    fd, output = tempfile.mkstemp()
+    os.close(fd)
+    argv, stdout = sys.argv, sys.stdout
+    sys.argv = ['gcp-audit', '-o', output, '-w', str(workers),
+                '-p', ','.join(projects)]
+    sys.stdout = open(os.devnull, 'w')
+
+    gcp.forget_listings()
+    start = time.time()
+    try:
+        gcp_audit.main()
+    finally:
+        sys.argv, sys.stdout = argv, stdout
+    elapsed = time.time() - start
+
+    with open(output) as f:
+        # timestamps differ between runs, the findings must not
+        results = re.sub(r'(?m)^.*?: Project: ', '', f.read())
+    os.remove(output)
+    return elapsed, results
+
+
+def main():
+    nprojects = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+
+    org = fakeapi.Org(projects=nprojects)
+    gcp.create_service = fakeapi.service_factory(org, latency)
+
+    print '%d projects, %.0fms per request' % (nprojects, latency * 1000)
+    print '%8s %10s %8s %10s' % ('workers', 'seconds', 'speedup', 'requests')
+
+    baseline = None
+    for workers in (1, 2, 4, 8, 16, 32):
+        org.requests = 0
+        elapsed, results = run(org.projects, workers)
+        if baseline is None:
+            baseline = (elapsed, results)
+        elif results != baseline[1]:
+            sys.exit('results with %d workers differ from serial run'
+                     % workers)
+        print '%8d %10.2f %7.1fx %10d' % (workers, elapsed,
+                                          baseline[0] / elapsed,
+                                          org.requests)
+
+
+if __name__ == '__main__':
+    main()
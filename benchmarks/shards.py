@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Audit a fake org in shards, merge them, and compare with a single run.
+
+Every shard runs in a process of its own, like it would on a machine of
+its own, against one fakeserver. The merged report must hold the same
+findings as a run over the whole org.
+
+usage: python benchmarks/shards.py [-n SHARDS] [--projects N]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import fakeapi
+import fakeserver
+
+
+def child(url, *args):
+    from gcp_audit import gcp_audit
+
+    if url != '-':
+        fakeserver.use_server(url)
+    sys.argv = ['gcp-audit'] + list(args)
+    sys.stdout = open(os.devnull, 'w')
+    gcp_audit.main()
+
+
+def spawn(url, *args):
+    return subprocess.Popen([sys.executable, __file__, 'child', url] +
+                            list(args))
+
+
+def wait(*procs):
+    for proc in procs:
+        if proc.wait():
+            sys.exit('gcp-audit failed')
+
+
+def findings(path):
+    with open(path) as f:
+        res = [json.loads(line) for line in f]
+    return sorted(json.dumps(dict(finding, time=None), sort_keys=True)
+                  for finding in res)
+
+
+def api_calls(path):
+    with open(path) as f:
+        return sum(entry['count'] for entry in json.load(f)['api'])
+
+
+def parse_options():
+    parser = argparse.ArgumentParser(description='Check that sharded runs \
+                                                  of gcp-audit add up')
+    parser.add_argument('-n', '--shards', type=int, default=4)
+    parser.add_argument('--projects', type=int, default=40)
+    return parser.parse_args()
+
+
+def main():
+    options = parse_options()
+    org = fakeapi.Org(projects=options.projects, buckets=20, firewalls=20)
+    server, url = fakeserver.start(org, latency=0.01)
+    tmp = tempfile.mkdtemp()
+    audit = ['-f', 'jsonl', '-w', '4']
+
+    try:
+        single = os.path.join(tmp, 'single.jsonl')
+        start = time.time()
+        wait(spawn(url, '-o', single, *audit))
+        print '%-8s %8.2fs' % ('single', time.time() - start)
+
+        outputs = [os.path.join(tmp, '%d.jsonl' % i)
+                   for i in range(options.shards)]
+        stats = [os.path.join(tmp, '%d.metrics.json' % i)
+                 for i in range(options.shards)]
+        start = time.time()
+        wait(*[spawn(url, '-o', outputs[i], '--metrics-out', stats[i],
+                     '--shard', '%d/%d' % (i, options.shards), *audit)
+               for i in range(options.shards)])
+        print '%-8s %8.2fs  (%d shards in parallel)' % (
+            'sharded', time.time() - start, options.shards)
+        for i, path in enumerate(stats):
+            print '  shard %d: %4d findings %5d API calls' % (
+                i, len(findings(outputs[i])), api_calls(path))
+
+        merged = os.path.join(tmp, 'merged.jsonl')
+        wait(spawn('-', 'merge', '-o', merged,
+                   *outputs + ['--metrics'] + stats))
+
+        expected, got = findings(single), findings(merged)
+        print '%d findings in the single run, %d merged' % (len(expected),
+                                                          len(got))
+        if expected != got:
+            sys.exit('the merged findings differ from the single run')
+    finally:
+        shutil.rmtree(tmp)
+        server.terminate()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['child']:
+        child(*sys.argv[2:])
+    else:
+        main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Run end-to-end scenarios against a local fake of the Google APIs.
+
+Every scenario serves a synthetic org from fakeserver, runs main() in a
+child process, and reports its wall time, the API requests it made, its
+peak RSS and the number of findings. Results can be saved, and later
+runs compared against them to catch regressions.
+
+usage: python benchmarks/suite.py [-s SCENARIO]... [--save FILE]
+                                  [--compare FILE] [--tolerance FRACTION]
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import fakeapi
+import fakeserver
+
+SCENARIOS = [
+    # name, org, latency, share of failed requests, gcp-audit arguments
+    ('small', {}, 0.01, 0, []),
+    ('paginated', dict(projects=20, firewalls=250, instances=20,
+                       page_size=50), 0.01, 0, ['-w', '8']),
+    ('memo', dict(projects=20, firewalls=250, instances=20, page_size=50),
+     0.01, 0, ['-w', '8', '--memo-size', '10000']),
+    ('buckets', dict(projects=20, buckets=100, acls=10), 0.02, 0,
+     ['-w', '8']),
+    ('unbatched', dict(projects=10, buckets=50), 0.02, 0,
+     ['-w', '8', '--batch-size', '1']),
+    # a quarter of the buckets use uniform bucket-level access
+    ('acl-lookups', dict(projects=10, buckets=40, uniform=10), 0.02, 0,
+     ['-w', '8', '--batch-size', '1']),
+    ('inline-acls', dict(projects=10, buckets=40, uniform=10), 0.02, 0,
+     ['-w', '8', '--batch-size', '1', '--inline-acls']),
+    ('errors', dict(projects=20, buckets=20), 0.01, 0.05, ['-w', '8']),
+    # only the categories the correlation rules join are listed
+    ('correlations', dict(projects=20, firewalls=250, instances=20, vms=100,
+                          page_size=50), 0.01, 0,
+     ['-w', '8', '-c', 'correlations']),
+    ('large-org', dict(projects=500, firewalls=20, buckets=2, instances=1),
+     0.005, 0, ['-w', '32']),
+    ('async', dict(projects=20, buckets=100), 0.05, 0,
+     ['-w', '32', '--engine', 'async', '--batch-size', '1']),
+]
+
+# figures that may not grow by more than the tolerance
+FIGURES = ('seconds', 'requests', 'rss_mb')
+
+
+def child(url, output, *args):
+    from gcp_audit import gcp_audit
+
+    fakeserver.use_server(url)
+    # the same backoff delays on every run
+    random.seed(0)
+    sys.argv = ['gcp-audit', '-o', output, '-f', 'jsonl'] + list(args)
+    sys.stdout = open(os.devnull, 'w')
+
+    start = time.time()
+    gcp_audit.main()
+    elapsed = time.time() - start
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    sys.stderr.write('%f %d\n' % (elapsed, rss))
+
+
+def run(name, org, latency, errors, args):
+    server, url = fakeserver.start(fakeapi.Org(**org), latency, errors)
+    fd, output = tempfile.mkstemp()
+    os.close(fd)
+
+    try:
+        proc = subprocess.Popen([sys.executable, __file__, 'child', url,
+                                 output] + args, stderr=subprocess.PIPE)
+        _, err = proc.communicate()
+        if proc.returncode:
+            sys.exit('scenario %s failed:\n%s' % (name, err))
+        elapsed, rss = err.split()[-2:]
+
+        with open(output) as f:
+            findings = sum(1 for _ in f)
+        return {'seconds': float(elapsed),
+                'requests': fakeserver.requests(url),
+                'rss_mb': int(rss) / 1024.0,
+                'findings': findings}
+    finally:
+        os.remove(output)
+        server.terminate()
+
+
+def regressions(name, result, baseline, tolerance):
+    res = []
+    for figure in FIGURES:
+        if result[figure] > baseline[figure] * (1 + tolerance):
+            res.append('%s: %s went from %.4g to %.4g' % (
+                name, figure, baseline[figure], result[figure]))
+    if result['findings'] != baseline['findings']:
+        res.append('%s: %d findings instead of %d' % (
+            name, result['findings'], baseline['findings']))
+    return res
+
+
+def parse_options():
+    parser = argparse.ArgumentParser(description='End-to-end benchmarks of \
+                                                  gcp-audit')
+    parser.add_argument('-s', '--scenario', action='append',
+                        choices=[s[0] for s in SCENARIOS],
+                        help='scenario to run, all by default')
+    parser.add_argument('--save', help='write the results to this file')
+    parser.add_argument('--compare',
+                        help='compare the results with a saved file, and \
+                              exit with 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='share a figure may grow by before it counts \
+                              as a regression')
+    return parser.parse_args()
+
+
+def main():
+    options = parse_options()
+    baseline = {}
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+
+    try:
+        import gevent
+    except ImportError:
+        gevent = None
+
+    print '%-12s %9s %9s %9s %9s' % ('scenario', 'seconds', 'requests',
+                                     'peak MB', 'findings')
+    results = {}
+    failed = []
+    for name, org, latency, errors, args in SCENARIOS:
+        if options.scenario and name not in options.scenario:
+            continue
+        if '--engine' in args and gevent is None:
+            print '%-12s skipped, requires gevent' % name
+            continue
+
+        result = results[name] = run(name, org, latency, errors, args)
+        print '%-12s %9.2f %9d %9.1f %9d' % (
+            name, result['seconds'], result['requests'], result['rss_mb'],
+            result['findings'])
+        if name in baseline:
+            failed.extend(regressions(name, result, baseline[name],
+                                      options.tolerance))
+
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if failed:
+        print
+        print 'Regressions:'
+        for line in failed:
+            print '  %s' % line
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['child']:
+        child(*sys.argv[2:])
+    else:
+        main()
@@ -0,0 +1,113 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from util import assets
+from util.firewalls import FirewallIndex
+
+NETWORK = 'https://www.googleapis.com/compute/v1/projects/p1/global/' \
+    'networks/default'
+
+EXPORT = [
+    {'name': '//compute.googleapis.com/projects/p1/global/firewalls/fw',
+     'asset_type': 'compute.googleapis.com/Firewall',
+     'resource': {'data': {
+         'name': 'fw', 'selfLink': 'https://www.googleapis.com/compute/v1/'
+                                   'projects/p1/global/firewalls/fw'}}},
+    {'name': '//storage.googleapis.com/b1',
+     'asset_type': 'storage.googleapis.com/Bucket',
+     'ancestors': ['projects/123', 'organizations/1'],
+     'resource': {'data': {
+         'name': 'b1',
+         'acl': [{'entity': 'allUsers', 'role': 'READER'}],
+         'defaultObjectAcl': [{'entity': 'project-owners-123',
+                               'role': 'OWNER'}]}}},
+    {'name': '//sqladmin.googleapis.com/projects/p2/instances/db',
+     'assetType': 'sqladmin.googleapis.com/Instance',
+     'resource': {'data': {'name': 'db', 'project': 'p2'}}},
+    {'name': '//compute.googleapis.com/projects/p1/zones/z/disks/d',
+     'asset_type': 'compute.googleapis.com/Disk',
+     'resource': {'data': {'name': 'd'}}},
+    {'name': '//cloudresourcemanager.googleapis.com/projects/123',
+     'asset_type': 'cloudresourcemanager.googleapis.com/Project',
+     'resource': {'data': {'projectNumber': '123', 'projectId': 'p3'}}},
+    {'name': '//compute.googleapis.com/projects/p1/zones/z/instances/vm',
+     'asset_type': 'compute.googleapis.com/Instance',
+     'resource': {'data': {
+         'name': 'vm', 'networkInterfaces': [{'network': NETWORK}],
+         'selfLink': 'https://www.googleapis.com/compute/v1/projects/p1/'
+                     'zones/z/instances/vm'}}},
+    # from an export of IAM policies
+    {'name': '//cloudresourcemanager.googleapis.com/projects/123',
+     'asset_type': 'cloudresourcemanager.googleapis.com/Project',
+     'iam_policy': {'bindings': [{'role': 'roles/owner',
+                                  'members': ['user:a']}]}},
+]
+
+
+class TestAssets(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, opener=open):
+        path = os.path.join(self.dir, name)
+        f = opener(path, 'wb')
+        for asset in EXPORT:
+            f.write(json.dumps(asset) + '\n\n')
+        f.close()
+        return path
+
+    def test_routing(self):
+        objects = list(assets.read_objects(self.write('export.json')))
+
+        self.assertEqual([(project, check, obj.get('name') or
+                           obj.get('entity') or obj['member'])
+                          for project, check, obj in objects],
+                         [('p1', 'firewalls', 'fw'),
+                          ('123', 'buckets', 'allUsers'),
+                          ('123', 'bucket_objects', 'project-owners-123'),
+                          ('p2', 'cloudsql', 'db'),
+                          ('p1', 'instances', 'vm'),
+                          ('123', 'iam', 'user:a')])
+        self.assertEqual(objects[1][2]['bucket'], 'b1')
+        self.assertNotIn('firewalls', objects[4][2])
+
+    def test_project_ids_and_firewalls(self):
+        path = self.write('export.json')
+        ids, firewalls = assets.scan(path, firewalls=True)
+        self.assertEqual(ids, {'123': 'p3'})
+        self.assertEqual([f['name'] for f in firewalls], ['fw'])
+
+        firewalls[0].update(network=NETWORK, allowed=[{}])
+        objects = list(assets.read_objects(path, ['buckets', 'instances',
+                                                  'iam'],
+                                           ids, FirewallIndex(firewalls)))
+        self.assertEqual([(project, check) for project, check, _ in objects],
+                         [('p3', 'buckets'), ('p1', 'instances'),
+                          ('p3', 'iam')])
+        self.assertEqual(objects[1][2]['firewalls'],
+                         [{'name': 'fw', 'allowed': [{}]}])
+        self.assertEqual(objects[2][2]['member'], 'user:a')
+
+    def test_gzip_and_checks(self):
+        path = self.write('export.json.gz', gzip.open)
+
+        self.assertEqual([check for _, check, _ in
+                          assets.read_objects(path, ['cloudsql', 'buckets'])],
+                         ['buckets', 'cloudsql'])
+
+    def test_invalid_line(self):
+        path = os.path.join(self.dir, 'export.json')
+        with open(path, 'w') as f:
+            f.write('{}\n{"name": \n')
+
+        with self.assertRaises(ValueError) as cm:
+            list(assets.read_objects(path))
+        self.assertIn('export.json:2', str(cm.exception))
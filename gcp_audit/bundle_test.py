@@ -0,0 +1,47 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import util.bundle as bundle
+
+RULE = {'name': 'open', 'filters': []}
+
+
+class TestBundle(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.rules = os.path.join(self.dir, 'firewalls')
+        os.mkdir(self.rules)
+        self.rulefile = os.path.join(self.rules, 'open.json')
+        with open(self.rulefile, 'w') as f:
+            json.dump(RULE, f)
+        self.path = os.path.join(self.dir, 'bundle.json')
+        bundle.write(self.path, {'firewalls': (bundle.stamp(self.rules),
+                                               [RULE])})
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        bundle._bundles.clear()
+
+    def test_load(self):
+        self.assertEqual(bundle.load(self.path, 'firewalls', self.rules),
+                         [RULE])
+        self.assertEqual(bundle.load(self.path, 'buckets', self.rules), None)
+        self.assertEqual(bundle.load(self.path + '2', 'firewalls',
+                                     self.rules), None)
+
+    def test_changed_rules(self):
+        with open(os.path.join(self.rules, 'new.json'), 'w') as f:
+            json.dump(RULE, f)
+
+        self.assertEqual(bundle.load(self.path, 'firewalls', self.rules),
+                         None)
+
+    def test_rule_files_gone(self):
+        shutil.rmtree(self.rules)
+
+        self.assertEqual(bundle.load(self.path, 'firewalls', self.rules),
+                         [RULE])
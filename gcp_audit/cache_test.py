@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from util.cache import CacheMiss, ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_ttl(self):
+        cache = ResponseCache(self.dir, ttl=60)
+        cache.put('a', {'items': [1]})
+
+        self.assertEqual(cache.get('a'), {'items': [1]})
+        self.assertIsNone(cache.get('b'))
+
+        then = time.time() - 120
+        os.utime(cache.path('a'), (then, then))
+        self.assertIsNone(cache.get('a'))
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(self.dir, max_size=100)
+        for i, key in enumerate(['a', 'b', 'c']):
+            cache.put(key, 'x' * 30)
+            then = time.time() - 100 + i
+            os.utime(cache.path(key), (then, time.time()))
+
+        # reading a makes b the least recently used entry
+        cache.get('a')
+        cache.put('d', 'x' * 30)
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertLessEqual(cache.size, 100)
+
+    def test_replay(self):
+        ResponseCache(self.dir, ttl=0).put('a', {'items': []})
+        cache = ResponseCache(self.dir, ttl=0, replay=True)
+
+        self.assertEqual(cache.get('a'), {'items': []})
+        self.assertRaises(CacheMiss, cache.get, 'b')
@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from util.checkpoint import Checkpoint
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'checkpoint')
+        self.output = os.path.join(self.dir, 'results')
+        with open(self.output, 'w') as f:
+            f.write('previous run\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_resume(self):
+        checkpoint = Checkpoint(self.path, self.output)
+        with open(self.output, 'a') as f:
+            f.write('p1 finding\n')
+        checkpoint.record('p1', 'buckets', os.path.getsize(self.output))
+        with open(self.output, 'a') as f:
+            f.write('p2 finding, never committed\n')
+
+        checkpoint = Checkpoint(self.path, self.output, resume=True)
+        checkpoint.truncate()
+
+        self.assertEqual(checkpoint.done(), set([('p1', 'buckets')]))
+        with open(self.output) as f:
+            self.assertEqual(f.read(), 'previous run\np1 finding\n')
+
+    def test_new_run_starts_over(self):
+        Checkpoint(self.path, self.output).record('p1', 'buckets', 0)
+        checkpoint = Checkpoint(self.path, self.output)
+        checkpoint.truncate()
+
+        self.assertEqual(checkpoint.done(), set())
+        self.assertEqual(os.path.getsize(self.output), 13)
+
+        checkpoint.finish()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_other_output(self):
+        Checkpoint(self.path, self.output)
+
+        self.assertRaises(ValueError, Checkpoint, self.path,
+                          self.output + '2', True)
@@ -0,0 +1,96 @@
+import unittest
+
+import gcp_audit
+
+from util.columnar import Batch, compile_batch_filter
+from util.filter import filterjson
+
+OBJECTS = [
+    {u'name': u'open', u'sourceRanges': [u'0.0.0.0/0'],
+     u'allowed': [{u'IPProtocol': u'tcp', u'ports': [u'22', u'3306']}]},
+    {u'name': u'range', u'sourceRanges': [u'0.0.0.0/0', u'10.0.0.0/8'],
+     u'allowed': [{u'IPProtocol': u'udp', u'ports': [u'1000-2000']},
+                  {u'IPProtocol': u'icmp'}],
+     u'targetTags': [u'web']},
+    {u'name': u'noranges', u'sourceRanges': [],
+     u'allowed': [{u'IPProtocol': u'tcp', u'ports': [u'3306']}]},
+    {u'name': u'scalar', u'sourceRanges': u'0.0.0.0/0',
+     u'allowed': [{u'IPProtocol': u'tcp', u'ports': []}]},
+    {u'name': u'noallowed', u'sourceRanges': [u'0.0.0.0/0'],
+     u'allowed': []},
+    {u'name': u'missing'},
+    {u'name': u'mixed', u'sourceRanges': [u'0.0.0.0/0', {u'x': 1}],
+     u'allowed': {u'IPProtocol': u'tcp'}},
+    {u'name': u'strings', u'sourceRanges': [u'0.0.0.0/0'],
+     u'allowed': [u'tcp']},
+    {u'name': u'nested', u'settings': {u'size': 10, u'tags': [u'a']}},
+    {u'name': u'nested2', u'settings': {u'size': True}},
+]
+
+FILTERS = [
+    ({u'sourceRanges': u'0.0.0.0/0',
+      u'allowed': [{u'IPProtocol': u'tcp|udp', u'ports': u'.+'}]}, 'regex'),
+    ({u'sourceRanges': [u'0.0.0.0/0'],
+      u'allowed': [{u'IPProtocol': u'tcp|udp', u'ports': u'\\d+-\\d+'}]},
+     'regex'),
+    ({u'sourceRanges': u'0.0.0.0/0',
+      u'allowed': [{u'IPProtocol': u'tcp', u'ports': u'3306'}]}, 'exact'),
+    ({u'targetTags': u'eq 0'}, 'count'),
+    ({u'allowed': [{u'ports': u'gt 1'}]}, 'count'),
+    ({u'sourceRanges': [u'10.0.0.0/8', u'0.0.0.0/0']}, 'exact'),
+    ({u'settings': {u'size': u'ge 10'}}, 'numeric'),
+    ({u'settings': {u'tags': [u'a']}}, 'exact'),
+    ({u'name': u'o'}, 'partial'),
+    # the protocol and the ports of the same allowed entry
+    ({u'allowed': [{u'IPProtocol': u'tcp', u'ports': u'covers 3306'}]},
+     'portrange', {u'IPProtocol': u'exact'}),
+    ({u'allowed': [{u'IPProtocol': u'tcp|udp', u'ports': u'gt 1'}]},
+     'count', {u'IPProtocol': u'regex'}),
+]
+
+
+class TestColumnar(unittest.TestCase):
+
+    def test_same_as_filterjson(self):
+        batch = Batch(OBJECTS)
+
+        for entry in FILTERS:
+            filter, matchtype = entry[:2]
+            matchtypes = entry[2] if len(entry) > 2 else None
+            for listcondition in ('or', 'and'):
+                expected = {}
+                for i, obj in enumerate(OBJECTS):
+                    try:
+                        expected[i] = bool(filterjson(obj, filter, matchtype,
+                                                      listcondition,
+                                                      matchtypes))
+                    except Exception:
+                        # filterjson fails on some of the odd shapes
+                        pass
+
+                match = compile_batch_filter(filter, matchtype,
+                                             listcondition, matchtypes)
+                rows = match(batch, sum(1 << i for i in expected))
+
+                for i in expected:
+                    self.assertEqual(bool(rows >> i & 1), expected[i],
+                                     (filter, listcondition,
+                                      OBJECTS[i]['name']))
+
+    def test_rows_are_restricted(self):
+        # regex on an int fails in filterjson, but not for rows that are
+        # not asked about
+        objects = [{u'a': u'x'}, {u'a': 5}]
+        match = compile_batch_filter({u'a': u'x'}, 'regex')
+
+        self.assertEqual(match(Batch(objects), 1), 1)
+        self.assertRaises(TypeError, match, Batch(objects))
+
+    def test_bundled_rules(self):
+        # the other objects make the bundled rules fail either way
+        objects = [obj for obj in OBJECTS if obj[u'name'] not in
+                   (u'mixed', u'strings', u'scalar')]
+
+        self.assertEqual(gcp_audit.evaluate_batches('firewalls', objects,
+                                                    size=3),
+                         gcp_audit.evaluate_rules('firewalls', objects))
@@ -0,0 +1,188 @@
+import unittest
+
+import gcp_audit
+from util import gcp, metrics
+from util.correlate import MAX_RELATED, Correlator
+
+NETWORK = u'https://www.googleapis.com/compute/v1/projects/p/global/' \
+    u'networks/default'
+OTHER = u'projects/p/global/networks/other'
+
+
+def firewall(name, network=NETWORK, **fields):
+    return dict(name=name, network=network, **fields)
+
+
+def instance(name, network=NETWORK, tags=(), account=None, **fields):
+    obj = dict(name=name, networkInterfaces=[{u'network': network}],
+               tags={u'items': list(tags)}, **fields)
+    if account:
+        obj[u'serviceAccounts'] = [{u'email': account}]
+    return obj
+
+
+def sql(name, network=None):
+    config = {u'ipv4Enabled': True}
+    if network:
+        config[u'privateNetwork'] = network
+    return {u'name': name, u'settings': {u'ipConfiguration': config}}
+
+
+def correlator(*rules):
+    return Correlator(rules, gcp_audit.compile_rule, gcp_audit.descfields())
+
+
+def names(found):
+    return [(obj[u'name'], [rule['name'] for rule in rules])
+            for obj, rules in found]
+
+
+class TestCorrelator(unittest.TestCase):
+
+    tagged = {
+        u'name': u'tagged', u'object': {u'check': u'firewalls'},
+        u'join': [{u'check': u'instances', u'on': u'tag', u'filters': [
+            {u'matchtype': u'exact', u'filter': {u'status': u'RUNNING'}}]}]}
+    unused = {
+        u'name': u'unused', u'object': {u'check': u'firewalls', u'filters': [
+            {u'matchtype': u'count', u'filter': {u'targetTags': u'gt 0'}}]},
+        u'join': [{u'check': u'instances', u'on': u'tag',
+                   u'exists': False}]}
+    sql_network = {
+        u'name': u'sql', u'object': {u'check': u'firewalls'},
+        u'join': [{u'check': u'cloudsql', u'on': u'network'}]}
+
+    listings = {
+        u'firewalls': [
+            firewall(u'web', targetTags=[u'web']),
+            firewall(u'db', targetTags=[u'db']),
+            # the same tag in another network
+            firewall(u'other', OTHER, targetTags=[u'web']),
+            firewall(u'all')],
+        u'instances': [
+            instance(u'vm-1', tags=[u'web'], status=u'RUNNING'),
+            instance(u'vm-2', tags=[u'db'], status=u'TERMINATED'),
+            instance(u'vm-3', tags=[u'web', u'db'], status=u'RUNNING'),
+            instance(u'vm-4', OTHER, tags=[u'db'], status=u'RUNNING')],
+        u'cloudsql': [sql(u'public'), sql(u'private', OTHER)]}
+
+    def test_tags(self):
+        found = correlator(self.tagged).correlate(self.listings)
+        self.assertEqual(names(found), [(u'firewalls/web', [u'tagged']),
+                                        (u'firewalls/db', [u'tagged'])])
+        related = found[0][0][u'related']
+        self.assertEqual(related, {u'tagged': {u'instances': [u'vm-1',
+                                                              u'vm-3']}})
+        self.assertIs(found[0][0][u'object'], self.listings[u'firewalls'][0])
+
+    def test_not_exists(self):
+        found = correlator(self.unused).correlate(self.listings)
+        self.assertEqual(names(found), [(u'firewalls/other', [u'unused'])])
+        self.assertEqual(found[0][0][u'related'], {u'unused': {}})
+
+    def test_rules_of_an_object(self):
+        found = correlator(self.tagged, self.unused,
+                           self.sql_network).correlate(self.listings)
+        self.assertEqual(names(found), [
+            (u'firewalls/web', [u'tagged']),
+            (u'firewalls/db', [u'tagged']),
+            (u'firewalls/other', [u'unused', u'sql'])])
+
+    def test_accounts(self):
+        rule = {u'name': u'owner', u'object': {u'check': u'instances'},
+                u'join': [{u'check': u'iam', u'on': u'service_account',
+                           u'filters': [{u'matchtype': u'exact',
+                                         u'filter': {u'role':
+                                                     u'roles/owner'}}]}]}
+        listings = {
+            u'instances': [instance(u'vm-1', account=u'sa@p'),
+                           instance(u'vm-2', account=u'other@p'),
+                           instance(u'vm-3')],
+            u'iam': [{u'member': u'serviceAccount:sa@p',
+                      u'role': u'roles/owner'},
+                     {u'member': u'serviceAccount:other@p',
+                      u'role': u'roles/viewer'},
+                     {u'member': u'user:sa@p', u'role': u'roles/owner'}]}
+        found = correlator(rule).correlate(listings)
+        self.assertEqual(names(found), [(u'instances/vm-1', [u'owner'])])
+        self.assertEqual(found[0][0][u'related'][u'owner'],
+                         {u'iam': [u'serviceAccount:sa@p']})
+
+    def test_related_names_capped(self):
+        listings = {u'firewalls': [firewall(u'all')],
+                    u'cloudsql': [sql(u'sql-%d' % i, NETWORK)
+                                  for i in range(3 * MAX_RELATED)]}
+        found = correlator(self.sql_network).correlate(listings)
+        related = found[0][0][u'related'][u'sql'][u'cloudsql']
+        self.assertEqual(related, [u'sql-%d' % i
+                                   for i in range(MAX_RELATED)])
+
+    def test_checks_and_missing_listings(self):
+        c = correlator(self.tagged, self.sql_network)
+        self.assertEqual(c.checks, [u'cloudsql', u'firewalls', u'instances'])
+        self.assertEqual(c.correlate({}), [])
+
+    def test_empty_project(self):
+        metrics.enable()
+        try:
+            c = correlator(self.tagged, self.unused)
+            self.assertEqual(c.correlate({u'firewalls': [],
+                                          u'instances': []}), [])
+            self.assertEqual(metrics.totals('rule')['tagged'].count, 0)
+            self.assertTrue(any(line.endswith('  tagged')
+                                for line in metrics.summary()))
+        finally:
+            metrics.reset()
+
+    def test_skipped_rules(self):
+        c = correlator(self.tagged, self.sql_network)
+        self.assertEqual(c.needing(u'cloudsql'), [u'sql'])
+        self.assertEqual(c.needing(u'firewalls'), [u'tagged', u'sql'])
+        self.assertEqual(names(c.correlate(self.listings, set([u'sql']))),
+                         [(u'firewalls/web', [u'tagged']),
+                          (u'firewalls/db', [u'tagged'])])
+
+    def test_unlisted_check(self):
+        def listing(project, name):
+            if name == u'cloudsql':
+                raise gcp.record_failure('sql.instances.list', project,
+                                         'forbidden')
+            return self.listings[name]
+
+        saved = gcp_audit.listing, gcp_audit.get_index
+        gcp_audit.listing = listing
+        gcp_audit.get_index = lambda name: correlator(self.tagged,
+                                                      self.sql_network)
+        try:
+            skipped = set()
+            found = gcp_audit.correlate(u'p', skipped)
+        finally:
+            gcp_audit.listing, gcp_audit.get_index = saved
+            failures = gcp.failures[:]
+            del gcp.failures[:]
+
+        # the rules that do not join CloudSQL are still run
+        self.assertEqual(names(found), [(u'firewalls/web', [u'tagged']),
+                                        (u'firewalls/db', [u'tagged'])])
+        self.assertEqual(skipped, set([u'sql']))
+        self.assertEqual(len(failures), 2)
+        self.assertIn('skipped sql', str(failures[1]))
+
+    def test_invalid(self):
+        for rule in [
+                {u'name': u'no joins', u'object': {u'check': u'firewalls'},
+                 u'join': []},
+                {u'name': u'key', u'object': {u'check': u'firewalls'},
+                 u'join': [{u'check': u'cloudsql', u'on': u'zone'}]},
+                {u'name': u'check', u'object': {u'check': u'cloudsql'},
+                 u'join': [{u'check': u'instances', u'on': u'tag'}]},
+                {u'name': u'filters', u'object': {u'check': u'firewalls',
+                                                  u'filters': [{}]},
+                 u'join': [{u'check': u'instances', u'on': u'tag'}]}]:
+            self.assertRaises(ValueError, correlator, rule)
+
+    def test_bundled_rules(self):
+        rules = gcp_audit.get_rules('correlations')
+        self.assertTrue(rules)
+        self.assertIsInstance(gcp_audit.get_index('correlations'),
+                              Correlator)
@@ -0,0 +1,63 @@
+import json
+import unittest
+import urllib2
+
+from util.daemon import Daemon, serve
+
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.projects = ['p1', 'p2']
+        self.calls = []
+
+        def audit(project, check):
+            self.calls.append((project, check))
+            if project == 'broken':
+                raise ValueError('no access')
+            return [{'project': project, 'check': check, 'rule': 'open'}]
+
+        self.daemon = Daemon(audit, {'buckets': 10, 'firewalls': 60},
+                             lambda: self.projects, projects_every=100)
+
+    def test_schedule(self):
+        self.assertTrue(self.daemon.tick(now=1000))
+        self.assertEqual(len(self.calls), 4)
+        self.assertEqual(self.daemon.health(now=1000)['status'], 'ok')
+
+        # nothing is due before the interval of a check is over
+        self.assertFalse(self.daemon.tick(now=1001))
+        self.daemon.checks['buckets'].due = 1001
+        self.assertTrue(self.daemon.tick(now=1001))
+        self.assertEqual(self.calls[4:], [('p1', 'buckets'),
+                                          ('p2', 'buckets')])
+
+        self.assertEqual(self.daemon.health(now=1000000)['late'],
+                         ['buckets', 'firewalls'])
+
+    def test_projects_listed_again(self):
+        self.daemon.tick(now=1000)
+        self.projects = ['p2', 'broken']
+        for check in self.daemon.checks.values():
+            check.due = 0
+
+        self.daemon.tick(now=1000 + 100)
+
+        self.assertEqual(self.daemon.get_findings(check='buckets'),
+                         [{'project': 'p2', 'check': 'buckets',
+                           'rule': 'open'}])
+        self.assertEqual(self.daemon.checks['buckets'].errors, 1)
+
+    def test_http(self):
+        self.daemon.tick()
+        server = serve(self.daemon, port=0)
+        root = 'http://127.0.0.1:%d' % server.server_address[1]
+        try:
+            findings = json.load(urllib2.urlopen(root +
+                                                 '/findings?project=p1'))
+            health = json.load(urllib2.urlopen(root + '/health'))
+        finally:
+            server.shutdown()
+
+        self.assertEqual(len(findings), 2)
+        self.assertEqual(health['projects'], 2)
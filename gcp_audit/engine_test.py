@@ -0,0 +1,67 @@
+import threading
+import time
+import unittest
+
+from util import engine
+
+
+class FakeHttp(object):
+
+    def __init__(self, lock, state):
+        self.lock = lock
+        self.state = state
+
+        def request(uri):
+            with self.lock:
+                self.state['running'] += 1
+                self.state['peak'] = max(self.state['peak'],
+                                         self.state['running'])
+            time.sleep(0.005)
+            with self.lock:
+                self.state['running'] -= 1
+            return uri, id(self)
+
+        request.credentials = 'creds'
+        self.request = request
+
+
+class TestSharedHttp(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.state = {'running': 0, 'peak': 0, 'made': 0}
+
+    def factory(self):
+        self.state['made'] += 1
+        return FakeHttp(self.lock, self.state)
+
+    def test_connections_are_reused(self):
+        http = engine.SharedHttp(self.factory, 4)
+
+        conns = set(http.request('u%d' % i)[1] for i in range(5))
+
+        self.assertEqual(len(conns), 1)
+        self.assertEqual(self.state['made'], 1)
+        self.assertEqual(http.request.credentials, 'creds')
+
+    def test_inflight_cap(self):
+        http = engine.SharedHttp(self.factory, 3)
+        threads = [threading.Thread(target=http.request, args=('u',))
+                   for _ in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertLessEqual(self.state['peak'], 3)
+        self.assertLessEqual(self.state['made'], 3)
+
+
+class TestThreadsEngine(unittest.TestCase):
+
+    def test_passthrough(self):
+        items = iter([1, 2, 3])
+
+        self.assertIs(engine.prefetch(items), items)
+        self.assertEqual(list(engine.imap(lambda x: x * 2, [1, 2, 3])),
+                         [2, 4, 6])
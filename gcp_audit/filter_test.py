@@ -125,5 +125,164 @@ class TestApplyRuleFilter(unittest.TestCase):
             obj, filters, filtercondition))
 
 
+class TestCompiledRules(unittest.TestCase):
+
+    firewalls = [
+        {u'name': u'open', u'sourceRanges': [u'0.0.0.0/0'],
+         u'allowed': [{u'IPProtocol': u'tcp', u'ports': [u'22', u'3306']}]},
+        {u'name': u'range', u'sourceRanges': [u'0.0.0.0/0'],
+         u'allowed': [{u'IPProtocol': u'udp', u'ports': [u'1000-2000']}],
+         u'targetTags': [u'web']},
+        {u'name': u'noranges', u'sourceRanges': [],
+         u'allowed': [{u'IPProtocol': u'tcp', u'ports': [u'3306']}]},
+        {u'name': u'icmp', u'sourceRanges': [u'10.0.0.0/8'],
+         u'allowed': [{u'IPProtocol': u'icmp'}]},
+        {u'name': u'noallowed', u'sourceRanges': [u'0.0.0.0/0'],
+         u'allowed': []},
+        {u'name': u'halves', u'sourceRanges': [u'0.0.0.0/1', u'128.0.0.0/1'],
+         u'allowed': [{u'IPProtocol': u'tcp', u'ports': [u'3000-4000']}]},
+        {u'name': u'ipv6', u'sourceRanges': [u'::/0'],
+         u'allowed': [{u'IPProtocol': u'tcp', u'ports': [u'3306']}]},
+        # private ranges are not open to all IP's
+        {u'name': u'private', u'sourceRanges': [u'10.0.0.0/8'],
+         u'allowed': [{u'IPProtocol': u'tcp', u'ports': [u'3306']}]},
+        {u'name': u'private12', u'sourceRanges': [u'172.16.0.0/12'],
+         u'allowed': [{u'IPProtocol': u'tcp', u'ports': [u'3306']}]},
+        {u'name': u'udp', u'sourceRanges': [u'0.0.0.0/0'],
+         u'allowed': [{u'IPProtocol': u'udp', u'ports': [u'3306']}]},
+        # the MySQL port is open, but not over tcp
+        {u'name': u'split', u'sourceRanges': [u'0.0.0.0/0'],
+         u'allowed': [{u'IPProtocol': u'tcp', u'ports': [u'80']},
+                      {u'IPProtocol': u'udp', u'ports': [u'3306', u'53']}]},
+    ]
+
+    def test_bundled_rules_match_interpreted(self):
+        for rule in gcp_audit.loadrules('firewalls'):
+            match = gcp_audit.compile_rule(rule)
+            for obj in self.firewalls:
+                self.assertEqual(
+                    bool(match(obj)),
+                    bool(gcp_audit.apply_rule_filters(
+                        obj, rule['filters'],
+                        rule.get('filtercondition', 'and'))),
+                    (rule['name'], obj['name']))
+
+    def test_listcondition_and(self):
+        filters = [{u'filter': {u'ports': [u'22', u'3306']},
+                    u'matchtype': u'exact', u'listcondition': u'and'}]
+        match = gcp_audit.compile_rule({u'name': u'x', u'filters': filters})
+
+        for ports in ([u'22', u'3306'], [u'3306'], [u'80']):
+            obj = {u'ports': ports}
+            self.assertEqual(
+                bool(match(obj)),
+                bool(gcp_audit.apply_rule_filters(obj, filters)), ports)
+
+    def test_numeric(self):
+        filters = [{u'filter': {u'size': u'ge 10'}, u'matchtype': u'numeric'}]
+        match = gcp_audit.compile_rule({u'name': u'x', u'filters': filters})
+
+        self.assertTrue(match({u'size': 10}))
+        self.assertFalse(match({u'size': 9}))
+        self.assertFalse(match({u'size': u'10'}))
+        self.assertTrue(gcp_audit.apply_rule_filters({u'size': 10}, filters))
+
+    def test_bundled_rules_semantic_ranges(self):
+        rules = [(rule['name'], gcp_audit.compile_rule(rule))
+                 for rule in gcp_audit.loadrules('firewalls')]
+        firewalls = [obj for obj in self.firewalls if obj['sourceRanges']]
+
+        mysql = [match for name, match in rules if 'MySQL' in name][0]
+        found = [obj['name'] for obj in firewalls if mysql(obj)]
+        self.assertEqual(found, [u'open', u'halves', u'ipv6'])
+
+        notags = [match for name, match in rules if 'no target' in name][0]
+        found = [obj['name'] for obj in firewalls if notags(obj)]
+        self.assertEqual(found, [u'open', u'halves', u'ipv6', u'udp',
+                                 u'split'])
+
+        ranges = [match for name, match in rules
+                  if 'multiple ports (range' in name][0]
+        found = [obj['name'] for obj in firewalls if ranges(obj)]
+        self.assertEqual(found, [u'range', u'halves'])
+
+    def test_bundled_instance_rule(self):
+        rule = [rule for rule in gcp_audit.loadrules('instances')
+                if 'external IP' in rule['name']][0]
+        match = gcp_audit.compile_rule(rule)
+        nic = {u'accessConfigs': [{u'natIP': u'203.0.113.1'}]}
+
+        def vm(*firewalls):
+            return {u'networkInterfaces': [nic], u'firewalls': [
+                {u'sourceRanges': [ranges], u'allowed': [{u'IPProtocol': p}]}
+                for ranges, p in firewalls]}
+
+        # like the default network's default-allow-icmp
+        self.assertFalse(match(vm((u'0.0.0.0/0', u'icmp'))))
+        self.assertFalse(match(vm((u'0.0.0.0/0', u'icmp'),
+                                  (u'10.0.0.0/8', u'tcp'))))
+        self.assertTrue(match(vm((u'0.0.0.0/0', u'tcp'))))
+        self.assertTrue(match(vm((u'0.0.0.0/0', u'all'))))
+        self.assertFalse(match(dict(vm((u'0.0.0.0/0', u'tcp')),
+                                    networkInterfaces=[{}])))
+
+    def test_matchtypes(self):
+        filters = [{u'filter': {u'allowed': [{u'IPProtocol': u'tcp',
+                                              u'ports': u'covers 22'}]},
+                    u'matchtype': u'portrange',
+                    u'matchtypes': {u'IPProtocol': u'exact'}}]
+        match = gcp_audit.compile_rule({u'name': u'x', u'filters': filters})
+
+        for allowed, expected in [
+                ([{u'IPProtocol': u'tcp', u'ports': [u'20-30']}], True),
+                ([{u'IPProtocol': u'udp', u'ports': [u'22']}], False),
+                ([{u'IPProtocol': u'tcp', u'ports': [u'80']},
+                  {u'IPProtocol': u'udp', u'ports': [u'22']}], False)]:
+            obj = {u'allowed': allowed}
+            self.assertEqual(bool(match(obj)), expected, allowed)
+            self.assertEqual(
+                bool(gcp_audit.apply_rule_filters(obj, filters)), expected)
+
+        self.assertRaises(ValueError, gcp_audit.compile_rule, {
+            u'name': u'x', u'filters': [dict(filters[0], matchtypes={
+                u'IPProtocol': u'fuzzy'})]})
+
+    def test_cidr(self):
+        match = gcp_audit.compile_rule({u'name': u'x', u'filters': [
+            {u'filter': {u'ranges': u'within 10.0.0.0/8 192.168.0.0/16'},
+             u'matchtype': u'cidr'}]})
+
+        self.assertTrue(match({u'ranges': [u'8.8.8.8', u'10.1.0.0/16']}))
+        self.assertTrue(match({u'ranges': u'192.168.1.1'}))
+        self.assertFalse(match({u'ranges': [u'10.0.0.0/7', u'fd00::/8']}))
+        self.assertFalse(match({u'ranges': [u'bogus', 42]}))
+
+    def test_portrange(self):
+        filters = [{u'filter': {u'ports': u'overlaps 20-23 size lt 100'},
+                    u'matchtype': u'portrange'}]
+        match = gcp_audit.compile_rule({u'name': u'x', u'filters': filters})
+
+        for ports, expected in (([u'22'], True), ([u'1-21'], True),
+                                ([u'0-65535'], False), ([u'80', 23], True),
+                                ([u'24-30'], False)):
+            obj = {u'ports': ports}
+            self.assertEqual(bool(match(obj)), expected, ports)
+            self.assertEqual(bool(gcp_audit.apply_rule_filters(obj, filters)),
+                             expected, ports)
+
+    def test_invalid_rules(self):
+        for f in ({u'filter': {u'a': u'b'}, u'matchtype': u'fuzzy'},
+                  {u'filter': {u'a': u'('}, u'matchtype': u'regex'},
+                  {u'filter': {u'a': u'about 3'}, u'matchtype': u'count'},
+                  {u'filter': {u'a': u'near 10.0.0.0/8'}, u'matchtype': u'cidr'},
+                  {u'filter': {u'a': u'covers 1.2.3.4/33'},
+                   u'matchtype': u'cidr'},
+                  {u'filter': {u'a': u'covers 80-70'},
+                   u'matchtype': u'portrange'},
+                  {u'filter': {u'a': u'b'}}):
+            self.assertRaises(ValueError, gcp_audit.compile_rule,
+                              {u'name': u'x', u'filters': [f]})
+
+
 if __name__ == '__main__':
     unittest.main()
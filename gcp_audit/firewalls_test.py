@@ -0,0 +1,62 @@
+import unittest
+
+from util.firewalls import FirewallIndex, instance_targets, network_key
+
+NETWORK = 'https://www.googleapis.com/compute/v1/projects/p/global/' \
+    'networks/default'
+
+
+class TestFirewallIndex(unittest.TestCase):
+
+    firewalls = [
+        {'name': 'all', 'network': NETWORK, 'allowed': [{}],
+         'sourceRanges': ['0.0.0.0/0'], 'id': '1'},
+        {'name': 'web', 'network': NETWORK, 'allowed': [{}],
+         'targetTags': ['web', 'lb']},
+        {'name': 'account', 'network': NETWORK, 'allowed': [{}],
+         'targetServiceAccounts': ['sa@p.iam.gserviceaccount.com'],
+         'targetTags': ['web']},
+        {'name': 'egress', 'network': NETWORK, 'allowed': [{}],
+         'direction': 'EGRESS'},
+        {'name': 'disabled', 'network': NETWORK, 'allowed': [{}],
+         'disabled': True},
+        {'name': 'deny', 'network': NETWORK, 'denied': [{}]},
+        {'name': 'other', 'network': 'projects/p/global/networks/other',
+         'allowed': [{}]},
+    ]
+
+    def setUp(self):
+        self.index = FirewallIndex(self.firewalls)
+
+    def names(self, network, tags=(), accounts=()):
+        return [f['name'] for f in self.index.applying(network, tags,
+                                                       accounts)]
+
+    def test_applying(self):
+        self.assertEqual(self.names(NETWORK), ['all'])
+        self.assertEqual(self.names(NETWORK, ['lb', 'web']),
+                         ['all', 'web', 'account'])
+        self.assertEqual(self.names(NETWORK, ['db'],
+                                    ['sa@p.iam.gserviceaccount.com']),
+                         ['all', 'account'])
+        self.assertEqual(self.names('global/networks/default'), [])
+        # partial URLs are the same network
+        self.assertEqual(self.names('projects/p/global/networks/other'),
+                         ['other'])
+        self.assertEqual(self.names('projects/p/global/networks/none'), [])
+
+    def test_fields_kept(self):
+        self.assertEqual(self.index.applying(NETWORK)[0],
+                         {'name': 'all', 'allowed': [{}],
+                          'sourceRanges': ['0.0.0.0/0']})
+
+    def test_instance_targets(self):
+        self.assertEqual(instance_targets({}), ([], []))
+        self.assertEqual(instance_targets({
+            'tags': {'items': ['web']},
+            'serviceAccounts': [{'email': 'sa@p', 'scopes': []}]}),
+            (['web'], ['sa@p']))
+
+    def test_network_key(self):
+        self.assertEqual(network_key(NETWORK),
+                         'projects/p/global/networks/default')
@@ -20,36 +20,75 @@
 # under the License.
 
 import atexit
+import collections
 import datetime
-
-try:
-    import googleapiclient
-except ImportError:
-    # allow tests without this dependency
-    googleapiclient = None
-
+import itertools
 import json
 import os
 import signal
 import sys
+import util.assets as assets
+import util.bundle as bundle
+import util.daemon as daemon
+import util.engine as engine
 import util.gcp as gcp
-import yaml
+import util.merge as merge
+import util.metrics as metrics
+import util.snapshot as snapshot
 
 from argparse import ArgumentParser
 from termcolor import colored
-from util.filter import filterjson
+from util.cache import CacheMiss, ResponseCache
+from util.checkpoint import Checkpoint
+from util.columnar import Batch, compile_batch_filter, to_rows
+from util.correlate import Correlator
+from util.firewalls import FirewallIndex
+from util.filter import compile_filter, filterjson
+from util.memo import RuleMemo
+from util.output import open_sink, sinks
+from util.ratelimit import RateLimiter
+from util.ruleindex import RuleIndex
+from util.scheduler import Scheduler
+from util.shard import parse_shard, shard_of
+
 
+RULES_DIR = os.path.join(os.path.dirname(__file__), 'rules')
+
+# Written by compile-rules, and used in place of the rule files that did
+# not change since.
+rules_bundle = os.path.join(RULES_DIR, 'bundle.json')
 
 env_credentials = ''
+rulesets = {}
+batch_rulesets = {}
+# the files of each category when its rules were last loaded, see
+# reload_rules
+rule_stamps = {}
+snapshots = None
+scheduler = None
+
+# Evaluate the checks that allow it over batches of this many objects.
+batch_eval = 0
+# Remember the rule results of this many distinct objects per category.
+memo_size = 0
+
+labels = {
+    None: ('MATCH:', 'red'),
+    snapshot.NEW: ('NEW:', 'red'),
+    snapshot.PRESENT: ('MATCH:', 'yellow'),
+    snapshot.RESOLVED: ('RESOLVED:', 'green')
+}
 
 checks = {
     'buckets': {
         'func': gcp.get_acls_for_buckets,
-        'descfield': 'bucket'
+        'descfield': 'bucket',
+        'partial': True
     },
     'bucket_objects': {
         'func': gcp.get_default_acls,
-        'descfield': 'entity'
+        'descfield': 'entity',
+        'partial': True
     },
     'cloudsql': {
         'func': gcp.get_cloudsql_instances,
@@ -57,60 +96,485 @@ checks = {
     },
     'firewalls': {
         'func': gcp.get_firewalls,
-        'descfield': 'name'
+        'descfield': 'name',
+        'columnar': True
+    },
+    'iam': {
+        'func': gcp.get_iam_bindings,
+        'descfield': 'member'
+    },
+    'instances': {
+        'func': gcp.get_instances,
+        'descfield': 'name',
+        'partial': True
+    },
+    # joins the objects of the other checks, see util/correlate.py; only
+    # run with -c, as it keeps the listings it joins in memory
+    'correlations': {
+        'descfield': 'name',
+        'correlate': True,
+        'optional': True
     }
 }
 
+# every check, also those left out with -c, as correlation rules may
+# join their objects
+all_checks = checks
+
+
+def loadrulefile(path):
+    with open(path) as rulefile:
+        if path.endswith(".json"):
+            try:
+                return json.load(rulefile)
+            except ValueError as e:
+                raise ValueError("%s: %s" % (path, e))
+        elif path.endswith(".yaml"):
+            # only the rules written in YAML need it
+            import yaml
+            try:
+                return yaml.safe_load(rulefile)
+            except yaml.YAMLError as e:
+                raise ValueError("%s: %s" % (path, e))
+        raise ValueError("Unknown rule format: %s" % path)
+
 
 def loadrules(ruletype):
-    rules = []
-    path = os.path.join(os.path.dirname(__file__), "rules/%s" % ruletype)
-    for file in os.listdir(path):
-        with open("%s/%s" % (path, file)) as rulefile:
-            if file.endswith(".json"):
-                rule = json.load(rulefile)
-            elif file.endswith(".yaml"):
-                rule = yaml.safe_load(rulefile)
-            else:
-                raise "Unknown rule format"
-            rules.append(rule)
+    start = metrics.clock()
+    path = os.path.join(RULES_DIR, ruletype)
+    rules = bundle.load(rules_bundle, ruletype, path)
+    if rules is None:
+        rules = [loadrulefile(os.path.join(path, file))
+                 for file in sorted(os.listdir(path))]
+    metrics.record('stage', 'loadrules', start)
     return rules
 
 
-def apply_rules(ruletype, gcpobjects, descfield, outfile, project):
-    rules = loadrules(ruletype)
+def compile_rules_main(args):
+    parser = ArgumentParser(prog='gcp-audit compile-rules',
+                            description='Check the rules of every category \
+                                         and write them to a single file \
+                                         that loads faster. Rule files \
+                                         changed later are still used.')
+    parser.add_argument('-o', '--output', default=rules_bundle,
+                        help='file to write the bundle to, pass it to runs \
+                              with --rules-bundle (default: %s)'
+                             % rules_bundle)
+    options = parser.parse_args(args)
+
+    categories = {}
+    for ruletype in sorted(checks):
+        path = os.path.join(RULES_DIR, ruletype)
+        files = bundle.stamp(path)
+        rules = []
+        for file in sorted(files):
+            try:
+                rule = loadrulefile(os.path.join(path, file))
+                if checks[ruletype].get('correlate'):
+                    Correlator([rule], compile_rule, descfields())
+                else:
+                    compile_rule(rule)
+            except Exception as e:
+                print colored('ERROR:', 'red'), \
+                    "Invalid rule in %s/%s: %s" % (ruletype, file, e)
+                sys.exit(1)
+            rules.append(rule)
+        categories[ruletype] = (files, rules)
+
+    try:
+        bundle.write(options.output, categories)
+    except (IOError, OSError) as e:
+        print colored('ERROR:', 'red'), \
+            "Could not write the bundle to %s: %s" % (options.output, e)
+        sys.exit(1)
+    print '%d rules of %d categories written to %s' % (
+        sum(len(rules) for _, rules in categories.values()), len(categories),
+        options.output)
+
+
+def compile_rule(rule):
+    """Compile a rule into a function of one object.
+
+    The function returns the same result as apply_rule_filters on the
+    rule's filters, see compile_filter.
+    """
+    if 'name' not in rule or not isinstance(rule.get('filters'), list):
+        raise ValueError("a rule needs a name and a list of filters")
+
+    try:
+        matchers = [compile_filter(f['filter'], f['matchtype'],
+                                   f.get('listcondition', 'or'),
+                                   f.get('matchtypes'))
+                    for f in rule['filters']]
+    except (KeyError, ValueError) as e:
+        raise ValueError("rule '%s': %s" % (rule['name'], e))
+
+    stop_on = {'or': True, 'and': False}.get(rule.get('filtercondition',
+                                                      'and'))
+
+    def match(obj):
+        res = True
+        for matcher in matchers:
+            res = matcher(obj)
+            if stop_on is not None and bool(res) == stop_on:
+                break
+        return res
+
+    return match
+
+
+def compile_batch_rule(rule):
+    """Compile a rule into a function of a Batch, see compile_rule.
+
+    The function returns the rows of the batch that match the rule.
+    """
+    matchers = [compile_batch_filter(f['filter'], f['matchtype'],
+                                     f.get('listcondition', 'or'),
+                                     f.get('matchtypes'))
+                for f in rule['filters']]
+    filtercondition = rule.get('filtercondition', 'and')
+
+    def match(batch):
+        if filtercondition == 'and':
+            mask = batch.all
+            for matcher in matchers:
+                if not mask:
+                    break
+                mask &= matcher(batch, mask)
+        elif filtercondition == 'or':
+            mask = 0
+            for matcher in matchers:
+                if mask == batch.all:
+                    break
+                mask |= matcher(batch, batch.all & ~mask)
+        else:
+            mask = batch.all
+            for matcher in matchers:
+                mask = matcher(batch)
+        return mask
+
+    return match
+
+
+def descfields():
+    return dict((name, check['descfield'])
+                for name, check in all_checks.iteritems())
+
+
+def build_index(ruletype):
+    if all_checks[ruletype].get('correlate'):
+        return Correlator(loadrules(ruletype), compile_rule, descfields())
+
+    index = RuleIndex([(rule, compile_rule(rule))
+                       for rule in loadrules(ruletype)])
+    if memo_size:
+        index = RuleMemo(index, ruletype, memo_size)
+    return index
+
+
+def get_index(ruletype):
+    """Load, compile and index the rules of a category, once per process."""
+    if ruletype not in rulesets:
+        rulesets[ruletype] = build_index(ruletype)
+    return rulesets[ruletype]
+
+
+def reload_rules():
+    """Load the rules of the categories whose files changed again.
+
+    Returns a (category, error) pair per category reloaded, where error
+    is None if its rules loaded fine. A category whose rules do not load
+    keeps its previous ones.
+    """
+    res = []
+    for ruletype in sorted(checks):
+        try:
+            stamp = bundle.stamp(os.path.join(RULES_DIR, ruletype))
+        except OSError:
+            continue
+        if rule_stamps.get(ruletype) == stamp:
+            continue
+
+        # taken before reading, so that a file changed meanwhile is read
+        # again next time
+        rule_stamps[ruletype] = stamp
+        try:
+            index = build_index(ruletype)
+        except (IOError, ValueError) as e:
+            res.append((ruletype, str(e)))
+            continue
+        rulesets[ruletype] = index
+        batch_rulesets.pop(ruletype, None)
+        res.append((ruletype, None))
+    return res
+
+
+def get_rules(ruletype):
+    return get_index(ruletype).rules
+
+
+def match_rule(obj, rule, match):
+    start = metrics.clock()
+    hit = bool(match(obj))
+    metrics.record('rule', rule['name'], start, matches=hit)
+    return hit
+
+
+def _match(obj, rule, match):
+    return match(obj)
+
+
+def match_object(index, obj):
+    if isinstance(index, RuleMemo):
+        pairs, hit = index.match(obj, match_rule if metrics.enabled
+                                 else _match)
+        if hit is not None:
+            metrics.record('memo', index.name, None, matches=hit)
+        return [rule for rule, _ in pairs]
+
+    if not metrics.enabled:
+        return [rule for rule, match in index.candidates(obj) if match(obj)]
+    return [rule for rule, match in index.candidates(obj)
+            if match_rule(obj, rule, match)]
+
+
+def evaluate_rules(ruletype, gcpobjects):
+    index = get_index(ruletype)
+    matches = []
     for obj in gcpobjects:
-        for rule in rules:
-            if 'filtercondition' in rule:
-                res = apply_rule_filters(obj, rule['filters'],
-                                         rule['filtercondition'])
-            else:
-                res = apply_rule_filters(obj, rule['filters'])
+        for rule in match_object(index, obj):
+            matches.append((obj, rule))
+    return matches
+
+
+def evaluate_batches(ruletype, gcpobjects, size=1024):
+    """Like evaluate_rules, but evaluate the rules column by column."""
+    if ruletype not in batch_rulesets:
+        batch_rulesets[ruletype] = [(rule, compile_batch_rule(rule))
+                                    for rule, _ in get_rules(ruletype)]
+    rules = batch_rulesets[ruletype]
+
+    matches = []
+    objects = iter(gcpobjects)
+    while True:
+        chunk = list(itertools.islice(objects, size))
+        if not chunk:
+            return matches
+
+        batch = Batch(chunk)
+        hits = [[] for _ in chunk]
+        for rule, match in rules:
+            start = metrics.clock()
+            rows = list(to_rows(match(batch)))
+            metrics.record('rule', rule['name'], start, count=len(chunk),
+                           matches=len(rows))
+            for row in rows:
+                hits[row].append(rule)
+
+        for obj, rules_hit in zip(chunk, hits):
+            for rule in rules_hit:
+                matches.append((obj, rule))
+
+
+def report_matches(matches, check, descfield, sink, project):
+    start = metrics.clock()
+    for obj, rule, status in matches:
+        label, color = labels[status]
+        print colored(label, color), \
+            "object '%s' matches rule '%s'" \
+            % (obj[descfield], rule['name'])
+
+        sink.write(project, check, obj[descfield], rule, obj, status)
+    if matches:
+        metrics.record('stage', 'write', start, count=len(matches))
+
+
+def listing(project, name):
+    """List the objects of a check once per project, for the check and
+    the correlations.
+    """
+    func = all_checks[name]['func']
+    return gcp.shared_listing('check/%s' % name, project,
+                              lambda: list(func(project)))
+
+
+def list_objects(project, name, failed=None):
+    if 'correlations' in checks and \
+            name in get_index('correlations').checks:
+        return iter(listing(project, name))
+    if checks[name].get('partial'):
+        # lists what it can, and adds the buckets or objects it could not
+        # fully list to failed
+        return checks[name]['func'](project, failed)
+    return checks[name]['func'](project)
+
+
+def correlate(project, skipped=None):
+    """Return the (finding, rules) pairs of the correlation rules in a
+    project, see Correlator.correlate.
+
+    The rules that need the objects of a check that cannot be listed are
+    skipped, reported in `gcp.failures` and added to `skipped`.
+    """
+    correlator = get_index('correlations')
+    listings = {}
+    if skipped is None:
+        skipped = set()
+    for name in correlator.checks:
+        try:
+            listings[name] = listing(project, name)
+        except gcp.FetchError as e:
+            rules = correlator.needing(name)
+            skipped.update(rules)
+            gcp.record_failure('correlations', project,
+                               'skipped %s: %s' % (', '.join(rules), e))
+    if metrics.enabled:
+        metrics.set_project(project)
+    start = metrics.clock()
+    res = correlator.correlate(listings, skipped)
+    metrics.record('stage', 'correlate', start)
+    return res
+
+
+def run_check(project, name):
+    if checks[name].get('correlate'):
+        return run_correlations(project, name)
+
+    failed = set()
+    objects = list_objects(project, name, failed)
+    if metrics.enabled:
+        metrics.set_project(project)
+        objects = _in_project(project, objects)
+    objects = engine.prefetch(objects)
+
+    if snapshots is None:
+        if batch_eval and checks[name].get('columnar'):
+            matches = evaluate_batches(name, objects, batch_eval)
+        else:
+            matches = evaluate_rules(name, objects)
+        return [(obj, rule, None) for obj, rule in matches]
+
+    index = get_index(name)
+    return snapshots.audit(project, name, objects, index.rules,
+                           lambda obj: match_object(index, obj),
+                           checks[name]['descfield'], failed)
+
+
+def run_correlations(project, name):
+    skipped = set()
+    found = correlate(project, skipped)
+    if snapshots is None:
+        return [(obj, rule, None) for obj, rules in found for rule in rules]
+
+    matched = dict((id(obj), rules) for obj, rules in found)
+    return snapshots.audit(project, name, [obj for obj, _ in found],
+                           get_rules(name), lambda obj: matched[id(obj)],
+                           checks[name]['descfield'], skipped)
+
+
+def _in_project(project, objects):
+    # the async engine lists the objects in a greenlet of its own
+    metrics.set_project(project)
+    for obj in objects:
+        yield obj
+
+
+def in_shard(project, shard):
+    return shard is None or shard_of(project, shard[1]) == shard[0]
+
+
+def list_projects(projects=None, shard=None):
+    """Return the given projects, or all of them, that are in the shard."""
+    projects = list(projects or gcp.get_all_projects())
+    if shard:
+        total = len(projects)
+        projects = [p for p in projects if in_shard(p, shard)]
+        print 'Shard %d/%d: auditing %d of %d projects' % (
+            shard + (len(projects), total))
+    return projects
+
+
+def audit_unit(project, name):
+    """Return the findings of a check of a project, like the lines of a
+    jsonl results file.
+    """
+    now = datetime.datetime.now().isoformat()
+    descfield = checks[name]['descfield']
+    return [{'time': now,
+             'project': project,
+             'check': name,
+             'object': obj[descfield],
+             'rule': rule['name'],
+             'data': obj}
+            for obj, rule, _ in run_check(project, name)]
+
 
-            if res:
-                print colored('MATCH:', 'red'), \
-                    "object '%s' matches rule '%s'" \
-                    % (obj[descfield], rule['name'])
+def audit_assets(path, sink, projects=None, shard=None):
+    """Audit the resources of an asset export in one pass over the file,
+    after a first pass over its projects and firewalls.
 
-                with open(outfile, 'a') as f:
-                    f.write(datetime.datetime.now().ctime()
-                            + ": Project: " + project
-                            + " | Object: " + obj[descfield]
-                            + " | Matches rule: " + rule['name']
-                            + "\n" + json.dumps(obj) + "\n\n")
+    The objects the correlation rules join are kept, and correlated per
+    project once the whole file is read.
+    """
+    correlated = set()
+    if 'correlations' in checks:
+        correlated.update(get_index('correlations').checks)
+    listings = collections.defaultdict(lambda: collections.defaultdict(list))
+
+    wanted = set(checks) | correlated
+    ids, firewalls = assets.scan(path, 'instances' in wanted)
+    index = FirewallIndex(firewalls) if 'instances' in wanted else None
+
+    count = 0
+    counts = collections.Counter()
+    numbers = set()
+    for project, name, obj in assets.read_objects(path, wanted, ids, index):
+        counts[name] += 1
+        if project.isdigit():
+            numbers.add(project)
+        if projects and project not in projects:
+            continue
+        if not in_shard(project, shard):
+            continue
+        if name in correlated:
+            listings[project][name].append(obj)
+        if name not in checks:
+            continue
+        count += 1
+        report_matches([(obj, rule, None)
+                        for rule in match_object(get_index(name), obj)],
+                       name, checks[name]['descfield'], sink, project)
+
+    correlator = get_index('correlations') if correlated else None
+    for project in sorted(listings):
+        report_matches([(obj, rule, None) for obj, rules
+                        in correlator.correlate(listings[project])
+                        for rule in rules],
+                       'correlations', checks['correlations']['descfield'],
+                       sink, project)
+
+    if numbers:
+        print colored('WARNING:', 'yellow'), \
+            "%d projects are only known by number, as the export holds " \
+            "no project assets for them: %s" % (
+                len(numbers), ', '.join(sorted(numbers)))
+    missing = sorted(name for name in wanted
+                     if name in assets.exported and not counts[name])
+    if missing:
+        print colored('WARNING:', 'yellow'), \
+            "the export holds no objects for these checks: %s%s" % (
+                ', '.join(missing), " (IAM policies are only exported "
+                "with --content-type iam-policy)" if 'iam' in missing
+                else "")
+    return count
 
 
 def apply_rule_filters(obj, filters, filtercondition='and'):
     res = True
 
     for f in filters:
-        if 'listcondition' in f:
-            res = filterjson(obj,
-                             f['filter'],
-                             f['matchtype'],
-                             f['listcondition'])
-        else:
-            res = filterjson(obj, f['filter'], f['matchtype'])
+        res = filterjson(obj, f['filter'], f['matchtype'],
+                         f.get('listcondition', 'or'), f.get('matchtypes'))
 
         if ((filtercondition == 'or' and res) or
            (filtercondition == 'and' and not res)):
@@ -119,15 +583,29 @@ def apply_rule_filters(obj, filters, filtercondition='and'):
     return res
 
 
-def handle_signal(signal, frame):
-    print "SIGINT received. Exiting."
-    sys.exit(0)
+def handle_signal(signum, frame):
+    name = 'SIGTERM' if signum == signal.SIGTERM else 'SIGINT'
+    if scheduler is None or scheduler.stopped:
+        print "%s received. Exiting." % name
+        sys.exit(0)
+
+    print "%s received. Finishing the units in progress, send it again " \
+        "to exit right away." % name
+    scheduler.stop()
 
 
 def parse_options():
     def comma_split(str):
         return str.split(',')
 
+    def address(str):
+        host, _, port = str.rpartition(':')
+        return host or '127.0.0.1', int(port)
+
+    def check_interval(str):
+        check, _, seconds = str.partition('=')
+        return check, float(seconds)
+
     parser = ArgumentParser(description='A tool for auditing security \
                                          properties of GCP projects.',
                             epilog='gcp-audit needs a valid key for an account \
@@ -138,21 +616,291 @@ def parse_options():
                                     environment variable, \
                                     or via the -k parameter.')
     parser.add_argument('-c', '--checks',
-                        help='comma separated list of types of checks to run')
+                        help='comma separated list of types of checks to run \
+                              (default: all but correlations)')
     parser.add_argument('-k', '--keyfile',
                         help="keyfile to use for GCP credentials")
     parser.add_argument('-o', '--output',
                         help='file to output results to',
                         default='results.json')
+    parser.add_argument('-f', '--format',
+                        help='format of the results file: text (default), \
+                              jsonl (one finding per line) or json (a \
+                              single document)',
+                        choices=sorted(sinks), default='text')
+    parser.add_argument('-z', '--compress',
+                        help='gzip the results file',
+                        action='store_true')
+    parser.add_argument('-i', '--incremental',
+                        help='only evaluate objects that changed since the \
+                              previous run, and report findings as new, \
+                              resolved or still present',
+                        action='store_true')
+    parser.add_argument('--snapshot-file',
+                        help='file to keep the state of incremental runs in',
+                        default='snapshot.db')
+    parser.add_argument('--resume',
+                        help='continue an interrupted run, skipping the \
+                              projects and checks it completed',
+                        action='store_true')
+    parser.add_argument('--checkpoint-file',
+                        help='file to record completed units in (default: \
+                              the results file with .checkpoint appended)')
+    parser.add_argument('--rate-limit',
+                        help='maximum API calls per second and service, \
+                              lowered automatically on quota errors \
+                              (default: no limit until the first quota \
+                              error)',
+                        type=float)
+    parser.add_argument('--retries',
+                        help='times to retry quota, server and network \
+                              errors',
+                        type=int, default=gcp.max_retries)
+    parser.add_argument('--cache-dir',
+                        help='directory to cache API responses in')
+    parser.add_argument('--cache-ttl',
+                        help='seconds to reuse cached API responses for',
+                        type=int, default=3600)
+    parser.add_argument('--cache-size',
+                        help='maximum size of the response cache in MB',
+                        type=int, default=1024)
+    parser.add_argument('--replay',
+                        help='work offline from the response cache only',
+                        action='store_true')
+    parser.add_argument('--assets',
+                        help='audit the resources in a Cloud Asset \
+                              Inventory export (newline-delimited JSON, \
+                              optionally gzipped) instead of calling the \
+                              APIs')
     parser.add_argument('-p', '--projects',
                         help='comma separated list of GCP projects to audit',
                         type=comma_split)
+    parser.add_argument('--shard',
+                        help='only audit the projects that hash to shard \
+                              INDEX out of COUNT, e.g. 0/4, and combine the \
+                              results with gcp-audit merge')
+    parser.add_argument('-w', '--workers',
+                        help='number of (project, check) units to audit \
+                              concurrently',
+                        type=int, default=1)
+    parser.add_argument('--project-workers',
+                        help='maximum number of concurrent units per \
+                              project (default: no limit besides -w)',
+                        type=int)
+    parser.add_argument('--batch-size',
+                        help='number of bucket ACL lookups to group into \
+                              one batch request, at most %d, 1 disables \
+                              batching' % gcp.MAX_BATCH_SIZE,
+                        type=int, default=gcp.batch_size)
+    parser.add_argument('--inline-acls',
+                        help='list buckets with their ACLs (full \
+                              projection), and only look up the ACLs of \
+                              buckets the listing leaves them out of',
+                        action='store_true')
+    parser.add_argument('--columnar',
+                        help='evaluate the firewall rules column by column, \
+                              over batches of this many objects',
+                        type=int, default=0, metavar='BATCH')
+    parser.add_argument('--rules-bundle',
+                        help='bundle written by compile-rules to load the \
+                              rules from',
+                        default=rules_bundle, metavar='FILE')
+    parser.add_argument('--memo-size',
+                        help='remember the rule results of up to this many \
+                              distinct objects per category, and only \
+                              evaluate the rules once for objects that are \
+                              the same in the keys the rules read',
+                        type=int, default=0, metavar='OBJECTS')
+    parser.add_argument('--engine',
+                        help='make blocking API calls from -w threads \
+                              (default), or run units as greenlets with \
+                              non-blocking I/O (async, requires gevent)',
+                        choices=engine.engines, default='threads')
+    parser.add_argument('--max-inflight',
+                        help='maximum number of concurrent API requests \
+                              with the async engine',
+                        type=int, default=100)
+    parser.add_argument('--metrics-out',
+                        help='record API calls, stage and rule timings, \
+                              print a summary and write them to this file \
+                              (Prometheus textfile if it ends in .prom, \
+                              else JSON)')
+    parser.add_argument('--serve',
+                        help='keep running, audit the projects on a \
+                              schedule, and serve the latest findings, \
+                              health and metrics over HTTP on this \
+                              [HOST:]PORT',
+                        type=address, metavar='[HOST:]PORT')
+    parser.add_argument('--every',
+                        help='seconds between the rounds of each check \
+                              with --serve',
+                        type=float, default=3600)
+    parser.add_argument('--check-every',
+                        help='seconds between the rounds of one check, \
+                              e.g. firewalls=600; can be repeated',
+                        type=check_interval, action='append', default=[],
+                        metavar='CHECK=SECONDS')
+    parser.add_argument('--projects-every',
+                        help='seconds between listings of the projects \
+                              with --serve',
+                        type=float, default=6 * 3600)
 
     options = parser.parse_args()
 
+    if options.replay and not options.cache_dir:
+        parser.error('--replay requires --cache-dir')
+    if options.assets and options.incremental:
+        parser.error('--incremental cannot be used with --assets')
+    if options.resume and (options.assets or options.compress or
+                           options.format == 'json'):
+        parser.error('--resume cannot be used with --assets, -z or -f json')
+    if not 1 <= options.batch_size <= gcp.MAX_BATCH_SIZE:
+        parser.error('--batch-size must be between 1 and %d'
+                     % gcp.MAX_BATCH_SIZE)
+    if options.engine == 'async' and not engine.available():
+        parser.error('--engine async requires gevent')
+    if options.shard:
+        try:
+            options.shard = parse_shard(options.shard)
+        except ValueError as e:
+            parser.error(str(e))
+    if options.serve and (options.assets or options.incremental or
+                          options.resume):
+        parser.error('--serve cannot be used with --assets, --incremental '
+                     'or --resume')
+    for check, _ in options.check_every:
+        if check not in checks:
+            parser.error("--check-every: unknown check '%s'" % check)
+
     return options
 
 
+def parse_merge_options(args):
+    parser = ArgumentParser(prog='gcp-audit merge',
+                            description='Combine the results files of \
+                                         several gcp-audit runs, e.g. the \
+                                         shards of an audit, into one \
+                                         report without duplicates.')
+    parser.add_argument('results', nargs='+',
+                        help='json or jsonl results files to merge')
+    parser.add_argument('-o', '--output', required=True,
+                        help='file to write the merged results to')
+    parser.add_argument('-f', '--format',
+                        help='format of the merged results (default: jsonl)',
+                        choices=sorted(sinks), default='jsonl')
+    parser.add_argument('-z', '--compress',
+                        help='gzip the merged results',
+                        action='store_true')
+    parser.add_argument('--metrics', nargs='+', default=[],
+                        help='JSON metrics files of the runs to combine')
+    parser.add_argument('--metrics-out',
+                        help='write the combined metrics to this file')
+
+    options = parser.parse_args(args)
+
+    output = os.path.abspath(options.output)
+    if output in map(os.path.abspath, options.results):
+        parser.error('the output cannot be one of the results files')
+    if options.metrics_out and not options.metrics:
+        parser.error('--metrics-out requires --metrics')
+
+    return options
+
+
+def merge_main(args):
+    options = parse_merge_options(args)
+
+    try:
+        findings = merge.merge(options.results)
+        for path in options.metrics:
+            with open(path) as f:
+                metrics.load(json.load(f))
+    except (IOError, ValueError) as e:
+        print colored('ERROR:', 'red'), "Could not merge: %s" % e
+        sys.exit(1)
+
+    # the text and jsonl sinks append
+    if os.path.exists(options.output):
+        os.remove(options.output)
+    with open_sink(options.output, options.format,
+                   options.compress) as sink:
+        for finding in findings:
+            sink.write(finding['project'], finding['check'],
+                       finding['object'], {'name': finding['rule']},
+                       finding.get('data'), finding.get('status'),
+                       finding['time'])
+
+    print '%d findings merged from %d files' % (len(findings),
+                                                len(options.results))
+    if options.metrics:
+        for line in metrics.summary():
+            print line
+    if options.metrics_out:
+        metrics.write(options.metrics_out)
+    print colored('DONE', 'green'), \
+        ' - merged results have been written to %s' % options.output
+
+
+def log(message):
+    print '%s %s' % (datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                     message)
+    sys.stdout.flush()
+
+
+def new_round():
+    """Forget the listings and failures of the previous round of --serve."""
+    gcp.forget_listings()
+    del gcp.failures[:]
+
+
+def serve(options):
+    """Audit the projects on a schedule until a signal comes."""
+    global scheduler
+
+    # record what the rules were loaded from, for hot reloading
+    for ruletype, error in reload_rules():
+        if error is not None:
+            print colored('ERROR:', 'red'), "Invalid rule: %s" % error
+            sys.exit(1)
+
+    intervals = dict((name, options.every) for name in checks)
+    intervals.update((name, seconds) for name, seconds
+                     in options.check_every if name in checks)
+
+    auditor = daemon.Daemon(audit_unit, intervals,
+                            lambda: list_projects(options.projects,
+                                                  options.shard),
+                            options.projects_every, reload_rules,
+                            workers=options.workers,
+                            per_project=options.project_workers,
+                            new_round=new_round, log=log)
+    scheduler = auditor.scheduler
+
+    host, port = options.serve
+    try:
+        server = daemon.serve(auditor, host, port)
+    except (IOError, OSError) as e:
+        print colored('ERROR:', 'red'), "Cannot listen on %s:%d: %s" % (
+            host, port, e)
+        sys.exit(1)
+    log('Serving /findings, /health and /metrics on http://%s:%d/'
+        % server.server_address)
+
+    auditor.run()
+    server.shutdown()
+    log('Stopped')
+
+
+def write_metrics(path, start):
+    metrics.record('stage', 'run', start)
+    for line in metrics.summary():
+        print line
+    try:
+        metrics.write(path)
+    except (IOError, OSError) as e:
+        print colored('ERROR:', 'red'), "Could not write metrics: %s" % e
+
+
 def restore_env_credentials():
     if env_credentials:
         os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = env_credentials
@@ -163,14 +911,37 @@ def restore_env_credentials():
 def main():
     global checks
     global env_credentials
+    global snapshots
+    global batch_eval, memo_size
+    global scheduler
+    global rules_bundle
+
+    if sys.argv[1:2] == ['merge']:
+        return merge_main(sys.argv[2:])
+    if sys.argv[1:2] == ['compile-rules']:
+        return compile_rules_main(sys.argv[2:])
 
     options = parse_options()
 
+    if options.engine == 'async':
+        # before any lock or connection is made
+        engine.install(options.max_inflight)
+        gcp.init_engine()
+    if options.metrics_out or options.serve:
+        metrics.enable()
+    if options.metrics_out:
+        atexit.register(write_metrics, options.metrics_out, metrics.clock())
+
     signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
 
+    rules_bundle = options.rules_bundle
     if options.checks:
         checks = dict((k, v) for k, v in checks.iteritems()
                       if k in options.checks.split(','))
+    else:
+        checks = dict((k, v) for k, v in checks.iteritems()
+                      if not v.get('optional'))
 
     if options.keyfile:
         if 'GOOGLE_APPLICATION_CREDENTIALS' in os.environ:
@@ -178,20 +949,126 @@ def main():
         atexit.register(restore_env_credentials)
         os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = options.keyfile
 
-    if options.projects:
-        projects = options.projects
-    else:
-        projects = gcp.get_all_projects()
+    gcp.batch_size = options.batch_size
+    gcp.inline_acls = options.inline_acls
+    batch_eval = options.columnar
+    memo_size = options.memo_size
+    gcp.max_retries = options.retries
+    gcp.limiter = RateLimiter(options.rate_limit)
+
+    if options.cache_dir:
+        gcp.cache = ResponseCache(options.cache_dir, options.cache_ttl,
+                                  options.cache_size << 20, options.replay)
+
+    try:
+        for name in checks:
+            get_rules(name)
+    except ValueError as e:
+        print colored('ERROR:', 'red'), "Invalid rule: %s" % e
+        sys.exit(1)
+
+    # the firewalls are only kept whole when instances are audited
+    gcp.index_firewalls = 'instances' in checks or (
+        'correlations' in checks and
+        'instances' in get_index('correlations').checks)
 
-    for project in projects:
-        print colored('Project:', 'blue'), project
-        for name, check in checks.iteritems():
+    if options.incremental:
+        snapshots = snapshot.SnapshotStore(options.snapshot_file)
+
+    if options.assets:
+        with open_sink(options.output, options.format,
+                       options.compress) as sink:
             try:
-                res = check['func'](project)
-                apply_rules(name, res, check['descfield'],
-                            options.output, project)
-            except googleapiclient.errors.HttpError:
-                print colored('ERROR:', 'red'), "Permission denied?"
+                count = audit_assets(options.assets, sink, options.projects,
+                                     options.shard)
+            except (IOError, ValueError) as e:
+                print colored('ERROR:', 'red'), \
+                    "Could not read asset export: %s" % e
+                sys.exit(1)
+        print '%d objects audited from %s' % (count, options.assets)
+        print colored('DONE', 'green'), \
+            ' - results (if any) have been written to %s' % options.output
+        return
+
+    if options.serve:
+        return serve(options)
+
+    projects = list_projects(options.projects, options.shard)
+
+    units = [(project, name) for project in projects for name in checks]
+
+    # findings can only be cut back to a unit boundary in plain files
+    checkpoint = None
+    if options.format != 'json' and not options.compress:
+        try:
+            checkpoint = Checkpoint(options.checkpoint_file or
+                                    options.output + '.checkpoint',
+                                    options.output, options.resume)
+        except ValueError as e:
+            print colored('ERROR:', 'red'), "Cannot resume: %s" % e
+            sys.exit(1)
+
+    if options.resume and checkpoint is not None:
+        checkpoint.truncate()
+        done = checkpoint.done()
+        if done:
+            units = [unit for unit in units if unit not in done]
+            print 'Resuming, %d units were already done' % len(done)
+
+    scheduler = Scheduler(run_check, options.workers,
+                          options.project_workers)
+    current = None
+    totals = collections.Counter()
+    finished = 0
+
+    with open_sink(options.output, options.format,
+                   options.compress) as sink:
+        for unit, matches, exc_info in scheduler.run(units):
+            if unit.project != current:
+                current = unit.project
+                print colored('Project:', 'blue'), current
+
+            finished += 1
+            if exc_info is None:
+                totals.update(status for _, _, status in matches)
+                report_matches(matches, unit.check,
+                               checks[unit.check]['descfield'], sink,
+                               unit.project)
+                if checkpoint is not None:
+                    checkpoint.record(unit.project, unit.check, sink.sync())
+            elif isinstance(exc_info[1], CacheMiss):
+                print colored('ERROR:', 'red'), \
+                    "Response not in cache: %s" % exc_info[1]
+            elif isinstance(exc_info[1], gcp.FetchError):
+                hint = " (permission denied?)" \
+                    if exc_info[1].status == 403 else ""
+                print colored('ERROR:', 'red'), \
+                    "Could not fetch %s: %s%s" % (unit.check, exc_info[1],
+                                                  hint)
+            else:
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+    if gcp.failures:
+        print colored('WARNING:', 'yellow'), \
+            "%d requests failed after retries, these objects were not " \
+            "audited:" % len(gcp.failures)
+        for error in gcp.failures:
+            print '  %s' % error
+
+    if snapshots is not None:
+        print '%d new, %d resolved and %d still present findings' % \
+            (totals[snapshot.NEW], totals[snapshot.RESOLVED],
+             totals[snapshot.PRESENT])
+
+    if scheduler.stopped:
+        print colored('INTERRUPTED:', 'yellow'), \
+            "%d units were not audited%s" % (
+                len(units) - finished,
+                ", run again with --resume to audit them"
+                if checkpoint is not None else "")
+        sys.exit(1)
+    if checkpoint is not None:
+        checkpoint.finish()
 
     print colored('DONE', 'green'), \
         ' - results (if any) have been written to %s' % options.output
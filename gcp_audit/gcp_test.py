@@ -0,0 +1,502 @@
+import json
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from util import gcp
+from util.cache import ResponseCache
+from util.ratelimit import RateLimiter, TokenBucket, retryable
+
+
+class FakeCredentials(object):
+
+    @staticmethod
+    def get_application_default():
+        return FakeCredentials()
+
+    def authorize(self, http):
+        return http
+
+
+class FakeHttplib2(object):
+
+    class Http(object):
+        pass
+
+
+class FakeDiscovery(object):
+
+    def __init__(self):
+        self.builds = []
+
+    def build(self, service, version, http=None, cache_discovery=True):
+        self.builds.append((service, version))
+        resource = FakeResource(http)
+        resource._rootDesc = {'name': service, 'version': version}
+        return resource
+
+    def build_from_document(self, document, http=None):
+        return FakeResource(http)
+
+
+class FakeResource(object):
+
+    def __init__(self, http):
+        self.http = http
+
+
+class TestServiceRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = gcp.discovery, gcp.GoogleCredentials, gcp.httplib2
+        gcp.discovery = FakeDiscovery()
+        gcp.GoogleCredentials = FakeCredentials
+        gcp.httplib2 = FakeHttplib2
+        gcp._local = threading.local()
+        gcp._credentials.clear()
+        gcp._documents.clear()
+
+    def tearDown(self):
+        gcp.discovery, gcp.GoogleCredentials, gcp.httplib2 = self.saved
+
+    def test_service_reused(self):
+        first = gcp.create_service('storage')
+        second = gcp.create_service('storage')
+        compute = gcp.create_service('compute')
+
+        self.assertIs(first, second)
+        self.assertIs(first.http, compute.http)
+        self.assertEqual(gcp.discovery.builds,
+                         [('storage', 'v1'), ('compute', 'v1')])
+
+    def test_service_per_thread(self):
+        services = []
+
+        def create():
+            services.append(gcp.create_service('storage'))
+
+        threads = [threading.Thread(target=create) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(set(id(s.http) for s in services)), 4)
+        self.assertEqual(gcp.discovery.builds, [('storage', 'v1')])
+
+
+class FakeError(Exception):
+
+    def __init__(self, status):
+        self.resp = type('Response', (object,), {'status': status})
+        self.content = ''
+
+
+class Always(dict):
+
+    def __init__(self, status):
+        self.status = status
+
+    def pop(self, key, default=None):
+        return self.status
+
+
+BINDINGS = [{'role': 'roles/storage.objectAdmin', 'members': ['allUsers']}]
+
+
+class FakeBatch(object):
+
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.ids = []
+
+    def add(self, request, request_id=None):
+        self.ids.append(request_id)
+
+    def execute(self):
+        self.service.batches.append(self.ids)
+        if self.service.batch_errors:
+            raise self.service.batch_errors.pop(0)
+        for request_id in self.ids:
+            status = self.service.errors.pop(request_id, None)
+            if status:
+                self.callback(request_id, None, FakeError(status))
+            else:
+                self.callback(request_id, {'items': [request_id],
+                                           'bindings': BINDINGS}, None)
+
+
+class FakeStorage(object):
+
+    def __init__(self, errors, batch_errors=()):
+        self.errors = errors
+        self.batch_errors = list(batch_errors)
+        self.batches = []
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def bucketAccessControls(self):
+        return self
+
+    def buckets(self):
+        return self
+
+    def list(self, bucket):
+        return None
+
+    def getIamPolicy(self, bucket):
+        return None
+
+
+class TestBatchList(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = gcp.create_service, gcp.batch_size, gcp.backoff, \
+            gcp.get_buckets, gcp.inline_acls
+        gcp.backoff = lambda attempt: 0
+        del gcp.failures[:]
+
+    def tearDown(self):
+        gcp.create_service, gcp.batch_size, gcp.backoff, gcp.get_buckets, \
+            gcp.inline_acls = self.saved
+        gcp.forget_listings()
+        del gcp.failures[:]
+
+    def test_batches_and_retries(self):
+        storage = FakeStorage({'b1': 503, 'b2': 403})
+        gcp.create_service = lambda service, version='v1': storage
+        gcp.batch_size = 2
+
+        failed = set()
+        res = gcp.batch_list('bucketAccessControls',
+                             ['b0', 'b1', 'b2', 'b3', 'b4'], failed=failed)
+
+        self.assertEqual(storage.batches,
+                         [['b0', 'b1'], ['b2', 'b3'], ['b4'], ['b1']])
+        self.assertEqual(res, {'b0': ['b0'], 'b1': ['b1'], 'b2': [],
+                               'b3': ['b3'], 'b4': ['b4']})
+        self.assertEqual([(e.target, e.status) for e in gcp.failures],
+                         [('b2', 403)])
+        self.assertEqual(failed, set(['b2']))
+
+    def test_batch_errors(self):
+        # the whole batch fails, once with a retryable error
+        storage = FakeStorage({}, [FakeError(503), FakeError(400)])
+        gcp.create_service = lambda service, version='v1': storage
+
+        failed = set()
+        res = gcp.batch_list('bucketAccessControls', ['b0', 'b1'],
+                             failed=failed)
+
+        self.assertEqual(len(storage.batches), 2)
+        self.assertEqual(res, {'b0': [], 'b1': []})
+        self.assertEqual([(e.target, e.status) for e in gcp.failures],
+                         [('b0', 400), ('b1', 400)])
+        self.assertEqual(failed, set(['b0', 'b1']))
+
+    def test_gives_up_after_retries(self):
+        storage = FakeStorage(Always(429))
+        gcp.create_service = lambda service, version='v1': storage
+
+        res = gcp.batch_list('bucketAccessControls', ['b0'])
+
+        self.assertEqual(len(storage.batches), gcp.max_retries + 1)
+        self.assertEqual(res, {'b0': []})
+        self.assertEqual([(e.target, e.status) for e in gcp.failures],
+                         [('b0', 429)])
+
+
+    def test_inline_acls_and_uniform_access(self):
+        storage = FakeStorage({})
+        gcp.create_service = lambda service, version='v1': storage
+        gcp.get_buckets = lambda project: [
+            {'name': 'b0', 'acl': [{'entity': 'allUsers'}]},
+            {'name': 'b1'},
+            {'name': 'b2', 'acl': [],
+             'iamConfiguration': {'uniformBucketLevelAccess':
+                                  {'enabled': True}}}]
+        gcp.inline_acls = True
+
+        res = list(gcp.get_acls_for_buckets('p1'))
+
+        self.assertEqual(storage.batches, [['b1'], ['b2']])
+        self.assertEqual(res, [
+            {'entity': 'allUsers', 'bucket': 'b0'}, 'b1',
+            {'kind': 'storage#policyBinding', 'bucket': 'b2',
+             'entity': 'allUsers', 'role': 'roles/storage.objectAdmin'}])
+
+
+class FakePages(object):
+
+    methodId = 'compute.firewalls.list'
+    uri = 'https://example.com/firewalls'
+
+    def __init__(self, pages):
+        self.pages = pages
+
+    def execute(self):
+        page = self.pages[0]
+        if isinstance(page, Exception):
+            raise page
+        return page
+
+    def list_next(self, previous_request, previous_response):
+        if 'nextPageToken' not in previous_response:
+            return None
+        return FakePages(previous_request.pages[1:])
+
+
+class FakeResponse(object):
+
+    def __init__(self, status):
+        self.status = status
+
+
+class FakeRawPages(FakePages):
+    """Pages as JSON bodies, parsed by a postproc like the API client's."""
+
+    @property
+    def uri(self):
+        return 'https://example.com/firewalls?page=%d' % len(self.pages)
+
+    def postproc(self, resp, content):
+        if resp.status >= 300:
+            raise FakeError(resp.status)
+        return json.loads(content)
+
+    def execute(self):
+        page = self.pages[0]
+        if isinstance(page, Exception):
+            return self.postproc(FakeResponse(page.resp.status), '')
+        return self.postproc(FakeResponse(200), json.dumps(page))
+
+    def list_next(self, previous_request, previous_response):
+        if 'nextPageToken' not in previous_response:
+            return None
+        return FakeRawPages(previous_request.pages[1:])
+
+
+class TestPagination(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = gcp.backoff, gcp.limiter
+        gcp.backoff = lambda attempt: 0
+
+    def tearDown(self):
+        gcp.backoff, gcp.limiter = self.saved
+        del gcp.failures[:]
+
+    def test_follows_page_tokens(self):
+        pages = FakePages([{'items': [1, 2], 'nextPageToken': 'a'},
+                           {'nextPageToken': 'b'},
+                           {'items': [3]}])
+
+        self.assertEqual(list(gcp.paginate(pages, pages)), [1, 2, 3])
+
+    def test_streams_pages_through_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        gcp.cache = ResponseCache(directory)
+        self.addCleanup(setattr, gcp, 'cache', None)
+
+        pages = FakeRawPages([{'items': [{'a': 1}, 2], 'nextPageToken': 'a'},
+                              {'nextPageToken': 'b'},
+                              {'items': [3], 'kind': 'x'}])
+        self.assertEqual(list(gcp.paginate(pages, pages)), [{'a': 1}, 2, 3])
+
+        # served from the cache, without calling the API
+        pages = FakeRawPages([FakeError(500)] * 3)
+        self.assertEqual(list(gcp.paginate(pages, pages)), [{'a': 1}, 2, 3])
+
+    def test_raw_pages_fail(self):
+        pages = FakeRawPages([{'items': [1], 'nextPageToken': 'a'},
+                              FakeError(404)])
+        items = gcp.paginate(pages, pages)
+        self.assertEqual(next(items), 1)
+        self.assertRaises(gcp.FetchError, list, items)
+        self.assertEqual(len(gcp.failures), 1)
+
+    def test_stops_on_error(self):
+        pages = FakePages([{'items': [1], 'nextPageToken': 'a'},
+                           ValueError()])
+
+        items = gcp.paginate(pages, pages)
+        self.assertEqual(next(items), 1)
+        self.assertRaises(gcp.FetchError, list, items)
+        self.assertEqual(len(gcp.failures), 1)
+
+    def test_retries_and_throttles(self):
+        errors = [FakeError(503), FakeError(429)]
+        gcp.limiter = RateLimiter()
+        limiter = gcp.limiter.bucket('compute')
+
+        def func():
+            if errors:
+                raise errors.pop(0)
+            return 'ok'
+
+        self.assertIsNone(limiter.rate)
+        self.assertEqual(gcp.call('compute.firewalls.list', func), 'ok')
+        self.assertIsNotNone(limiter.rate)
+        self.assertIsNone(limiter.max_rate)
+
+    def test_rate_climbs_back(self):
+        bucket = TokenBucket(10)
+        bucket.throttled()
+        self.assertEqual(bucket.rate, 5)
+        for i in range(200):
+            bucket.succeeded()
+        self.assertEqual(bucket.rate, 10)
+
+        bucket = TokenBucket()
+        bucket.acquire(40)
+        bucket.throttled()
+        rate = bucket.rate
+        for i in range(200):
+            bucket.succeeded()
+        self.assertGreater(bucket.rate, 2 * rate)
+
+    def test_retryable(self):
+        self.assertTrue(retryable(FakeError(503)))
+        self.assertTrue(retryable(FakeError(429)))
+        self.assertFalse(retryable(FakeError(404)))
+        self.assertTrue(retryable(socket.error()))
+        self.assertTrue(retryable(socket.timeout()))
+        self.assertFalse(retryable(KeyError('items')))
+        self.assertFalse(retryable(ValueError()))
+
+
+class FakeCollection(object):
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = 0
+
+    def list(self, **params):
+        self.calls += 1
+        return FakePages(self.pages)
+
+    aggregatedList = getIamPolicy = list
+
+    def list_next(self, previous_request, previous_response):
+        if 'nextPageToken' not in previous_response:
+            return None
+        return FakePages(previous_request.pages[1:])
+
+    aggregatedList_next = list_next
+
+
+class FakeService(object):
+
+    def __init__(self, **collections):
+        self.collections = collections
+
+    def __getattr__(self, name):
+        return lambda: self.collections[name]
+
+
+class TestInstancesAndPolicies(unittest.TestCase):
+
+    network = 'https://www.googleapis.com/compute/v1/projects/%s/global/' \
+        'networks/default'
+
+    def setUp(self):
+        self.saved = gcp.create_service
+
+    def tearDown(self):
+        gcp.create_service = self.saved
+        gcp.index_firewalls = False
+        del gcp.failures[:]
+        gcp.forget_listings()
+
+    def test_instances_with_firewalls(self):
+        firewalls = FakeCollection([
+            {'items': [{'name': 'open', 'network': self.network % 'host',
+                        'allowed': [{}]}], 'nextPageToken': 'a'},
+            {'items': [{'name': 'web', 'network': self.network % 'host',
+                        'allowed': [{}], 'targetTags': ['web'],
+                        'id': '1'}]}])
+        instances = FakeCollection([
+            {'items': {'zones/a': {'instances': [
+                {'name': 'vm-0', 'tags': {'items': ['web']},
+                 'networkInterfaces': [
+                     {'network': self.network % 'host'}]}]},
+                'zones/b': {'warning': {}}}, 'nextPageToken': 'a'},
+            {'items': {'zones/b': {'instances': [
+                {'name': 'vm-1', 'networkInterfaces': [
+                    {'network': self.network % 'host'}]},
+                {'name': 'vm-2'}]}}}])
+        compute = FakeService(firewalls=firewalls, instances=instances)
+        gcp.create_service = lambda service, version='v1': compute
+        gcp.index_firewalls = True
+
+        res = [(vm['name'], [f['name'] for f in vm['firewalls']])
+               for vm in gcp.get_instances('service')]
+        self.assertEqual(res, [('vm-0', ['open', 'web']),
+                               ('vm-1', ['open']), ('vm-2', [])])
+        # the firewalls of the host project are listed once, and shared
+        # with the firewalls check
+        self.assertEqual([f['name'] for f in gcp.get_firewalls('host')],
+                         ['open', 'web'])
+        self.assertEqual(firewalls.calls, 1)
+
+    def test_firewalls_streamed(self):
+        firewalls = FakeCollection([{'items': [{'name': 'a'}],
+                                     'nextPageToken': 'a'},
+                                    {'items': [{'name': 'b'}]}])
+        gcp.create_service = lambda service, version='v1': \
+            FakeService(firewalls=firewalls)
+
+        res = gcp.get_firewalls('p')
+        self.assertEqual(next(res)['name'], 'a')
+        # nothing is kept for the instances
+        self.assertEqual(len(gcp._listings), 0)
+        self.assertEqual([f['name'] for f in res], ['b'])
+
+    def test_host_project_firewalls_failing(self):
+        class Failing(object):
+            calls = 0
+
+            def list(self, **params):
+                self.calls += 1
+                raise gcp.record_failure('compute.firewalls.list', 'host',
+                                         'forbidden')
+
+        firewalls = Failing()
+        instances = FakeCollection([{'items': {'zones/a': {'instances': [
+            {'name': 'vm-%d' % i, 'selfLink': 'vm-%d' % i,
+             'networkInterfaces': [{'network': self.network % 'host'}]}
+            for i in range(2)]}}}])
+        gcp.create_service = lambda service, version='v1': \
+            FakeService(firewalls=firewalls, instances=instances)
+
+        failed = set()
+        res = [(vm['name'], vm['firewalls'])
+               for vm in gcp.get_instances('service', failed)]
+        self.assertEqual(res, [('vm-0', []), ('vm-1', [])])
+        self.assertEqual(failed, set(['vm-0', 'vm-1']))
+        # tried once, and recorded along with what it means
+        self.assertEqual(firewalls.calls, 1)
+        self.assertEqual(len(gcp.failures), 2)
+        self.assertIn('instances audited without', str(gcp.failures[1]))
+
+    def test_iam_bindings(self):
+        projects = FakeCollection([{'bindings': [
+            {'role': 'roles/owner', 'members': ['user:a', 'group:b']},
+            {'role': 'roles/viewer', 'members': ['allUsers'],
+             'condition': {'title': 't'}}]}])
+        gcp.create_service = lambda service, version='v1': \
+            FakeService(projects=projects)
+
+        self.assertEqual(list(gcp.get_iam_bindings('p')), [
+            {'kind': 'cloudresourcemanager#policyBinding', 'project': 'p',
+             'member': 'user:a', 'role': 'roles/owner'},
+            {'kind': 'cloudresourcemanager#policyBinding', 'project': 'p',
+             'member': 'group:b', 'role': 'roles/owner'},
+            {'kind': 'cloudresourcemanager#policyBinding', 'project': 'p',
+             'member': 'allUsers', 'role': 'roles/viewer',
+             'condition': {'title': 't'}}])
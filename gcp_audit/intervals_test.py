@@ -0,0 +1,46 @@
+import random
+import unittest
+
+from util.intervals import IntervalIndex, parse_cidr, parse_portrange
+
+
+class TestIntervals(unittest.TestCase):
+
+    def test_index_same_as_scan(self):
+        rnd = random.Random(4)
+        for _ in range(200):
+            intervals = []
+            for _ in range(rnd.randint(1, 8)):
+                start = rnd.randint(0, 50)
+                intervals.append((start, start + rnd.randint(0, 20)))
+            index = IntervalIndex(intervals)
+
+            start = rnd.randint(0, 60)
+            q = (start, start + rnd.randint(0, 20))
+            self.assertEqual(index.overlaps(q), any(
+                s <= q[1] and e >= q[0] for s, e in intervals))
+            self.assertEqual(index.within(q), any(
+                s <= q[0] and e >= q[1] for s, e in intervals))
+            self.assertEqual(index.outside(q), not index.within(q))
+            self.assertEqual(index.covers(q), any(
+                s >= q[0] and e <= q[1] for s, e in intervals))
+
+    def test_parse_cidr(self):
+        self.assertEqual(parse_cidr(u'10.1.2.3/8'),
+                         (10 << 24, (11 << 24) - 1, 8))
+        self.assertEqual(parse_cidr('0.0.0.1'), (1, 1, 32))
+
+        start, end, prefix = parse_cidr(u'::/0')
+        self.assertTrue(start > parse_cidr(u'0.0.0.0/0')[1])
+        self.assertEqual((end - start, prefix), ((1 << 128) - 1, 0))
+
+        for value in (u'10.0.0.0/33', u'10.0.0/8', u'host', None, 3):
+            self.assertRaises(ValueError, parse_cidr, value)
+
+    def test_parse_portrange(self):
+        self.assertEqual(parse_portrange(u'1000-2000'), (1000, 2000, 1001))
+        self.assertEqual(parse_portrange(u'22'), (22, 22, 1))
+        self.assertEqual(parse_portrange(443), (443, 443, 1))
+
+        for value in (u'2000-1000', u'70000', u'http', u'', True):
+            self.assertRaises(ValueError, parse_portrange, value)
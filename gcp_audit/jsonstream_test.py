@@ -0,0 +1,51 @@
+import json
+import unittest
+
+from StringIO import StringIO
+
+from util.jsonstream import iter_items
+
+
+class TestIterItems(unittest.TestCase):
+
+    page = {u'kind': u'compute#firewallList',
+            u'items': [{u'name': u'fw-%d' % i, u'size': i * 10 ** i,
+                        u'tags': [u'\xe9' * i, None, True, 1.5]}
+                       for i in range(20)],
+            u'nextPageToken': u'token'}
+
+    def test_items_and_rest(self):
+        text = json.dumps(self.page, indent=2)
+        # values that end a chunk are read on, numbers included
+        for chunk_size in (1, 2, 7, 1 << 16):
+            rest = {}
+            items = list(iter_items(StringIO(text), rest=rest,
+                                    chunk_size=chunk_size))
+            self.assertEqual(items, self.page[u'items'])
+            self.assertEqual(rest, {u'kind': u'compute#firewallList',
+                                    u'nextPageToken': u'token'})
+
+    def test_other_key(self):
+        text = json.dumps({u'projects': [1, 2], u'items': 3})
+        rest = {}
+        self.assertEqual(list(iter_items(StringIO(text), 'projects', rest)),
+                         [1, 2])
+        self.assertEqual(rest, {u'items': 3})
+
+    def test_empty(self):
+        for text in ('{}', ' { "items" : [ ] } ', '{"kind": "x"}'):
+            self.assertEqual(list(iter_items(StringIO(text))), [])
+
+    def test_invalid(self):
+        for text in ('', '[1]', '{"items": [1, 2', '{"items": [1}',
+                     '{1: 2}', '{"items": [tru]}'):
+            self.assertRaises(ValueError, list, iter_items(StringIO(text)))
+
+    def test_aggregated(self):
+        text = json.dumps({u'items': {u'zones/a': {u'instances': [1]},
+                                      u'zones/b': {u'warning': {}}},
+                           u'nextPageToken': u't'})
+        rest = {}
+        self.assertEqual(sorted(iter_items(StringIO(text), rest=rest)),
+                         [{u'instances': [1]}, {u'warning': {}}])
+        self.assertEqual(rest, {u'nextPageToken': u't'})
@@ -0,0 +1,99 @@
+import unittest
+
+import gcp_audit
+from util.memo import RuleMemo, freeze, read_keys
+from util.ruleindex import RuleIndex
+
+
+def run(obj, rule, match):
+    return bool(match(obj))
+
+
+class TestRuleMemo(unittest.TestCase):
+
+    rules = [
+        {u'name': u'open', u'filters': [
+            {u'matchtype': u'cidr',
+             u'filter': {u'sourceRanges': u'overlaps 0.0.0.0/0'}}]},
+        {u'name': u'notags', u'filters': [
+            {u'matchtype': u'count', u'filter': {u'targetTags': u'eq 0'}}]},
+        {u'name': u'anything', u'filters': [
+            {u'matchtype': u'exact', u'filter': u'ssh'}]},
+        {u'name': u'open and one', u'filters': [
+            {u'matchtype': u'cidr',
+             u'filter': {u'sourceRanges': u'overlaps 0.0.0.0/0'}},
+            {u'matchtype': u'exact', u'filter': {u'size': 1}}]},
+    ]
+
+    objects = [
+        {u'name': u'a', u'sourceRanges': [u'0.0.0.0/0']},
+        {u'name': u'b', u'sourceRanges': [u'0.0.0.0/0']},
+        {u'name': u'ssh', u'sourceRanges': [u'10.0.0.0/8'],
+         u'targetTags': [u'x']},
+        {u'name': u'c', u'sourceRanges': [u'0.0.0.0/0'], u'size': 1},
+        {u'name': u'd', u'sourceRanges': [u'0.0.0.0/0'], u'size': True},
+        {u'name': u'e', u'sourceRanges': [u'0.0.0.0/0'], u'size': 1.0},
+        {u'name': u'f', u'sourceRanges': [u'0.0.0.0/0'], u'size': 1},
+        [u'ssh'],
+    ]
+
+    def setUp(self):
+        self.compiled = [(rule, gcp_audit.compile_rule(rule))
+                         for rule in self.rules]
+        self.memo = RuleMemo(RuleIndex(self.compiled), 'firewalls')
+
+    def test_same_results(self):
+        for obj in self.objects:
+            expected = [rule['name'] for rule, match in self.compiled
+                        if match(obj)]
+            pairs, _ = self.memo.match(obj, run)
+            self.assertEqual([rule['name'] for rule, _ in pairs], expected)
+
+    def test_hits(self):
+        hits = [self.memo.match(obj, run)[1] for obj in self.objects]
+        # b is a and f is c to the rules, but 1, 1.0 and True are not
+        self.assertEqual(hits, [False, True, False, False, False, False,
+                                True, None])
+
+    def test_keys_per_rule(self):
+        named = {u'name': u'named', u'filters': [
+            {u'matchtype': u'regex', u'filter': {u'name': u'^db-'}}]}
+        compiled = self.compiled[:2] + [(named,
+                                         gcp_audit.compile_rule(named))]
+        memo = RuleMemo(RuleIndex(compiled), 'firewalls')
+        calls = []
+
+        def counted(obj, rule, match):
+            calls.append(rule['name'])
+            return run(obj, rule, match)
+
+        for name in (u'db-1', u'db-2', u'web'):
+            pairs, hit = memo.match({u'name': name,
+                                     u'sourceRanges': [u'0.0.0.0/0']},
+                                    counted)
+            self.assertFalse(hit)
+        self.assertEqual([rule['name'] for rule, _ in pairs],
+                         [u'open', u'notags'])
+        # a rule reading the name does not make the others run again
+        self.assertEqual(sorted(calls), [u'named'] * 3 +
+                         [u'notags', u'open'])
+
+    def test_size(self):
+        memo = RuleMemo(RuleIndex(self.compiled[3:]), 'firewalls', size=4)
+        for i in range(10):
+            memo.match({u'size': i}, run)
+        self.assertEqual(len(memo.recent), 2)
+        # a result used again is kept
+        for i in range(20):
+            self.assertEqual(memo.match({u'size': 0}, run)[1], i > 0)
+            memo.match({u'size': 100 + i}, run)
+
+    def test_read_keys(self):
+        self.assertEqual(read_keys(self.rules[3]), (u'size', u'sourceRanges'))
+        self.assertIsNone(read_keys(self.rules[2]))
+
+    def test_freeze(self):
+        self.assertEqual(freeze({u'a': [1, {u'b': u'c'}], u'd': None}),
+                         freeze({u'd': None, u'a': [1, {u'b': u'c'}]}))
+        self.assertNotEqual(freeze([1]), freeze([True]))
+        self.assertNotEqual(freeze([u'a']), freeze({u'a': None}))
@@ -0,0 +1,56 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from util.merge import merge
+from util.output import open_sink
+
+RULE = {'name': 'open'}
+
+
+class TestMerge(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def results(self, name, format, findings, compress=False):
+        path = os.path.join(self.dir, name)
+        with open_sink(path, format, compress) as sink:
+            for project, obj, data, day in findings:
+                sink.write(project, 'firewalls', obj, RULE, data,
+                           time=datetime.datetime(2017, 1, day, 12, 0))
+        return path
+
+    def test_merge(self):
+        paths = [self.results('0.jsonl', 'jsonl', [('p2', 'fw', 1, 2),
+                                                   ('p1', 'fw', 2, 1)]),
+                 self.results('1.json', 'json', [('p1', 'fw', 3, 2),
+                                                 ('p1', 'abc', 4, 1)]),
+                 self.results('2.gz', 'jsonl', [('p1', 'fw', 5, 1)], True),
+                 self.results('empty', 'jsonl', [])]
+
+        findings = merge(paths)
+
+        self.assertEqual([(f['project'], f['object'], f['data'])
+                          for f in findings],
+                         [('p1', 'abc', 4), ('p1', 'fw', 3), ('p2', 'fw', 1)])
+        self.assertEqual(findings[1]['time'],
+                         datetime.datetime(2017, 1, 2, 12, 0))
+
+    def test_text_results(self):
+        path = self.results('text', 'text', [('p1', 'fw', 1, 1)])
+
+        self.assertRaises(ValueError, merge, [path])
+
+    def test_not_findings(self):
+        path = os.path.join(self.dir, 'other.jsonl')
+        with open(path, 'w') as f:
+            f.write(json.dumps({'name': 'fw'}) + '\n')
+
+        self.assertRaises(ValueError, merge, [path])
@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from util import gcp, metrics
+
+
+class FakeRequest(object):
+
+    methodId = 'compute.firewalls.list'
+    uri = 'https://example.com/firewalls'
+
+    def __init__(self, content):
+        self.content = content
+
+    def postproc(self, resp, content):
+        return json.loads(content)
+
+    def execute(self):
+        return self.postproc(None, self.content)
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        metrics.reset()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        metrics.reset()
+
+    def test_disabled(self):
+        gcp.execute(FakeRequest('{}'))
+        metrics.record('stage', 'write', metrics.clock())
+
+        self.assertEqual(metrics.stats, {})
+        self.assertEqual(metrics.summary(), [])
+
+    def test_api_calls_per_project(self):
+        metrics.enable()
+        metrics.set_project('p1')
+        gcp.execute(FakeRequest('{"items": []}'))
+        gcp.execute(FakeRequest('{}'))
+        metrics.set_project('p2')
+        gcp.execute(FakeRequest('{}'))
+
+        p1 = metrics.stats['api', 'compute.firewalls.list', 'p1']
+        self.assertEqual((p1.count, p1.errors, p1.bytes), (2, 0, 15))
+        self.assertEqual(metrics.totals('api')['compute.firewalls.list']
+                         .count, 3)
+        self.assertEqual(sorted(metrics.totals('api', by='project')),
+                         ['p1', 'p2'])
+
+    def test_outputs(self):
+        metrics.enable()
+        metrics.record('rule', u'open \u2192 "all"', None, count=10,
+                       matches=2)
+        metrics.record('api', 'storage.buckets.list', None, errors=1,
+                       project='p1')
+        metrics.record('memo', 'firewalls', None, count=4, matches=3)
+
+        path = os.path.join(self.dir, 'metrics.json')
+        metrics.write(path)
+        with open(path) as f:
+            data = json.load(f)
+        self.assertEqual(data['rule'][0]['matches'], 2)
+        self.assertEqual(data['api'][0]['project'], 'p1')
+
+        path = os.path.join(self.dir, 'metrics.prom')
+        metrics.write(path)
+        with open(path) as f:
+            lines = f.read().decode('utf-8').splitlines()
+        self.assertIn(u'gcp_audit_rule_matches_total'
+                      u'{name="open \u2192 \\"all\\""} 2', lines)
+        self.assertIn(u'gcp_audit_api_errors_total'
+                      u'{name="storage.buckets.list",project="p1"} 1', lines)
+        self.assertIn(u'gcp_audit_memo_hits_total{name="firewalls"} 3',
+                      lines)
+        self.assertEqual(os.listdir(self.dir),
+                         ['metrics.json', 'metrics.prom'])
+
+        self.assertTrue(any('storage.buckets.list' in line
+                            for line in metrics.summary()))
+        self.assertIn('       4        3   75.0  firewalls',
+                      metrics.summary())
+
+    def test_load(self):
+        metrics.enable()
+        metrics.record('api', 'storage.buckets.list', None, count=2,
+                       project='p1')
+        data = metrics.to_json()
+        metrics.reset()
+
+        metrics.load(data)
+        metrics.load(data)
+        self.assertEqual(metrics.stats['api', 'storage.buckets.list', 'p1']
+                         .count, 4)
@@ -0,0 +1,71 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from util.output import open_sink
+
+
+class TestSinks(unittest.TestCase):
+
+    rule = {u'name': u'World writable bucket'}
+    obj = {u'bucket': u'b1', u'entity': u'allUsers', u'role': u'OWNER'}
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'results')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, count, **kwargs):
+        with open_sink(self.path, **kwargs) as sink:
+            for i in range(count):
+                sink.write(u'p1', u'buckets', u'b%d' % i, self.rule, self.obj)
+
+    def test_text(self):
+        self.write(1)
+
+        with open(self.path) as f:
+            header, data, blank = f.read().split('\n', 2)
+
+        self.assertTrue(header.endswith(
+            ': Project: p1 | Object: b0 | Matches rule: '
+            'World writable bucket'))
+        self.assertEqual(json.loads(data), self.obj)
+
+    def test_jsonl_appends(self):
+        self.write(2, format='jsonl')
+        self.write(1, format='jsonl')
+
+        with open(self.path) as f:
+            findings = [json.loads(line) for line in f]
+
+        self.assertEqual([f['object'] for f in findings], ['b0', 'b1', 'b0'])
+        self.assertEqual(findings[0]['data'], self.obj)
+        self.assertEqual(findings[0]['check'], 'buckets')
+
+    def test_json_document(self):
+        for count in (0, 3):
+            self.write(count, format='json')
+
+            with open(self.path) as f:
+                self.assertEqual(len(json.load(f)), count)
+
+    def test_compressed_concurrent(self):
+        with open_sink(self.path, 'jsonl', True) as sink:
+            def produce():
+                for i in range(250):
+                    sink.write(u'p1', u'buckets', u'b', self.rule, self.obj)
+
+            threads = [threading.Thread(target=produce) for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        with gzip.open(self.path) as f:
+            self.assertEqual(len([json.loads(line) for line in f]), 1000)
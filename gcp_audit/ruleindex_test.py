@@ -0,0 +1,56 @@
+import unittest
+
+import gcp_audit
+from util.ruleindex import RuleIndex
+
+
+class TestRuleIndex(unittest.TestCase):
+
+    rules = [
+        {u'name': u'open', u'filters': [
+            {u'matchtype': u'exact',
+             u'filter': {u'sourceRanges': u'0.0.0.0/0'}}]},
+        {u'name': u'notags', u'filters': [
+            {u'matchtype': u'count', u'filter': {u'targetTags': u'eq 0'}}]},
+        {u'name': u'public sql', u'filters': [
+            {u'matchtype': u'exact', u'filter': {u'settings': {
+                u'ipConfiguration': {u'authorizedNetworks': [
+                    {u'value': u'0.0.0.0/0'}]}}}}]},
+        {u'name': u'ssh or rdp', u'filtercondition': u'or', u'filters': [
+            {u'matchtype': u'exact', u'filter': {u'name': u'ssh'}},
+            {u'matchtype': u'exact', u'filter': {u'name': u'rdp'}}]},
+        {u'name': u'default', u'filters': [
+            {u'matchtype': u'exact', u'filter': {u'name': u'default'}}]},
+    ]
+
+    objects = [
+        {u'name': u'ssh', u'sourceRanges': [u'0.0.0.0/0']},
+        {u'name': u'default', u'sourceRanges': []},
+        {u'name': u'rdp', u'targetTags': [u'a']},
+        {u'name': u'sql', u'settings': {u'ipConfiguration': {
+            u'authorizedNetworks': [{u'value': u'0.0.0.0/0'}]}}},
+        {u'name': u'nosettings', u'settings': {}},
+        {u'name': 5},
+    ]
+
+    def setUp(self):
+        self.compiled = [(rule, gcp_audit.compile_rule(rule))
+                         for rule in self.rules]
+        self.index = RuleIndex(self.compiled, min_rules=0)
+
+    def test_candidates_find_all_matches(self):
+        for obj in self.objects:
+            expected = [rule['name'] for rule, match in self.compiled
+                        if match(obj)]
+            found = [rule['name'] for rule, match
+                     in self.index.candidates(obj) if match(obj)]
+            self.assertEqual(found, expected)
+
+    def test_candidates_skip_rules(self):
+        candidates = self.index.candidates({u'name': u'rdp'})
+        self.assertEqual([rule['name'] for rule, _ in candidates],
+                         [u'notags', u'ssh or rdp'])
+
+    def test_few_rules_not_indexed(self):
+        index = RuleIndex(self.compiled)
+        self.assertEqual(index.candidates({}), self.compiled)
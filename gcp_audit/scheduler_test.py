@@ -0,0 +1,85 @@
+import threading
+import time
+import unittest
+
+from util.scheduler import Scheduler
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_results_in_submission_order(self):
+
+        def func(project, check):
+            # later units finish first
+            time.sleep(0.001 * (10 - check))
+            return (project, check)
+
+        units = [(p, c) for p in ['a', 'b'] for c in range(10)]
+        scheduler = Scheduler(func, workers=8)
+
+        self.assertEqual([res for _, res, _ in scheduler.run(units)], units)
+
+    def test_per_project_cap(self):
+        lock = threading.Lock()
+        running = {}
+        peak = {}
+
+        def func(project, check):
+            with lock:
+                running[project] = running.get(project, 0) + 1
+                peak[project] = max(peak.get(project, 0), running[project])
+            time.sleep(0.005)
+            with lock:
+                running[project] -= 1
+
+        units = [(p, c) for p in ['a', 'b', 'c'] for c in range(6)]
+        list(Scheduler(func, workers=8, per_project=2).run(units))
+
+        self.assertEqual(peak, {'a': 2, 'b': 2, 'c': 2})
+
+    def test_stop_drains_running_units(self):
+        started = []
+
+        def func(project, check):
+            started.append((project, check))
+            time.sleep(0.01)
+            if check == 1:
+                scheduler.stop()
+            return check
+
+        units = [('a', c) for c in range(20)]
+        for workers in (1, 4):
+            del started[:]
+            scheduler = Scheduler(func, workers=workers)
+            done = [res for _, res, _ in scheduler.run(units)]
+
+            # everything started is handed back, in order
+            self.assertEqual(done, [c for _, c in sorted(started)])
+            self.assertTrue(1 in done)
+            self.assertTrue(len(done) < 20)
+
+    def test_errors_are_returned(self):
+
+        def func(project, check):
+            raise ValueError(check)
+
+        unit, res, exc_info = next(Scheduler(func, workers=2).run([('a', 1)]))
+
+        self.assertIsNone(res)
+        self.assertTrue(isinstance(exc_info[1], ValueError))
+
+    def test_keep_workers(self):
+        threads = set()
+
+        def func(project, check):
+            threads.add(threading.current_thread())
+            return check
+
+        scheduler = Scheduler(func, workers=4, keep_workers=True)
+        for _ in range(3):
+            units = [('a', c) for c in range(8)]
+            self.assertEqual([res for _, res, _ in scheduler.run(units)],
+                             range(8))
+
+        self.assertTrue(len(threads) <= 4)
+        scheduler.stop()
@@ -0,0 +1,27 @@
+import collections
+import unittest
+
+from util.shard import parse_shard, shard_of
+
+
+class TestShard(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(parse_shard('1/4'), (1, 4))
+        for spec in ('4/4', '-1/4', '0/0', '1', 'a/b'):
+            self.assertRaises(ValueError, parse_shard, spec)
+
+    def test_shards_are_balanced(self):
+        projects = ['project-%d' % i for i in range(4000)]
+        sizes = collections.Counter(shard_of(p, 4) for p in projects)
+
+        self.assertEqual(sorted(sizes), [0, 1, 2, 3])
+        self.assertTrue(all(800 < size < 1200 for size in sizes.values()))
+        self.assertEqual(shard_of(u'project-1', 4), shard_of('project-1', 4))
+
+    def test_new_shard_only_takes_projects(self):
+        projects = ['project-%d' % i for i in range(4000)]
+        moved = [p for p in projects if shard_of(p, 4) != shard_of(p, 5)]
+
+        self.assertTrue(all(shard_of(p, 5) == 4 for p in moved))
+        self.assertTrue(600 < len(moved) < 1000)
@@ -0,0 +1,131 @@
+import unittest
+
+from util import snapshot
+
+
+class TestSnapshotStore(unittest.TestCase):
+
+    rules = [({u'name': u'public'}, None), ({u'name': u'owner'}, None)]
+
+    def setUp(self):
+        self.store = snapshot.SnapshotStore(':memory:')
+        self.evaluated = []
+
+    def evaluate(self, obj):
+        self.evaluated.append(obj['name'])
+        return [rule for rule, _ in self.rules if rule['name'] in obj['tags']]
+
+    def audit(self, objects):
+        res = self.store.audit('p1', 'buckets', objects, self.rules,
+                               self.evaluate, 'name')
+        return sorted((obj['name'], rule['name'], status)
+                      for obj, rule, status in res)
+
+    def test_incremental_runs(self):
+        a = {u'name': u'a', u'tags': [u'public']}
+        b = {u'name': u'b', u'tags': [u'public', u'owner']}
+
+        self.assertEqual(self.audit([a, b]),
+                         [(u'a', u'public', u'new'),
+                          (u'b', u'owner', u'new'),
+                          (u'b', u'public', u'new')])
+        self.assertEqual(self.evaluated, [u'a', u'b'])
+
+        # nothing changed, nothing is evaluated again
+        self.assertEqual(self.audit([a, b]),
+                         [(u'a', u'public', u'present'),
+                          (u'b', u'owner', u'present'),
+                          (u'b', u'public', u'present')])
+        self.assertEqual(self.evaluated, [u'a', u'b'])
+
+        # b lost a permission and a is gone
+        b = {u'name': u'b', u'tags': [u'owner']}
+        self.assertEqual(self.audit([b]),
+                         [(u'a', u'public', u'resolved'),
+                          (u'b', u'owner', u'present'),
+                          (u'b', u'public', u'resolved')])
+        self.assertEqual(self.evaluated, [u'a', u'b', u'b'])
+
+    def test_failed_buckets(self):
+        a = {u'name': u'a', u'bucket': u'b1', u'tags': [u'public']}
+        b = {u'name': u'b', u'bucket': u'b2', u'tags': [u'public']}
+        self.audit([a, b])
+
+        def listing(failed):
+            # the ACLs of b2 could not be fetched this time
+            yield a
+            failed.add(u'b2')
+
+        failed = set()
+        res = self.store.audit('p1', 'buckets', listing(failed), self.rules,
+                               self.evaluate, 'name', failed)
+        self.assertEqual([(obj['name'], status) for obj, _, status in res],
+                         [(u'a', u'present')])
+
+        # the partial run was not saved, b is still known
+        self.assertEqual(len(self.store.load('p1', 'buckets')), 2)
+        self.assertEqual(self.audit([a]),
+                         [(u'a', u'public', u'present'),
+                          (u'b', u'public', u'resolved')])
+
+    def test_skipped_rules(self):
+        a = {u'name': u'a', u'tags': [u'public', u'owner']}
+        self.audit([a])
+
+        # public could not be evaluated, owner went away
+        res = self.store.audit('p1', 'buckets', [], self.rules,
+                               self.evaluate, 'name', set([u'public']))
+        self.assertEqual([(obj['name'], rule['name'], status)
+                          for obj, rule, status in res],
+                         [(u'a', u'owner', u'resolved')])
+
+    def test_objects_without_links(self):
+        self.rules = [({u'name': u'owner'}, None),
+                      ({u'name': u'editor'}, None)]
+        bindings = [{u'member': u'user:a@x.com', u'role': u'roles/owner'},
+                    {u'member': u'user:a@x.com', u'role': u'roles/editor'}]
+
+        def evaluate(obj):
+            return [rule for rule, _ in self.rules
+                    if obj['role'] == 'roles/' + rule['name']]
+
+        def audit(objects):
+            res = self.store.audit('p1', 'iam', objects, self.rules,
+                                   evaluate, 'member')
+            return sorted((obj['role'], status) for obj, _, status in res)
+
+        self.assertEqual(audit(bindings), [(u'roles/editor', u'new'),
+                                           (u'roles/owner', u'new')])
+        for _ in range(2):
+            self.assertEqual(audit(bindings),
+                             [(u'roles/editor', u'present'),
+                              (u'roles/owner', u'present')])
+        self.assertEqual(audit(bindings[:1]),
+                         [(u'roles/editor', u'resolved'),
+                          (u'roles/owner', u'present')])
+
+    def test_object_key(self):
+        self.assertEqual(snapshot.object_key({u'name': u'a', u'id': u'1'},
+                                             'name'), u'1')
+        self.assertEqual(snapshot.object_key({u'name': u'a'}, 'name'), u'a')
+        acls = [{u'bucket': bucket, u'entity': u'allUsers',
+                 u'role': u'READER'} for bucket in (u'b1', u'b2')]
+        self.assertNotEqual(snapshot.object_key(acls[0], 'entity'),
+                            snapshot.object_key(acls[1], 'entity'))
+
+    def test_same_key_twice(self):
+        a = {u'name': u'a', u'tags': [u'public']}
+        b = {u'name': u'a', u'tags': [u'owner']}
+        self.assertEqual(self.audit([a, b]), [(u'a', u'owner', u'new'),
+                                              (u'a', u'public', u'new')])
+        self.assertEqual(self.audit([a, b]), [(u'a', u'owner', u'present'),
+                                              (u'a', u'public', u'present')])
+
+    def test_changed_rules_are_evaluated(self):
+        a = {u'name': u'a', u'tags': [u'public']}
+        self.audit([a])
+
+        self.rules = self.rules + [({u'name': u'new rule'}, None)]
+        self.audit([a])
+
+        self.assertEqual(self.evaluated, [u'a', u'a'])
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Read the resources of a Cloud Asset Inventory export.
+
+An export is newline-delimited JSON, optionally gzipped, with one asset
+per line:
+
+    {"name": "//compute.googleapis.com/projects/p/global/firewalls/fw",
+     "asset_type": "compute.googleapis.com/Firewall",
+     "resource": {"parent": "//cloudresourcemanager.googleapis.com/...",
+                  "data": {...}}}
+
+The file is read one line at a time. Project numbers are mapped to
+project IDs, and the firewalls the instances need are collected, in
+passes that only parse the lines of those assets beforehand, see scan.
+Only these firewalls are kept, so memory use otherwise does not depend on
+the size of the file.
+"""
+
+import gzip
+import json
+import re
+
+from firewalls import FIELDS, applying_firewalls
+from gcp import policy_bindings
+
+PROJECT = 'cloudresourcemanager.Project'
+FIREWALL = 'compute.Firewall'
+INSTANCE = 'compute.Instance'
+FIREWALL_FIELDS = frozenset(FIELDS + ('network', 'direction', 'disabled'))
+
+
+def _itself(data):
+    return [data]
+
+
+def _acls(field):
+    def objects(data):
+        res = []
+        for acl in data.get(field) or []:
+            acl = dict(acl)
+            acl.setdefault(u'bucket', data.get(u'name'))
+            res.append(acl)
+        return res
+    return objects
+
+
+# asset type: [(check, function from resource data to objects)]
+asset_types = {
+    'compute.Firewall': [('firewalls', _itself)],
+    'sqladmin.Instance': [('cloudsql', _itself)],
+    INSTANCE: [('instances', _itself)],
+    # the ACLs are only part of the bucket with the full projection
+    'storage.Bucket': [('buckets', _acls(u'acl')),
+                       ('bucket_objects', _acls(u'defaultObjectAcl'))],
+}
+
+
+# the checks an export can hold objects for
+exported = set(check for routes in asset_types.values()
+               for check, _ in routes) | set(['iam'])
+
+
+def asset_type(asset):
+    name = asset.get('asset_type') or asset.get('assetType') or ''
+    return name.replace('.googleapis.com/', '.')
+
+
+def asset_project(asset, data, ids=None):
+    """Find the project of an asset, by ID where possible.
+
+    `ids` maps project numbers to IDs, for the assets that only know the
+    number of their project.
+    """
+    project = _asset_project(asset, data)
+    return (ids or {}).get(project, project)
+
+
+def _asset_project(asset, data):
+    if 'project' in data:
+        return data['project']
+
+    match = re.search(r'/projects/([^/]+)/', data.get('selfLink', ''))
+    if match:
+        return match.group(1)
+
+    # buckets only know the number of their project
+    if 'projectNumber' in data:
+        return data['projectNumber']
+    for ancestor in asset.get('ancestors') or []:
+        if ancestor.startswith('projects/'):
+            return ancestor.split('/', 1)[1]
+    return asset.get('resource', {}).get('parent', '').rsplit('/', 1)[-1]
+
+
+def open_export(path):
+    with open(path, 'rb') as f:
+        magic = f.read(2)
+    if magic == '\x1f\x8b':
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def read_assets(path):
+    """Yield the assets of an export file one by one."""
+    with open_export(path) as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise ValueError('%s:%d: %s' % (path, lineno, e))
+
+
+def scan(path, firewalls=False):
+    """Return the project IDs of the project numbers of an export, and
+    the fields of its firewalls that FirewallIndex needs, if asked for.
+
+    Only the lines that mention a project or firewall asset are parsed.
+    Firewalls are only collected, in a pass of their own, from exports
+    that hold instances.
+    """
+    ids = {}
+    instances = False
+    with open_export(path) as f:
+        for line in f:
+            if _mentions(line, PROJECT):
+                asset = json.loads(line)
+                data = (asset.get('resource') or {}).get('data') or {}
+                if asset_type(asset) == PROJECT and 'projectId' in data:
+                    ids[unicode(data.get('projectNumber'))] = \
+                        data['projectId']
+            elif not instances and _mentions(line, INSTANCE):
+                instances = asset_type(json.loads(line)) == INSTANCE
+
+    res = []
+    if firewalls and instances:
+        with open_export(path) as f:
+            for line in f:
+                if not _mentions(line, FIREWALL):
+                    continue
+                asset = json.loads(line)
+                data = (asset.get('resource') or {}).get('data')
+                if asset_type(asset) == FIREWALL and data is not None:
+                    # only what FirewallIndex reads is kept
+                    res.append(dict((k, v) for k, v in data.iteritems()
+                                    if k in FIREWALL_FIELDS))
+    return ids, res
+
+
+def _mentions(line, kind):
+    # the asset type as it is written in the file
+    return kind.replace('.', '.googleapis.com/', 1) in line
+
+
+def policy(asset):
+    return asset.get('iam_policy') or asset.get('iamPolicy')
+
+
+def read_objects(path, checks=None, ids=None, firewalls=None):
+    """Yield a (project, check, object) triple per object to audit.
+
+    Assets of other types, and objects of checks not in `checks`, are
+    skipped. `ids` maps project numbers to IDs, and instances get the
+    rules of the FirewallIndex `firewalls` that apply to them, like in
+    gcp.get_instances. The IAM policies of projects, in exports of IAM
+    policies, are audited by the iam check.
+    """
+    for asset in read_assets(path):
+        kind = asset_type(asset)
+        if kind == PROJECT and policy(asset) is not None and \
+                (checks is None or 'iam' in checks):
+            number = asset.get('name', '').rsplit('/', 1)[-1]
+            project = (ids or {}).get(number, number)
+            for obj in policy_bindings(project, policy(asset)):
+                yield project, 'iam', obj
+
+        routes = asset_types.get(kind)
+        data = (asset.get('resource') or {}).get('data')
+        if routes is None or data is None:
+            continue
+
+        project = asset_project(asset, data, ids)
+        for check, objects in routes:
+            if checks is not None and check not in checks:
+                continue
+            for obj in objects(data):
+                if check == 'instances' and firewalls is not None:
+                    obj[u'firewalls'] = applying_firewalls(
+                        obj, lambda project: firewalls)
+                yield project, check, obj
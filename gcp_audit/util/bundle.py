@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""A single file holding the rules of every category, checked and parsed.
+
+Next to the rules of a category, the bundle records the size and
+modification time of each of its rule files. A category whose files
+changed since the bundle was written is loaded from the files again.
+"""
+
+import json
+import os
+
+VERSION = 1
+
+# path -> bundle, or None if there is none
+_bundles = {}
+
+
+def stamp(directory):
+    """Return the size and modification time of every file in directory."""
+    res = {}
+    for name in os.listdir(directory):
+        st = os.stat(os.path.join(directory, name))
+        res[name] = [st.st_size, st.st_mtime]
+    return res
+
+
+def _read(path):
+    if path not in _bundles:
+        try:
+            with open(path, 'rb') as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            data = None
+        if not isinstance(data, dict) or data.get('version') != VERSION:
+            data = None
+        _bundles[path] = data
+    return _bundles[path]
+
+
+def load(path, ruletype, directory):
+    """Return the rules of a category from the bundle at path, or None if
+    there is no bundle or the category changed since it was written.
+
+    The rules are trusted as they are if the rule files are gone.
+    """
+    data = _read(path)
+    if data is None or ruletype not in data['categories']:
+        return None
+
+    category = data['categories'][ruletype]
+    try:
+        if stamp(directory) != category['files']:
+            return None
+    except OSError:
+        pass
+    return category['rules']
+
+
+def write(path, categories):
+    """Write a bundle of {ruletype: (stamp, rules)}, replacing it at once."""
+    data = {'version': VERSION,
+            'categories': dict((ruletype, {'files': files, 'rules': rules})
+                               for ruletype, (files, rules)
+                               in categories.iteritems())}
+
+    tmp = '%s.tmp' % path
+    with open(tmp, 'wb') as f:
+        json.dump(data, f, sort_keys=True)
+    os.rename(tmp, path)
+    _bundles.pop(path, None)
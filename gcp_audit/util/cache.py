@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class CacheMiss(Exception):
+    """Raised in replay mode for a request that is not in the cache."""
+
+
+class ResponseCache(object):
+    """A directory of API responses, keyed by method and request URI.
+
+    The URI holds every parameter of the request, including the page
+    token, so each page of a listing is cached on its own. Entries expire
+    `ttl` seconds after they were written. When the cache grows beyond
+    `max_size` bytes, the least recently used entries are removed.
+
+    In replay mode entries never expire and requests that are not in the
+    cache raise CacheMiss instead of going to the network.
+    """
+
+    def __init__(self, directory, ttl=3600, max_size=1 << 30, replay=False):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        self.replay = replay
+        self.lock = threading.Lock()
+        self.size = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for path in self._entries():
+            self.size += os.path.getsize(path)
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.json'):
+                    yield os.path.join(root, name)
+
+    def path(self, key):
+        key = hashlib.sha1(key).hexdigest()
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def open(self, key):
+        """Return the entry of a key as a file open for reading, or None if
+        there is no fresh entry.
+        """
+        path = self.path(key)
+
+        try:
+            stat = os.stat(path)
+            if self.replay or stat.st_mtime + self.ttl > time.time():
+                # the access time orders entries for eviction
+                os.utime(path, (time.time(), stat.st_mtime))
+                return open(path, 'rb')
+        except (IOError, OSError):
+            pass
+
+        if self.replay:
+            raise CacheMiss(key)
+        return None
+
+    def get(self, key):
+        f = self.open(key)
+        if f is None:
+            return None
+
+        with f:
+            try:
+                return json.load(f)
+            except ValueError:
+                pass
+        if self.replay:
+            raise CacheMiss(key)
+        return None
+
+    def put(self, key, value):
+        self.put_raw(key, json.dumps(value))
+
+    def put_raw(self, key, data):
+        """Store a response body as it came, which must be JSON."""
+        if self.replay:
+            return
+
+        path = self.path(key)
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                # created by another thread
+                pass
+
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        size = os.path.getsize(tmp)
+        if os.path.exists(path):
+            size -= os.path.getsize(path)
+        os.rename(tmp, path)
+
+        with self.lock:
+            self.size += size
+            if self.size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        entries = []
+        for path in self._entries():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+
+        self.size = sum(size for _, size, _ in entries)
+        # make some room, so that we don't evict on every write
+        for _, size, path in sorted(entries):
+            if self.size <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(path)
+                self.size -= size
+            except OSError:
+                pass
+
+
+def request_key(req):
+    return '%s %s' % (req.methodId, req.uri)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import os
+import sqlite3
+
+
+class Checkpoint(object):
+    """Remembers the (project, check) units of a run that are done.
+
+    Each unit is committed together with the size of the results file
+    after its findings were written. A resumed run cuts the results file
+    back to that size, so findings of units that were not committed are
+    not reported twice.
+    """
+
+    def __init__(self, path, output, resume=False):
+        self.path = path
+        self.output = os.path.abspath(output)
+        self.db = sqlite3.connect(path)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS units ('
+                            'project TEXT, "check" TEXT, '
+                            'PRIMARY KEY (project, "check"))')
+            self.db.execute('CREATE TABLE IF NOT EXISTS run ('
+                            'output TEXT, size INTEGER)')
+
+        row = self.db.execute('SELECT output, size FROM run').fetchone()
+        if resume and row is not None:
+            if row[0] != self.output:
+                raise ValueError('%s belongs to a run writing to %s'
+                                 % (path, row[0]))
+            self.size = row[1]
+        else:
+            # a new run, appending to whatever is in the results file
+            self.size = _size(self.output)
+            with self.db:
+                self.db.execute('DELETE FROM units')
+                self.db.execute('DELETE FROM run')
+                self.db.execute('INSERT INTO run VALUES (?, ?)',
+                                (self.output, self.size))
+
+    def done(self):
+        """Return the set of (project, check) units already done."""
+        return set(self.db.execute('SELECT project, "check" FROM units'))
+
+    def truncate(self):
+        """Drop the findings written after the last committed unit."""
+        if _size(self.output) > self.size:
+            with open(self.output, 'r+b') as f:
+                f.truncate(self.size)
+
+    def record(self, project, check, size):
+        """Commit a unit whose findings end at `size` in the results file."""
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO units VALUES (?, ?)',
+                            (project, check))
+            self.db.execute('UPDATE run SET size = ?', (size,))
+        self.size = size
+
+    def finish(self):
+        """Remove the checkpoint of a run that completed."""
+        self.db.close()
+        os.remove(self.path)
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Evaluate filters over batches of objects, one column at a time.
+
+The objects of a batch are split by key into columns. Scalar values, and
+the elements of lists of scalars, are dictionary encoded: every distinct
+value maps to the rows holding it, so a filter value is matched once per
+distinct value instead of once per object. Dicts, and lists of dicts,
+become child batches that nested filters are evaluated on.
+
+Sets of rows are Python ints used as bitmasks, bit i standing for the
+i-th object of the batch.
+
+Rows whose values are shaped in ways the columns do not cover are
+evaluated one by one with compile_filter, so the result is always the
+same as that of filterjson.
+"""
+
+from filter import compile_filter, compile_matchstr
+
+# Scalar values that are dictionary encoded as they are. Other scalars
+# are encoded as (type, value), which keeps 1, 1.0 and True apart.
+STRINGS = frozenset([str, unicode])
+SCALARS = STRINGS | frozenset([int, long, float, bool, type(None)])
+
+_MISSING = object()
+
+
+class Batch(object):
+    """A list of objects whose columns are built on demand."""
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.all = (1 << len(objects)) - 1
+        self.columns = {}
+
+    def __len__(self):
+        return len(self.objects)
+
+    def column(self, key):
+        if key not in self.columns:
+            self.columns[key] = Column(self, key)
+        return self.columns[key]
+
+
+class Column(object):
+    """The values of one key across a batch, grouped by their shape."""
+
+    def __init__(self, batch, key):
+        self.all = batch.all
+        missing, empty, other = [], [], []
+        scalar_rows, scalar_lists = [], []
+        # encoded value -> rows
+        self.scalars = {}
+        self.elements = {}
+        # the row of each dict, and the (row, start, end) of each list of
+        # dicts in the child batches
+        self.parents = []
+        self.spans = []
+
+        dicts = []
+        items = []
+
+        for row, obj in enumerate(batch.objects):
+            if obj.__class__ is not dict:
+                other.append(row)
+                continue
+            value = obj.get(key, _MISSING)
+            if value is _MISSING:
+                missing.append(row)
+                continue
+
+            kind = value.__class__
+            if kind is dict:
+                self.parents.append(row)
+                dicts.append(value)
+            elif kind is not list:
+                if kind not in STRINGS:
+                    value = (kind, value)
+                self.scalars.setdefault(value, []).append(row)
+                scalar_rows.append(row)
+            elif not value:
+                empty.append(row)
+            else:
+                kinds = set(map(type, value))
+                if kinds <= STRINGS:
+                    for e in value:
+                        self.elements.setdefault(e, []).append(row)
+                    scalar_lists.append(row)
+                elif kinds <= SCALARS:
+                    for e in value:
+                        if e.__class__ not in STRINGS:
+                            e = (e.__class__, e)
+                        self.elements.setdefault(e, []).append(row)
+                    scalar_lists.append(row)
+                elif kinds == set([dict]):
+                    self.spans.append((row, len(items),
+                                       len(items) + len(value)))
+                    items.extend(value)
+                else:
+                    other.append(row)
+
+        self.missing = to_mask(missing)
+        self.empty = to_mask(empty)
+        self.other = to_mask(other)
+        self.scalar_rows = to_mask(scalar_rows)
+        self.scalar_lists = to_mask(scalar_lists)
+        self.dict_rows = to_mask(self.parents)
+        self.dict_lists = to_mask(row for row, _, _ in self.spans)
+
+        self.dicts = Batch(dicts)
+        self.items = Batch(items)
+
+
+def to_mask(rows):
+    mask = 0
+    for row in rows:
+        mask |= 1 << row
+    return mask
+
+
+def to_rows(mask):
+    """Yield the rows set in a mask, in order."""
+    bits = bin(mask)[:1:-1]
+    row = bits.find('1')
+    while row >= 0:
+        yield row
+        row = bits.find('1', row + 1)
+
+
+def _union(masks):
+    mask = 0
+    for m in masks:
+        mask |= m
+    return mask
+
+
+def _memoize(func, size=10000):
+    """Remember the results of func for the last encoded values seen."""
+    results = {}
+
+    def memoized(value):
+        try:
+            return results[value]
+        except KeyError:
+            if len(results) >= size:
+                results.clear()
+            res = results[value] = func(value[1] if value.__class__ is tuple
+                                        else value)
+            return res
+
+    return memoized
+
+
+def compile_batch_filter(filter, matchtype, listcondition="or",
+                         matchtypes=None):
+    """Compile a filter into a function of a batch and a set of rows.
+
+    The function returns the rows of the batch that match the filter,
+    among the rows it is asked about. Other rows may be set or not.
+    """
+    row = compile_filter(filter, matchtype, listcondition, matchtypes)
+    columns = None
+    if isinstance(filter, dict) and matchtype != 'partial' and \
+            'partial' not in (matchtypes or {}).values():
+        columns = _compile_dict(filter, matchtype, listcondition, matchtypes)
+
+    def match(batch, rows=None):
+        rows = batch.all if rows is None else rows
+        if columns is None:
+            return _match_rows(batch, row, rows)
+
+        try:
+            mask, irregular = columns(batch)
+        except Exception:
+            # let the objects that filterjson would have failed on fail
+            return _match_rows(batch, row, rows)
+
+        irregular &= rows
+        if irregular:
+            mask = (mask & ~irregular) | _match_rows(batch, row, irregular)
+        return mask
+
+    return match
+
+
+def _match_rows(batch, func, rows):
+    objects = batch.objects
+    return to_mask(row for row in to_rows(rows) if func(objects[row]))
+
+
+def _compile_dict(filter, matchtype, listcondition, matchtypes=None):
+    keys = []
+    for k, v in filter.iteritems():
+        # see filter._compile_dict
+        if matchtypes and not isinstance(v, dict):
+            key = _compile_key(v, matchtypes.get(k, matchtype),
+                               listcondition, matchtypes)
+        else:
+            key = _compile_key(v, matchtype, listcondition, matchtypes)
+        if key is None:
+            return None
+        keys.append((k, key))
+
+    def match_dict(batch):
+        mask = batch.all
+        irregular = 0
+        for k, key in keys:
+            column = batch.column(k)
+            matched, regular = key(column)
+            mask &= matched
+            irregular |= column.all & ~regular
+        return mask, irregular
+
+    return match_dict
+
+
+def _compile_key(v, matchtype, listcondition, matchtypes=None):
+    """Compile the filter value of one key into a function of a column.
+
+    The function returns the rows that match and the rows it could
+    decide on.
+    """
+    # For count checks, a missing key is matched as an empty list, for
+    # anything but a string that fails in filterjson
+    count = matchtype == 'count'
+
+    if isinstance(v, basestring):
+        scalar = compile_matchstr(v, matchtype)
+        func = _memoize(scalar)
+        missing = count and scalar([])
+
+        def match_scalar(column):
+            # an empty list leaves the match of the previous key, which
+            # is true
+            masks = [column.empty, column.missing if missing else 0]
+            for values in (column.scalars, column.elements):
+                for value, rows in values.iteritems():
+                    if func(value):
+                        masks.append(to_mask(rows))
+            return _union(masks), (column.missing | column.empty |
+                                   column.scalar_rows | column.scalar_lists)
+
+        return match_scalar
+
+    elif isinstance(v, dict):
+        sub = compile_batch_filter(v, matchtype, listcondition, matchtypes)
+
+        def match_nested(column):
+            parents = column.parents
+            mask = to_mask(parents[i] for i in to_rows(sub(column.dicts)))
+            return mask, column.dict_rows | (0 if count else column.missing)
+
+        return match_nested
+
+    elif isinstance(v, list) and v and listcondition in ('or', 'and'):
+        # every element of the filter is matched in turn, but only the
+        # last one decides
+        last = v[-1]
+        if isinstance(last, basestring):
+            func = _memoize(compile_matchstr(last, matchtype))
+            wanted = listcondition == 'or'
+
+            def match_elements(column):
+                mask = _union(to_mask(rows)
+                              for value, rows in column.elements.iteritems()
+                              if bool(func(value)) == wanted)
+                if not wanted:
+                    # the lists without an element that does not match
+                    mask = column.scalar_lists & ~mask
+                return mask, (column.scalar_lists | column.empty |
+                              (0 if count else column.missing))
+
+            return match_elements
+
+        elif isinstance(last, dict):
+            sub = compile_batch_filter(last, matchtype, listcondition,
+                                       matchtypes)
+            wanted = listcondition == 'or'
+
+            def match_items(column):
+                items = column.items
+                matched = sub(items)
+                if not wanted:
+                    matched = items.all & ~matched
+
+                owners = []
+                spans = iter(column.spans)
+                row, end = None, 0
+                for item in to_rows(matched):
+                    while item >= end:
+                        row, _, end = next(spans)
+                    owners.append(row)
+
+                mask = to_mask(owners)
+                if not wanted:
+                    # the lists without an item that does not match
+                    mask = column.dict_lists & ~mask
+                return mask, (column.dict_lists | column.empty |
+                              (0 if count else column.missing))
+
+            return match_items
+
+    return None
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Join the objects of different checks of a project.
+
+A correlation rule picks objects of one check with filters, like any
+other rule, and then requires each of its joins to find objects of
+another check that share a key with them and match the join's filters:
+
+    {"name": "MySQL open to all IP's in a network with public CloudSQL",
+     "object": {"check": "firewalls", "filters": [...]},
+     "join": [{"check": "cloudsql", "on": "network", "filters": [...]}]}
+
+A join with "exists": false requires that no such object is found.
+
+Each join looks keys up in a dict, built in one pass over the objects of
+its check, so the objects of a project are correlated in time linear in
+their number, however many objects share a key.
+"""
+
+import json
+
+import metrics
+from firewalls import instance_targets, network_key
+
+# The related objects of each check that a finding names.
+MAX_RELATED = 10
+
+
+def _networks(urls):
+    return [network_key(url) for url in urls if url]
+
+
+def _firewall_networks(firewall):
+    return _networks([firewall.get('network')])
+
+
+def _instance_networks(instance):
+    return _networks([interface.get('network') for interface
+                      in instance.get('networkInterfaces') or []])
+
+
+def _sql_networks(instance):
+    settings = instance.get('settings') or {}
+    config = settings.get('ipConfiguration') or {}
+    # instances with a public IP only are not in any network
+    return _networks([config.get('privateNetwork')])
+
+
+def _firewall_tags(firewall):
+    # tags only mean something within a network
+    return [(network, tag) for network in _firewall_networks(firewall)
+            for tag in firewall.get('targetTags') or []]
+
+
+def _instance_tags(instance):
+    tags, _ = instance_targets(instance)
+    return [(network, tag) for network in _instance_networks(instance)
+            for tag in tags]
+
+
+def _firewall_accounts(firewall):
+    return firewall.get('targetServiceAccounts') or []
+
+
+def _instance_accounts(instance):
+    return [account for account in instance_targets(instance)[1] if account]
+
+
+def _member_accounts(binding):
+    kind, _, account = (binding.get('member') or '').partition(':')
+    return [account] if kind == 'serviceAccount' else []
+
+
+def _bucket(obj):
+    return [obj['bucket']] if obj.get('bucket') else []
+
+
+# key -> {check: function from an object to its values of the key}
+KEYS = {
+    'network': {
+        'firewalls': _firewall_networks,
+        'instances': _instance_networks,
+        'cloudsql': _sql_networks
+    },
+    'tag': {
+        'firewalls': _firewall_tags,
+        'instances': _instance_tags
+    },
+    'service_account': {
+        'firewalls': _firewall_accounts,
+        'instances': _instance_accounts,
+        'iam': _member_accounts
+    },
+    'bucket': {
+        'buckets': _bucket,
+        'bucket_objects': _bucket
+    }
+}
+
+
+class Join(object):
+
+    def __init__(self, check, on, match, exists, keys, related_keys, key):
+        self.check = check
+        self.on = on
+        self.match = match
+        self.exists = exists
+        # the values of the key of the objects joined from, and to
+        self.keys = keys
+        self.related_keys = related_keys
+        # joins of the same objects share their index
+        self.key = key
+
+
+def compile_correlation(rule, compile):
+    """Compile a correlation rule into the match function of its objects
+    and its joins. `compile` compiles a rule with filters, see
+    gcp_audit.compile_rule.
+    """
+    name = rule.get('name')
+    obj = rule.get('object')
+    joins = rule.get('join')
+    if name is None or not isinstance(obj, dict) or \
+            not isinstance(joins, list) or not joins:
+        raise ValueError("a correlation rule needs a name, an object and "
+                         "a list of joins")
+
+    def filters(part):
+        return compile({'name': name, 'filters': part.get('filters', []),
+                        'filtercondition': part.get('filtercondition',
+                                                    'and')})
+
+    res = []
+    for join in joins:
+        on = join.get('on')
+        if on not in KEYS:
+            raise ValueError("rule '%s': cannot join on %r, only on %s"
+                             % (name, on, ', '.join(sorted(KEYS))))
+        for check in (obj.get('check'), join.get('check')):
+            if check not in KEYS[on]:
+                raise ValueError("rule '%s': %r objects have no %s"
+                                 % (name, check, on))
+        res.append(Join(join['check'], on, filters(join),
+                        bool(join.get('exists', True)),
+                        KEYS[on][obj['check']], KEYS[on][join['check']],
+                        (join['check'], on,
+                         json.dumps([join.get('filters', []),
+                                     join.get('filtercondition', 'and')],
+                                    sort_keys=True))))
+
+    return obj['check'], filters(obj), res
+
+
+class Correlator(object):
+    """The correlation rules of a run, compiled.
+
+    `rules` holds a (rule, compiled rule) pair per rule, like RuleIndex,
+    and `checks` the checks whose objects the rules need.
+    """
+
+    def __init__(self, rules, compile, descfields):
+        self.rules = [(rule, compile_correlation(rule, compile))
+                      for rule in rules]
+        self.descfields = descfields
+        checks = set()
+        for _, (check, _, joins) in self.rules:
+            checks.add(check)
+            checks.update(join.check for join in joins)
+        self.checks = sorted(checks)
+
+    def index(self, join, objects):
+        """Map the values of a join's key to the objects that match the
+        join's filters.
+        """
+        res = {}
+        for obj in objects:
+            if join.match(obj):
+                for value in join.related_keys(obj):
+                    res.setdefault(value, []).append(obj)
+        return res
+
+    def needing(self, check):
+        """Return the names of the rules that need the objects of a check."""
+        return [rule['name'] for rule, (obj_check, _, joins) in self.rules
+                if check == obj_check or
+                any(join.check == check for join in joins)]
+
+    def correlate(self, listings, skipped=()):
+        """Return a (finding, rules) pair per object that matches rules.
+
+        `listings` maps checks to the lists of objects of a project. A
+        finding wraps the object, and names the related objects each rule
+        joined it with. The rules named in `skipped` are not evaluated.
+        """
+        indexes = {}
+        findings = {}
+        res = []
+
+        for rule, (check, match, joins) in self.rules:
+            if rule['name'] in skipped:
+                continue
+            start = metrics.clock()
+            objects = listings.get(check) or []
+            for join in joins:
+                if join.key not in indexes:
+                    indexes[join.key] = self.index(
+                        join, listings.get(join.check) or [])
+
+            count = 0
+            for obj in objects:
+                if not match(obj):
+                    continue
+                related = self.join(obj, joins, indexes)
+                if related is None:
+                    continue
+
+                count += 1
+                if id(obj) not in findings:
+                    findings[id(obj)] = (self.finding(check, obj), [])
+                    res.append(findings[id(obj)])
+                finding, rules = findings[id(obj)]
+                rules.append(rule)
+                finding[u'related'][rule['name']] = dict(
+                    (name, self.names(name, objects))
+                    for name, objects in related)
+            metrics.record('rule', rule['name'], start, count=len(objects),
+                           matches=count)
+
+        return res
+
+    def join(self, obj, joins, indexes):
+        """Return the (check, related objects) of each join that finds
+        objects, or None if a join does not hold.
+        """
+        res = []
+        for join in joins:
+            index = indexes[join.key]
+            related = []
+            for value in join.keys(obj):
+                # a few are enough to name in the finding
+                related.extend(index.get(value, ())[:MAX_RELATED])
+                if len(related) >= MAX_RELATED:
+                    break
+            if bool(related) != join.exists:
+                return None
+            if related:
+                res.append((join.check, related))
+        return res
+
+    def finding(self, check, obj):
+        return {u'kind': u'gcp-audit#correlation',
+                u'name': u'%s/%s' % (check, obj[self.descfields[check]]),
+                u'check': check,
+                u'object': obj,
+                u'related': {}}
+
+    def names(self, check, objects):
+        descfield = self.descfields[check]
+        res = []
+        for obj in objects:
+            if obj[descfield] not in res:
+                res.append(obj[descfield])
+        return res[:MAX_RELATED]
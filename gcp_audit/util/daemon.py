@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Audit projects again and again, keeping everything warm in between.
+
+A Daemon runs every check on its own schedule, lists the projects less
+often, and holds on to the latest findings of every (project, check).
+serve() exposes them, the health of the daemon and its metrics over
+HTTP.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import datetime
+import json
+import threading
+import time
+import urlparse
+
+import metrics
+
+from scheduler import Scheduler
+
+
+class CheckState(object):
+    """The schedule and last round of one check."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.due = 0
+        self.started = None
+        self.finished = None
+        self.units = 0
+        self.errors = 0
+        self.findings = 0
+
+    def to_dict(self):
+        return {'interval': self.interval,
+                'next': _iso(self.due),
+                'last_started': _iso(self.started),
+                'last_finished': _iso(self.finished),
+                'units': self.units,
+                'errors': self.errors,
+                'findings': self.findings}
+
+
+class Daemon(object):
+    """Runs the checks of all projects on a schedule.
+
+    `audit(project, check)` returns the findings of one unit as dicts,
+    like the lines of a jsonl results file. `intervals` maps each check
+    to the seconds between its rounds. `list_projects()` is called every
+    `projects_every` seconds, and `reload_rules()` every `reload_every`
+    seconds, between rounds; it returns the (category, error) pairs of
+    the rules it reloaded, with None for the ones that loaded fine.
+    `new_round()` is called before each round, to drop what should not
+    outlive one.
+    """
+
+    def __init__(self, audit, intervals, list_projects, projects_every=21600,
+                 reload_rules=None, reload_every=5, workers=1,
+                 per_project=None, new_round=None, log=None):
+        self.scheduler = Scheduler(audit, workers, per_project,
+                                   keep_workers=True)
+        self.checks = dict((check, CheckState(interval))
+                           for check, interval in intervals.iteritems())
+        self.list_projects = list_projects
+        self.projects_every = projects_every
+        self.reload_rules = reload_rules
+        self.reload_every = reload_every
+        self.new_round = new_round
+        self.log = log or (lambda message: None)
+
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.projects = None
+        self.projects_listed = 0
+        self.projects_error = None
+        self.rules_checked = time.time()
+        self.rules_errors = {}
+        self.findings = {}
+
+    @property
+    def stopped(self):
+        return self.scheduler.stopped
+
+    def stop(self):
+        self.scheduler.stop()
+
+    def run(self):
+        """Run rounds until stopped."""
+        while not self.stopped:
+            if not self.tick():
+                time.sleep(0.5)
+
+    def tick(self, now=None):
+        """Do whatever is due, and tell if anything was."""
+        now = time.time() if now is None else now
+
+        if self.reload_rules and now - self.rules_checked >= \
+                self.reload_every:
+            self.rules_checked = now
+            self._reload(self.reload_rules())
+
+        # until the projects were listed once, retry every minute
+        every = self.projects_every if self.projects is not None \
+            else min(60, self.projects_every)
+        if now - self.projects_listed >= every:
+            self._list_projects(now)
+        if self.projects is None:
+            return False
+
+        due = sorted(check for check, state in self.checks.iteritems()
+                     if state.due <= now)
+        if due:
+            self._audit(due, now)
+        return bool(due)
+
+    def _reload(self, results):
+        for category, error in results:
+            if error is None:
+                self.log('Reloaded the %s rules' % category)
+                self.rules_errors.pop(category, None)
+            else:
+                self.log('Kept the previous %s rules: %s' % (category,
+                                                            error))
+                self.rules_errors[category] = error
+
+    def _list_projects(self, now):
+        self.projects_listed = now
+        try:
+            projects = list(self.list_projects())
+        except Exception as e:
+            # keep auditing the projects listed last time
+            self.projects_error = str(e) or e.__class__.__name__
+            self.log('Could not list the projects: %s' % self.projects_error)
+            return
+
+        self.projects_error = None
+        if projects != self.projects:
+            self.log('%d projects' % len(projects))
+        with self.lock:
+            self.projects = projects
+            listed = set(projects)
+            for key in [key for key in self.findings if key[0] not in listed]:
+                del self.findings[key]
+
+    def _audit(self, due, start):
+        if self.new_round:
+            self.new_round()
+        clock = time.time()
+        for check in due:
+            state = self.checks[check]
+            state.started = start
+            state.units = state.errors = state.findings = 0
+
+        units = [(project, check) for project in self.projects
+                 for check in due]
+        for unit, findings, exc_info in self.scheduler.run(units):
+            state = self.checks[unit.check]
+            state.units += 1
+            if exc_info is not None:
+                state.errors += 1
+                self.log('Could not audit %s of %s: %s' % (
+                    unit.check, unit.project, exc_info[1]))
+                continue
+            state.findings += len(findings)
+            with self.lock:
+                self.findings[unit.project, unit.check] = findings
+
+        elapsed = time.time() - clock
+        for check in due:
+            state = self.checks[check]
+            state.finished = start + elapsed
+            state.due = start + state.interval
+            self.log('%s: %d units, %d findings, %d errors in %.1fs' % (
+                check, state.units, state.findings, state.errors, elapsed))
+
+    def get_findings(self, project=None, check=None, rule=None):
+        with self.lock:
+            items = sorted(self.findings.items())
+        res = []
+        for (p, c), findings in items:
+            if project not in (None, p) or check not in (None, c):
+                continue
+            res.extend(f for f in findings if rule in (None, f['rule']))
+        return res
+
+    def health(self, now=None):
+        """Return the state of the daemon, and whether it is keeping up.
+
+        A check is late when its last round started more than two
+        intervals ago, or when it never completed one in that time.
+        """
+        now = time.time() if now is None else now
+        late = [check for check, state in self.checks.iteritems()
+                if now - (state.finished and state.started or
+                          self.started) > 2 * state.interval]
+
+        if late:
+            status = 'late'
+        elif any(state.finished is None for state in self.checks.values()):
+            status = 'starting'
+        else:
+            status = 'ok'
+
+        return {'status': status,
+                'late': sorted(late),
+                'started': _iso(self.started),
+                'projects': len(self.projects or []),
+                'projects_listed': _iso(self.projects_listed),
+                'projects_error': self.projects_error,
+                'rules_errors': self.rules_errors,
+                'checks': dict((check, state.to_dict())
+                               for check, state in self.checks.iteritems())}
+
+
+def _iso(timestamp):
+    if not timestamp:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp).isoformat()
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, code, body, content_type='application/json'):
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        daemon = self.server.daemon
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+
+        if url.path == '/health':
+            health = daemon.health()
+            self.send(503 if health['status'] == 'late' else 200,
+                      json.dumps(health, indent=2, sort_keys=True))
+        elif url.path == '/findings':
+            findings = daemon.get_findings(params.get('project'),
+                                           params.get('check'),
+                                           params.get('rule'))
+            self.send(200, json.dumps(findings))
+        elif url.path == '/metrics':
+            self.send(200, metrics.to_prometheus(),
+                      'text/plain; version=0.0.4')
+        else:
+            self.send(404, json.dumps({'error': 'not found'}))
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, daemon):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        self.daemon = daemon
+
+
+def serve(daemon, host='127.0.0.1', port=8080):
+    """Answer HTTP requests about daemon from a thread of their own.
+
+    Returns the server, whose server_address holds the port it listens
+    on.
+    """
+    server = Server((host, port), daemon)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
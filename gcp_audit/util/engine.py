@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""The I/O engines that API requests can be run with.
+
+The default `threads` engine makes blocking calls, one per thread. The
+`async` engine monkey-patches the standard library with gevent, so that
+threads become greenlets and every socket is non-blocking: thousands of
+requests can be in flight from a single OS thread.
+"""
+
+import imp
+import itertools
+import sys
+import threading
+import warnings
+
+# only imported by the async engine, see install
+gevent = None
+
+engines = ('threads', 'async')
+name = 'threads'
+
+# Maximum number of concurrent requests under the async engine.
+max_inflight = 1
+
+
+def available():
+    """Whether the async engine can be installed, without importing gevent."""
+    try:
+        imp.find_module('gevent')
+    except ImportError:
+        return False
+    return True
+
+
+def install(inflight=100):
+    """Switch to the async engine.
+
+    Must be called before any lock, thread or connection that should be
+    cooperative is created.
+    """
+    global name, max_inflight, gevent
+
+    try:
+        import gevent
+        import gevent.monkey
+        import gevent.pool
+        import gevent.queue
+    except ImportError:
+        raise ImportError('the async engine requires gevent')
+
+    with warnings.catch_warnings():
+        # ssl may have been imported already, but no connection was made
+        # yet
+        warnings.simplefilter('ignore')
+        gevent.monkey.patch_all()
+
+    name = 'async'
+    max_inflight = max(1, inflight)
+
+
+def imap(func, items):
+    """Like itertools.imap, but concurrent under the async engine.
+
+    Results are still yielded in the order of `items`.
+    """
+    if name != 'async':
+        return itertools.imap(func, items)
+    return gevent.pool.Pool(max_inflight).imap(func, items)
+
+
+def prefetch(iterable, size=1000):
+    """Consume `iterable` in the background under the async engine.
+
+    Up to `size` items are queued, so the next page of a listing is
+    fetched while the items of the previous one are evaluated.
+    """
+    if name != 'async':
+        return iterable
+    return _prefetch(iterable, size)
+
+
+def _produce(iterable, queue):
+    try:
+        for item in iterable:
+            queue.put((True, item))
+        queue.put((False, None))
+    except Exception:
+        queue.put((None, sys.exc_info()))
+
+
+def _prefetch(iterable, size):
+    queue = gevent.queue.Queue(size)
+    producer = gevent.spawn(_produce, iterable, queue)
+
+    try:
+        while True:
+            more, value = queue.get()
+            if more:
+                yield value
+            elif more is None:
+                raise value[0], value[1], value[2]
+            else:
+                return
+    finally:
+        producer.kill()
+
+
+class SharedHttp(object):
+    """Stands in for a httplib2.Http shared by all greenlets.
+
+    Every request is sent over an idle connection of the pool, and new
+    connections are made by `factory` until `size` requests are in flight.
+    Beyond that, callers wait for a connection to become free.
+    """
+
+    def __init__(self, factory, size):
+        self.factory = factory
+        self.idle = [factory()]
+        self.slots = threading.BoundedSemaphore(size)
+
+        def request(*args, **kwargs):
+            with self.slots:
+                http = self.idle.pop() if self.idle else self.factory()
+                try:
+                    return http.request(*args, **kwargs)
+                finally:
+                    self.idle.append(http)
+
+        # batch requests look up the credentials on the request method
+        credentials = getattr(self.idle[0].request, 'credentials', None)
+        if credentials is not None:
+            request.credentials = credentials
+        self.request = request
@@ -22,32 +22,61 @@
 import re
 import operator
 
+from intervals import IntervalIndex, parse_cidr, parse_portrange
 
-def filterjson(event, filter, matchtype, listcondition="or"):
+
+OPS = {"lt": operator.lt,
+       "le": operator.le,
+       "gt": operator.gt,
+       "ge": operator.ge,
+       "eq": operator.eq}
+
+MATCHTYPES = ('exact', 'partial', 'regex', 'numeric', 'count', 'cidr',
+              'portrange')
+
+# matchtype -> (parser of object values, keyword of the length condition)
+INTERVALS = {'cidr': (parse_cidr, 'prefix'),
+             'portrange': (parse_portrange, 'size')}
+
+RELATIONS = ('overlaps', 'within', 'outside', 'covers')
+
+
+def filterjson(event, filter, matchtype, listcondition="or",
+               matchtypes=None):
+    """Match an object against a filter.
+
+    `matchtypes` maps keys of the filter, at any depth, to the matchtype
+    of their values if it is not `matchtype`, so that conditions on one
+    object of a list can use several matchtypes.
+    """
     match = True
 
     if isinstance(filter, dict):
         for k, v in filter.iteritems():
+            keytype = matchtypes.get(k, matchtype) if matchtypes \
+                else matchtype
             if k in event:
                 if isinstance(v, dict):
-                    match = filterjson(event[k], v, matchtype, listcondition)
+                    match = filterjson(event[k], v, matchtype, listcondition,
+                                       matchtypes)
                 elif isinstance(v, list) and isinstance(event[k], list):
-                    match = filterjson(event[k], v, matchtype, listcondition)
+                    match = filterjson(event[k], v, keytype, listcondition,
+                                       matchtypes)
                 else:
                     # Match filter string against object array
                     if isinstance(event[k], list):
                         for e in event[k]:
-                            match = filterjson(e, v, matchtype)
+                            match = filterjson(e, v, keytype)
                             if match:
                                 break
                     # Match filter string against object string, int, bool
                     else:
-                        match = matchstr(event[k], v, matchtype)
+                        match = matchstr(event[k], v, keytype)
             else:
                 # For count checks, handle a missing key
                 # as if the key were an empty list
-                if matchtype == "count":
-                    match = matchstr([], v, matchtype)
+                if keytype == "count":
+                    match = matchstr([], v, keytype)
                 else:
                     match = False
 
@@ -60,13 +89,15 @@ def filterjson(event, filter, matchtype, listcondition="or"):
         else:
             for f in filter:
                 for e in event:
-                    match = filterjson(e, f, matchtype, listcondition)
+                    match = filterjson(e, f, matchtype, listcondition,
+                                       matchtypes)
                     if ((listcondition == 'or' and match) or
                             (listcondition == 'and' and not match)):
                         break
     elif isinstance(filter, list):
         for v in filter:
-            match = filterjson(event, v, matchtype, listcondition)
+            match = filterjson(event, v, matchtype, listcondition,
+                               matchtypes)
             if ((listcondition == 'or' and match) or
                     (listcondition == 'and' and not match)):
                 break
@@ -79,10 +110,6 @@ def filterjson(event, filter, matchtype, listcondition="or"):
 
 def matchstr(estr, fstr, matchtype):
     if matchtype == 'count' or matchtype == 'numeric':
-        ops = {"lt": operator.lt,
-               "gt": operator.gt,
-               "eq": operator.eq}
-
         op, val = fstr.split()
         val = int(val)
 
@@ -93,7 +120,7 @@ def matchstr(estr, fstr, matchtype):
     elif matchtype == 'regex':
         match = (re.search(fstr, estr) is not None)
     elif matchtype == 'numeric':
-        match = isinstance(estr, (int, long) and ops[op](estr, val))
+        match = isinstance(estr, (int, long)) and OPS[op](estr, val)
     elif matchtype == 'count':
         # All other objects than lists are single objects
         if isinstance(estr, list):
@@ -101,8 +128,222 @@ def matchstr(estr, fstr, matchtype):
         else:
             objlen = 1
 
-        match = ops[op](objlen, val)
+        match = OPS[op](objlen, val)
+    elif matchtype in INTERVALS:
+        if (fstr, matchtype) not in _intervals:
+            _intervals[fstr, matchtype] = compile_matchstr(fstr, matchtype)
+        match = _intervals[fstr, matchtype](estr)
     else:
         raise "ERROR: unknown mode"
 
     return match
+
+
+# compiled interval filters of matchstr
+_intervals = {}
+
+
+def compile_filter(filter, matchtype, listcondition="or", matchtypes=None):
+    """Compile a filter into a function of one object.
+
+    The returned function gives the same result as calling filterjson with
+    the same arguments, but the structure of the filter is resolved once,
+    regexes are precompiled and numeric operands are parsed up front.
+    Malformed filters raise ValueError here instead of at match time.
+    """
+    for mt in [matchtype] + (matchtypes or {}).values():
+        if mt not in MATCHTYPES:
+            raise ValueError("unknown matchtype '%s'" % mt)
+
+    if isinstance(filter, dict):
+        return _compile_dict(filter, matchtype, listcondition, matchtypes)
+    elif isinstance(filter, list):
+        return _compile_list(filter, matchtype, listcondition, matchtypes)
+    elif isinstance(filter, basestring):
+        return compile_matchstr(filter, matchtype)
+    else:
+        return lambda event: filterjson(event, filter, matchtype,
+                                        listcondition, matchtypes)
+
+
+def _compile_dict(filter, matchtype, listcondition, matchtypes=None):
+    keys = []
+
+    for k, v in filter.iteritems():
+        keytype = matchtypes.get(k, matchtype) if matchtypes else matchtype
+        if isinstance(v, dict):
+            present = _compile_nested(v, matchtype, listcondition,
+                                      matchtypes)
+        elif isinstance(v, list):
+            present = _compile_nested(v, keytype, listcondition, matchtypes,
+                                      _compile_value(v, keytype))
+        else:
+            present = _compile_value(v, keytype)
+
+        # For count checks, handle a missing key
+        # as if the key were an empty list
+        if keytype == "count" and isinstance(v, basestring):
+            missing = compile_matchstr(v, keytype)([])
+        elif keytype == "count":
+            missing = None
+        else:
+            missing = False
+
+        keys.append((k, v, keytype, present, missing))
+
+    def match_dict(event):
+        match = True
+        for k, v, keytype, present, missing in keys:
+            if k in event:
+                match = present(event[k], match)
+            elif missing is None:
+                match = matchstr([], v, keytype)
+            else:
+                match = missing
+
+            if not match:
+                break
+        return match
+
+    return match_dict
+
+
+def _compile_nested(v, matchtype, listcondition, matchtypes=None,
+                    fallback=None):
+    sub = compile_filter(v, matchtype, listcondition, matchtypes)
+
+    def match_nested(value, match):
+        if fallback is None or isinstance(value, list):
+            return sub(value)
+        return fallback(value, match)
+
+    return match_nested
+
+
+def _compile_value(v, matchtype):
+    if isinstance(v, basestring):
+        scalar = compile_matchstr(v, matchtype)
+        element = scalar
+    else:
+        scalar = lambda value: matchstr(value, v, matchtype)
+        element = lambda value: filterjson(value, v, matchtype)
+
+    def match_value(value, match):
+        # Match filter string against object array
+        if isinstance(value, list):
+            for e in value:
+                match = element(e)
+                if match:
+                    break
+            return match
+        # Match filter string against object string, int, bool
+        return scalar(value)
+
+    return match_value
+
+
+def _compile_list(filter, matchtype, listcondition, matchtypes=None):
+    subs = [compile_filter(f, matchtype, listcondition, matchtypes)
+            for f in filter]
+    stop_on = {'or': True, 'and': False}.get(listcondition)
+
+    def match_list(event):
+        match = True
+        if isinstance(event, list):
+            # empty event, means no hit
+            if len(event) == 0:
+                return False
+            for sub in subs:
+                for e in event:
+                    match = sub(e)
+                    if stop_on is not None and bool(match) == stop_on:
+                        break
+        else:
+            for sub in subs:
+                match = sub(event)
+                if stop_on is not None and bool(match) == stop_on:
+                    break
+        return match
+
+    return match_list
+
+
+def compile_matchstr(fstr, matchtype):
+    """Compile a single filter value into a function of one object value."""
+    if matchtype == 'count' or matchtype == 'numeric':
+        try:
+            op, val = fstr.split()
+            op, val = OPS[op], int(val)
+        except (KeyError, ValueError):
+            raise ValueError("invalid %s filter '%s'" % (matchtype, fstr))
+
+    if matchtype == 'exact':
+        return lambda estr: fstr == estr
+    elif matchtype == 'partial':
+        return lambda estr: estr.find(fstr)
+    elif matchtype == 'regex':
+        try:
+            search = re.compile(fstr).search
+        except re.error as e:
+            raise ValueError("invalid regex '%s': %s" % (fstr, e))
+        return lambda estr: search(estr) is not None
+    elif matchtype == 'numeric':
+        return lambda estr: isinstance(estr, (int, long)) and op(estr, val)
+    elif matchtype == 'count':
+        # All other objects than lists are single objects
+        return lambda estr: op(len(estr) if isinstance(estr, list) else 1,
+                               val)
+    elif matchtype in INTERVALS:
+        return _compile_interval(fstr, matchtype)
+    raise ValueError("unknown matchtype '%s'" % matchtype)
+
+
+def _compile_interval(fstr, matchtype):
+    """Compile a cidr or portrange filter value.
+
+    The syntax is `<relation> <range>... <keyword> <op> <value>`, where
+    either part may be left out: relation is one of overlaps, within,
+    outside or covers, and keyword is prefix for cidr and size for
+    portrange, e.g. "outside 10.0.0.0/8 fc00::/7 prefix le 8" or
+    "covers 3306". Object values that are not a range do not match.
+    """
+    parse, keyword = INTERVALS[matchtype]
+    words = fstr.split()
+    relation = length = None
+
+    try:
+        if len(words) >= 3 and words[-3] == keyword:
+            length = OPS[words[-2]], int(words[-1])
+            words = words[:-3]
+        if words:
+            if words[0] not in RELATIONS or len(words) < 2:
+                raise ValueError('expected one of %s and ranges'
+                                 % ', '.join(RELATIONS))
+            index = IntervalIndex([parse(w)[:2] for w in words[1:]])
+            relation = getattr(index, words[0])
+        elif length is None:
+            raise ValueError('empty filter')
+    except (KeyError, ValueError) as e:
+        raise ValueError("invalid %s filter '%s': %s" % (matchtype, fstr, e))
+
+    # object value -> result, as the same ranges come up over and over
+    results = {}
+
+    def match_interval(estr):
+        if isinstance(estr, basestring) and estr in results:
+            return results[estr]
+        try:
+            start, end, size = parse(estr)
+        except ValueError:
+            match = False
+        else:
+            match = ((relation is None or relation((start, end))) and
+                     (length is None or length[0](size, length[1])))
+
+        if isinstance(estr, basestring):
+            if len(results) >= 10000:
+                results.clear()
+            results[estr] = match
+        return match
+
+    return match_interval
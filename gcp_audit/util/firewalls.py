@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Find the firewall rules that let traffic in to an instance."""
+
+# The fields of a firewall rule that are kept on the instances it
+# applies to.
+FIELDS = ('name', 'sourceRanges', 'sourceTags', 'allowed', 'targetTags',
+          'targetServiceAccounts')
+
+
+def network_key(url):
+    """The part of a network URL from projects/ on, so that full and
+    partial URLs of a network are the same.
+    """
+    i = url.find('projects/')
+    return url[i:] if i >= 0 else url
+
+
+class FirewallIndex(object):
+    """The ingress allow rules of the networks of a project, by target.
+
+    Rules are grouped by network, and within a network by each of their
+    target tags and target service accounts. Rules without targets apply
+    to every instance of their network. Looking up the rules of an
+    instance takes one dict lookup per tag and service account of the
+    instance, however many rules there are.
+
+    Deny rules, and the priorities that make them win over allow rules,
+    are not taken into account.
+    """
+
+    def __init__(self, firewalls):
+        self.firewalls = firewalls
+        # network -> (rules for all instances, {tag: rules},
+        # {service account: rules})
+        self.networks = {}
+
+        for position, firewall in enumerate(firewalls):
+            if firewall.get('direction', 'INGRESS') != 'INGRESS' or \
+                    firewall.get('disabled') or not firewall.get('allowed'):
+                continue
+
+            everyone, by_tag, by_account = self.networks.setdefault(
+                network_key(firewall.get('network', '')), ([], {}, {}))
+            entry = (position, dict((k, firewall[k]) for k in FIELDS
+                                    if k in firewall))
+            tags = firewall.get('targetTags') or []
+            accounts = firewall.get('targetServiceAccounts') or []
+            for tag in tags:
+                by_tag.setdefault(tag, []).append(entry)
+            for account in accounts:
+                by_account.setdefault(account, []).append(entry)
+            if not tags and not accounts:
+                everyone.append(entry)
+
+    def applying(self, network, tags=(), accounts=()):
+        """Return the rules that apply to an instance with these network
+        tags and service accounts in a network, in the order they were
+        listed.
+        """
+        rules = self.networks.get(network_key(network))
+        if rules is None:
+            return []
+
+        everyone, by_tag, by_account = rules
+        entries = dict(everyone)
+        for tag in tags:
+            entries.update(by_tag.get(tag, ()))
+        for account in accounts:
+            entries.update(by_account.get(account, ()))
+        return [firewall for _, firewall in sorted(entries.items())]
+
+
+def applying_firewalls(instance, index_of):
+    """Return the rules that apply to an instance on all of its networks.
+
+    `index_of` returns the FirewallIndex of a project, as a network may
+    be shared from a host project.
+    """
+    tags, accounts = instance_targets(instance)
+    res = []
+    for interface in instance.get('networkInterfaces') or []:
+        network = network_key(interface.get('network') or '')
+        if not network.startswith('projects/'):
+            continue
+        index = index_of(network.split('/')[1])
+        res.extend(index.applying(network, tags, accounts))
+    return res
+
+
+def instance_targets(instance):
+    """Return the network tags and service accounts of an instance."""
+    tags = (instance.get('tags') or {}).get('items') or []
+    accounts = [account.get('email')
+                for account in instance.get('serviceAccounts') or []]
+    return tags, accounts
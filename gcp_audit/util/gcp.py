@@ -19,115 +19,662 @@
 # specific language governing permissions and limitations
 # under the License.
 
-try:
-    from googleapiclient import discovery
-except ImportError:
-    # allow tests without this dependency
-    discovery = None
+import collections
+import itertools
+import os
+import threading
+import time
 
-try:
-    from oauth2client.client import GoogleCredentials
-except ImportError:
-    # allow tests without this dependency
-    GoogleCredentials = None
+import engine
+import jsonstream
+import metrics
 
+from cStringIO import StringIO
+from contextlib import closing
 
-def create_service(service, version='v1'):
-    credentials = GoogleCredentials.get_application_default()
-    service = discovery.build(service, version, credentials=credentials)
+from cache import request_key
+from firewalls import FirewallIndex, applying_firewalls
+from ratelimit import RateLimiter, backoff, quota_exceeded, retryable, status
 
-    return service
 
+_lock = threading.Lock()
+_local = threading.local()
+_credentials = {}
+_documents = {}
+_listings = collections.OrderedDict()
 
-def get_firewalls(project):
-    service = create_service('compute')
-    req = service.firewalls().list(project=project)
+# The API client libraries take a while to import, see _import_clients.
+discovery = None
+httplib2 = None
+GoogleCredentials = None
 
-    try:
-        res = req.execute()['items']
-    except:
-        res = []
+# Maximum number of calls per batch request allowed by the storage API.
+MAX_BATCH_SIZE = 100
+batch_size = MAX_BATCH_SIZE
+listing_cache_size = 64
 
-    return res
+# List buckets with the full projection, whose ACLs are only fetched
+# separately when the listing leaves them out.
+inline_acls = False
 
+# Keep the firewalls of each project in a FirewallIndex, for the checks
+# of instances. Else the firewalls check streams them page by page.
+index_firewalls = False
 
-def get_buckets(project):
-    service = create_service('storage')
-    req = service.buckets().list(project=project)
-    try:
-        res = req.execute()['items']
-    except:
-        res = []
+# The field of a bucket holding the items of each ACL collection, with
+# the full projection.
+INLINE_ACLS = {'bucketAccessControls': 'acl',
+               'defaultObjectAccessControls': 'defaultObjectAcl'}
 
-    return res
+# A ResponseCache for API responses, if any.
+cache = None
 
+# Calls per second per API, limited once quota errors come back.
+limiter = RateLimiter()
+max_retries = 5
 
-def get_default_acls(project):
-    res = []
+# FetchErrors of all requests that failed for good.
+failures = []
 
-    for bucket in get_buckets(project):
-        res.extend(get_default_access_controls(project, bucket["name"]))
 
-    return res
+class FetchError(Exception):
+    """A request that still failed after all retries."""
 
+    def __init__(self, method, target, cause):
+        Exception.__init__(self, '%s %s: %s' % (method, target,
+                                                str(cause) or
+                                                cause.__class__.__name__))
+        self.method = method
+        self.target = target
+        self.cause = cause
+        self.status = status(cause)
+
+
+class _Shared(object):
+    """Process-wide stand-in for the thread-local state."""
+
+
+def init_engine():
+    """Recreate the locks and connection state for the engine in use.
+
+    Under the async engine all greenlets run in one OS thread, and share
+    the services and a pool of connections.
+    """
+    global _lock, _local
+
+    _lock = threading.Lock()
+    _local = _Shared() if engine.name == 'async' else threading.local()
+
+
+def _import_clients():
+    """Import the API client libraries, when the first service is needed.
+
+    Runs that never build a service, like --assets or merge, do not pay
+    for them, and the async engine is installed before they create any
+    lock.
+    """
+    global discovery, httplib2, GoogleCredentials
+
+    if discovery is None:
+        from googleapiclient import discovery
+    if httplib2 is None:
+        import httplib2
+    if GoogleCredentials is None:
+        from oauth2client.client import GoogleCredentials
+
+
+def record_failure(method, target, cause):
+    error = FetchError(method, target, cause)
+    with _lock:
+        failures.append(error)
+    return error
+
+
+def get_credentials():
+    """Load the application default credentials once per keyfile."""
+    key = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
+    _import_clients()
+
+    with _lock:
+        if key not in _credentials:
+            _credentials[key] = GoogleCredentials.get_application_default()
+        return key, _credentials[key]
+
+
+def get_http():
+    """Return this thread's authorized keep-alive connection pool.
+
+    httplib2.Http objects are not thread-safe, so each thread gets its own,
+    shared between all services using the same credentials.
+    """
+    pools = _local.__dict__.setdefault('http', {})
+
+    if cache is not None and cache.replay:
+        # replays never touch the network and need no credentials
+        if None not in pools:
+            pools[None] = _new_http(None)
+        return None, pools[None]
+
+    key, credentials = get_credentials()
+    if key not in pools:
+        pools[key] = _new_http(credentials)
+    return key, pools[key]
+
+
+def _new_http(credentials):
+    _import_clients()
+    if credentials is None:
+        factory = httplib2.Http
+    else:
+        factory = lambda: credentials.authorize(httplib2.Http())
+
+    if engine.name == 'async':
+        return engine.SharedHttp(factory, engine.max_inflight)
+    return factory()
+
+
+def create_service(service, version='v1'):
+    """Return a cached service object for the calling thread.
+
+    Services are keyed by (service, version, credentials), and the
+    discovery document of each API is only fetched once per process.
+    """
+    key, http = get_http()
+    services = _local.__dict__.setdefault('services', {})
+
+    if (service, version, key) not in services:
+        start = metrics.clock()
+        with _lock:
+            if (service, version) not in _documents:
+                _documents[(service, version)] = \
+                    _discovery_document(service, version, http)
+            document = _documents[(service, version)]
+
+        services[(service, version, key)] = \
+            discovery.build_from_document(document, http=http)
+        metrics.record('stage', 'create_service', start)
+
+    return services[(service, version, key)]
+
+
+def _discovery_document(service, version, http):
+    key = 'discovery %s %s' % (service, version)
+    document = cache.get(key) if cache is not None else None
+
+    if document is None:
+        resource = discovery.build(service, version, http=http,
+                                   cache_discovery=False)
+        document = resource._rootDesc
+        if cache is not None:
+            cache.put(key, document)
+
+    return document
+
+
+def call(method, func, tokens=1):
+    """Call func under the rate limit of the API that `method` belongs to.
+
+    Quota, server and transport errors are retried with exponential
+    backoff, and quota errors also slow down the API's token bucket.
+    """
+    bucket = limiter.bucket(method.split('.')[0])
+
+    for attempt in range(max_retries + 1):
+        bucket.acquire(tokens)
+        try:
+            res = func()
+        except Exception as e:
+            if quota_exceeded(e):
+                bucket.throttled()
+            if attempt < max_retries and retryable(e):
+                time.sleep(backoff(attempt))
+                continue
+            raise
+        bucket.succeeded()
+        return res
+
+
+def execute(req, cached=True):
+    """Execute a request, going through the response cache if enabled.
+
+    Requests that fail for good are recorded and raise FetchError.
+    """
+    key = request_key(req) if cache is not None and cached else None
+    resp = cache.get(key) if key else None
+
+    if resp is None:
+        sizes = _measure(req, [])
+        start = metrics.clock()
+        try:
+            resp = call(req.methodId, req.execute)
+        except Exception as e:
+            metrics.record('api', req.methodId, start, errors=1)
+            raise record_failure(req.methodId, req.uri, e)
+        metrics.record('api', req.methodId, start, nbytes=sum(sizes))
+        if key:
+            cache.put(key, resp)
+    elif key:
+        metrics.record('cache', req.methodId, None)
+    return resp
+
+
+def _measure(req, sizes):
+    """Add the size of each response to req to the list sizes.
+
+    Batch requests hand every part of their response to the postproc of
+    the request it belongs to, so this works for those too.
+    """
+    if metrics.enabled:
+        postproc = req.postproc
+
+        def measured(resp, content):
+            sizes.append(len(content))
+            return postproc(resp, content)
+
+        req.postproc = measured
+    return sizes
+
+
+def paginate(collection, req, key='items', method='list'):
+    """Yield the items of each page of a list request as it arrives.
+
+    `method` is the name of the collection's method that made the request,
+    whose _next method requests the next page.
+    """
+    next_page = getattr(collection, method + '_next', None)
+    while req is not None:
+        rest = {}
+        for item in page_items(req, key, rest):
+            yield item
+        req = next_page(req, rest) if next_page else None
+
+
+def page_items(req, key, rest):
+    """Yield the items of one page of a list request, parsed one at a
+    time from the response or cached body. The other fields of the page,
+    like nextPageToken, are added to the dict `rest` at the end.
+    """
+    cache_key = request_key(req) if cache is not None else None
+    f = cache.open(cache_key) if cache_key else None
+    if f is not None:
+        metrics.record('cache', req.methodId, None)
+    elif hasattr(req, 'postproc'):
+        req.postproc = _raw(req.postproc)
+        content = execute(req, cached=False)
+        if cache_key:
+            cache.put_raw(cache_key, content)
+        f = StringIO(content)
+    else:
+        resp = execute(req)
+        rest.update((k, v) for k, v in resp.iteritems() if k != key)
+        items = resp.get(key, [])
+        if isinstance(items, dict):
+            items = [items[k] for k in sorted(items)]
+        for item in items:
+            yield item
+        return
 
-def get_default_access_controls(project, bucket):
-    service = create_service('storage')
-    req = service.defaultObjectAccessControls().list(bucket=bucket)
     try:
-        res = req.execute()['items']
-    except:
-        res = []
+        with closing(f):
+            for item in jsonstream.iter_items(f, key, rest):
+                yield item
+    except ValueError as e:
+        raise record_failure(req.methodId, req.uri, e)
 
-    return res
 
+def _raw(postproc):
+    """Make a request return the body of a successful response as it is,
+    instead of parsing it.
+    """
+    def raw(resp, content):
+        if resp.status >= 300:
+            # raises the HttpError
+            return postproc(resp, content)
+        return content
+    return raw
 
-def get_acls_for_bucket(project, bucket):
+
+def get_firewalls(project):
+    if index_firewalls:
+        return iter(get_firewall_index(project).firewalls)
+    firewalls = create_service('compute').firewalls()
+    return paginate(firewalls, firewalls.list(project=project))
+
+
+def get_firewall_index(project):
+    """List the firewalls of a project once, for the firewalls check and
+    the instances of the project, or of projects sharing its networks.
+    """
+    def build():
+        firewalls = create_service('compute').firewalls()
+        return FirewallIndex(list(paginate(firewalls,
+                                           firewalls.list(project=project))))
+    return shared_listing('firewalls', project, build)
+
+
+def get_instances(project, failed=None):
+    """List the instances of all zones of a project in one stream.
+
+    Each instance gets the ingress rules that let traffic in to it under
+    `firewalls`, see FirewallIndex. The selfLinks of the instances on a
+    network whose firewalls could not be listed are added to `failed`.
+    """
+    unreadable = []
+
+    def index_of(host):
+        index = _instance_firewall_index(host)
+        if index is _no_firewalls:
+            unreadable.append(host)
+        return index
+
+    instances = create_service('compute').instances()
+    req = instances.aggregatedList(project=project)
+    for scoped in paginate(instances, req, method='aggregatedList'):
+        # zones without instances only hold a warning
+        for instance in scoped.get('instances', []):
+            del unreadable[:]
+            instance[u'firewalls'] = applying_firewalls(instance, index_of)
+            if unreadable and failed is not None:
+                failed.add(instance.get('selfLink'))
+            yield instance
+
+
+# stands in for the firewalls of a project that cannot be listed
+_no_firewalls = FirewallIndex([])
+
+
+def _instance_firewall_index(project):
+    """Like get_firewall_index, but a project whose firewalls cannot be
+    listed has none, so that its instances are still audited.
+    """
+    def build():
+        try:
+            return get_firewall_index(project)
+        except FetchError as e:
+            record_failure('compute.firewalls.list', project,
+                           'instances audited without these firewalls: %s'
+                           % e)
+            return _no_firewalls
+    return shared_listing('instance-firewalls', project, build)
+
+
+def get_buckets(project):
+    buckets = create_service('storage').buckets()
+    if inline_acls:
+        return paginate(buckets, buckets.list(project=project,
+                                              projection='full'))
+    return paginate(buckets, buckets.list(project=project))
+
+
+def get_bucket_list(project):
+    """List the buckets of a project once, for all storage checks."""
+    return shared_listing('buckets', project,
+                          lambda: list(get_buckets(project)))
+
+
+def shared_listing(kind, project, build):
+    """Build a listing of a project once, for all checks that use it.
+
+    The listings of the most recently listed projects are kept, so that
+    checks of a project share one listing even when they run
+    concurrently.
+    """
+    with _lock:
+        entry = _listings.get((kind, project))
+        if entry is None:
+            entry = _listings[kind, project] = [threading.Lock(), None]
+            if len(_listings) > listing_cache_size:
+                _listings.popitem(last=False)
+
+    with entry[0]:
+        if entry[1] is None:
+            entry[1] = build()
+        return entry[1]
+
+
+def forget_listings():
+    """Drop the listings kept for the checks."""
+    with _lock:
+        _listings.clear()
+
+
+def uniform_access(bucket):
+    """Whether a bucket ignores ACLs for IAM alone."""
+    config = bucket.get('iamConfiguration') or {}
+    return any((config.get(field) or {}).get('enabled')
+               for field in ('uniformBucketLevelAccess', 'bucketPolicyOnly'))
+
+
+def batch_list(collection, buckets, method='list', key='items',
+               failed=None):
+    """Call `method` of `collection` for each bucket, grouped into batch
+    requests.
+
+    Returns a dict from bucket name to the `key` items of its response.
+    Only the sub-requests that failed with a retryable error are sent
+    again. Buckets that could not be fetched are recorded in `failures`,
+    added to `failed` if given, and map to an empty list.
+    """
     service = create_service('storage')
-    req = service.bucketAccessControls().list(bucket=bucket)
+    bucket_limit = limiter.bucket('storage')
+    res = dict((bucket, []) for bucket in buckets)
+    requests = {}
+    errors = {}
+    pending = []
+
+    request = getattr(getattr(service, collection)(), method)
+    method = 'storage.%s.%s' % (collection, method)
+    sizes = []
+
+    for bucket in buckets:
+        req = request(bucket=bucket)
+        resp = cache.get(request_key(req)) if cache is not None else None
+        if resp is None:
+            requests[bucket] = req
+            pending.append(bucket)
+            _measure(req, sizes)
+        else:
+            res[bucket] = resp.get(key, [])
+            metrics.record('cache', method, None)
+
+    def callback(request_id, response, exception):
+        if exception is None:
+            res[request_id] = response.get(key, [])
+            errors.pop(request_id, None)
+            if cache is not None:
+                cache.put(request_key(requests[request_id]), response)
+            return
+
+        errors[request_id] = exception
+        if quota_exceeded(exception):
+            bucket_limit.throttled()
+        if retryable(exception):
+            retry.append(request_id)
+
+    for attempt in range(max_retries + 1):
+        retry = []
+
+        for i in range(0, len(pending), batch_size):
+            chunk = pending[i:i + batch_size]
+            batch = service.new_batch_http_request(callback=callback)
+            for bucket in chunk:
+                batch.add(requests[bucket], request_id=bucket)
+
+            bucket_limit.acquire(len(chunk))
+            start = metrics.clock()
+            del sizes[:]
+            try:
+                batch.execute()
+            except Exception as e:
+                for bucket in chunk:
+                    errors[bucket] = e
+                if quota_exceeded(e):
+                    bucket_limit.throttled()
+                if retryable(e):
+                    retry.extend(chunk)
+            metrics.record('api', method, start, count=len(chunk),
+                           errors=sum(1 for bucket in chunk
+                                      if bucket in errors),
+                           nbytes=sum(sizes))
+
+        pending = retry
+        if not pending or attempt == max_retries:
+            break
+        time.sleep(backoff(attempt))
 
-    try:
-        res = req.execute()['items']
-    except:
-        res = []
+    for bucket in buckets:
+        if bucket in errors:
+            record_failure(method, bucket, errors[bucket])
+            if failed is not None:
+                failed.add(bucket)
 
     return res
 
 
-def get_acls_for_buckets(project):
-    res = []
+def _per_bucket(project, buckets, collection, single, method='list',
+                key='items', failed=None):
+    """Yield (bucket, items) for one request per bucket, in batch
+    requests unless batching is disabled.
+
+    Buckets whose items could not be fetched have none, and are added to
+    `failed` if given.
+    """
+    def list_chunk(chunk):
+        # the async engine runs this in a greenlet of its own
+        metrics.set_project(project)
+        return batch_list(collection, chunk, method, key, failed)
+
+    def list_bucket(bucket):
+        metrics.set_project(project)
+        try:
+            return list(single(project, bucket))
+        except FetchError:
+            if failed is not None:
+                failed.add(bucket)
+            return []
+
+    if batch_size > 1:
+        chunks = [buckets[i:i + batch_size]
+                  for i in range(0, len(buckets), batch_size)]
+        results = engine.imap(list_chunk, chunks)
+        for chunk, items in itertools.izip(chunks, results):
+            for bucket in chunk:
+                yield bucket, items[bucket]
+    else:
+        results = engine.imap(list_bucket, buckets)
+        for bucket, items in itertools.izip(buckets, results):
+            yield bucket, items
+
+
+def _bucket_acls(project, collection, single, failed=None):
+    """Yield the ACLs of the buckets of a project that use them.
+
+    Buckets with uniform bucket-level access are skipped, as their ACLs
+    have no effect and cannot be listed. The buckets whose ACLs could not
+    be fetched are added to `failed`.
+    """
+    missing = []
+    for bucket in get_bucket_list(project):
+        if uniform_access(bucket):
+            continue
+        acls = bucket.get(INLINE_ACLS[collection]) if inline_acls else None
+        if acls is None:
+            # left out of the listing, e.g. without OWNER on the bucket
+            missing.append(bucket['name'])
+            continue
+        for acl in acls:
+            acl = dict(acl)
+            acl.setdefault(u'bucket', bucket['name'])
+            yield acl
+
+    for _, acls in _per_bucket(project, missing, collection, single,
+                               failed=failed):
+        for acl in acls:
+            yield acl
+
+
+def _bucket_policies(project, failed=None):
+    """Yield a binding of a member to a role per IAM policy member of the
+    buckets of a project with uniform bucket-level access.
+    """
+    buckets = [bucket['name'] for bucket in get_bucket_list(project)
+               if uniform_access(bucket)]
+
+    for bucket, bindings in _per_bucket(project, buckets, 'buckets',
+                                        get_bucket_bindings, 'getIamPolicy',
+                                        'bindings', failed):
+        for binding in bindings:
+            for member in binding.get('members', []):
+                obj = {u'kind': u'storage#policyBinding', u'bucket': bucket,
+                       u'entity': member, u'role': binding.get('role')}
+                if 'condition' in binding:
+                    obj[u'condition'] = binding['condition']
+                yield obj
+
+
+def get_bucket_bindings(project, bucket):
+    buckets = create_service('storage').buckets()
+    return execute(buckets.getIamPolicy(bucket=bucket)).get('bindings', [])
+
+
+def get_default_acls(project, failed=None):
+    return _bucket_acls(project, 'defaultObjectAccessControls',
+                        get_default_access_controls, failed)
 
-    for bucket in get_buckets(project):
-        res += get_acls_for_bucket(project, bucket['name'])
 
-    return res
+def get_default_access_controls(project, bucket):
+    acls = create_service('storage').defaultObjectAccessControls()
+    return paginate(acls, acls.list(bucket=bucket))
 
 
-def get_cloudsql_instances(project):
-    service = create_service(service='sqladmin', version='v1beta4')
-    req = service.instances().list(project=project)
+def get_acls_for_bucket(project, bucket):
+    acls = create_service('storage').bucketAccessControls()
+    return paginate(acls, acls.list(bucket=bucket))
 
-    try:
-        res = req.execute()['items']
-    except:
-        res = []
 
-    return res
+def get_acls_for_buckets(project, failed=None):
+    """The ACLs of the buckets of a project, and the IAM policy members of
+    those with uniform bucket-level access.
 
+    The buckets whose ACLs or policies could not be fetched are added to
+    `failed`.
+    """
+    return itertools.chain(_bucket_acls(project, 'bucketAccessControls',
+                                        get_acls_for_bucket, failed),
+                           _bucket_policies(project, failed))
 
-def get_all_projects():
-    """Get all organizations that the credentials have access to."""
-    projects = []
-    page_token = None
 
-    while True:
-        resp = create_service('cloudresourcemanager', 'v1beta1').projects() \
-            .list(pageSize=250, pageToken=page_token).execute()
+def get_cloudsql_instances(project):
+    instances = create_service(service='sqladmin', version='v1beta4') \
+        .instances()
+    return paginate(instances, instances.list(project=project))
 
-        projects += [x['projectId'] for x in resp['projects']]
 
-        page_token = resp.get('nextPageToken', None)
-        if not page_token:
-            break
+def get_iam_bindings(project):
+    """Yield a binding of a member to a role per member of the IAM policy
+    of a project.
+    """
+    projects = create_service('cloudresourcemanager', 'v1beta1').projects()
+    policy = execute(projects.getIamPolicy(resource=project, body={}))
+    return policy_bindings(project, policy)
+
+
+def policy_bindings(project, policy):
+    """Yield an object per member and role of a project IAM policy."""
+    for binding in policy.get('bindings', []):
+        for member in binding.get('members', []):
+            obj = {u'kind': u'cloudresourcemanager#policyBinding',
+                   u'project': project, u'member': member,
+                   u'role': binding.get('role')}
+            if 'condition' in binding:
+                obj[u'condition'] = binding['condition']
+            yield obj
+
+
+def get_all_projects():
+    """Get all organizations that the credentials have access to."""
+    projects = create_service('cloudresourcemanager', 'v1beta1').projects()
+    req = projects.list(pageSize=250)
 
-    return projects
+    for project in paginate(projects, req, key='projects'):
+        yield project['projectId']
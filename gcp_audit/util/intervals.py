@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Address ranges and port ranges as closed integer intervals."""
+
+import binascii
+import bisect
+import socket
+
+# IPv6 addresses are moved above the IPv4 ones, so that both families
+# share one line of integers without overlapping.
+IPV6 = 1 << 128
+
+
+class IntervalIndex(object):
+    """A set of intervals answering overlap and containment queries.
+
+    Every query is two binary searches, no matter how many intervals the
+    index holds.
+    """
+
+    def __init__(self, intervals):
+        by_start = sorted(intervals)
+        self.starts = [s for s, _ in by_start]
+        self.max_ends = _running_max(e for _, e in by_start)
+
+        by_end = sorted(intervals, key=lambda i: (i[1], i[0]))
+        self.ends = [e for _, e in by_end]
+        self.max_starts = _running_max(s for s, _ in by_end)
+
+    def overlaps(self, interval):
+        """Whether any interval of the index shares a value with this one."""
+        start, end = interval
+        i = bisect.bisect_right(self.starts, end)
+        return i > 0 and self.max_ends[i - 1] >= start
+
+    def within(self, interval):
+        """Whether an interval of the index holds all of this one."""
+        start, end = interval
+        i = bisect.bisect_right(self.starts, start)
+        return i > 0 and self.max_ends[i - 1] >= end
+
+    def outside(self, interval):
+        """Whether no interval of the index holds all of this one."""
+        return not self.within(interval)
+
+    def covers(self, interval):
+        """Whether this interval holds all of an interval of the index."""
+        start, end = interval
+        i = bisect.bisect_right(self.ends, end)
+        return i > 0 and self.max_starts[i - 1] >= start
+
+
+def _running_max(values):
+    res = []
+    for v in values:
+        res.append(max(v, res[-1]) if res else v)
+    return res
+
+
+def parse_cidr(value):
+    """Parse an address or a network into (start, end, prefix length).
+
+    Host bits are ignored, so 10.1.2.3/8 is 10.0.0.0/8. Raises
+    ValueError on anything else.
+    """
+    if not isinstance(value, basestring):
+        raise ValueError('not an address: %r' % (value,))
+
+    addr, _, prefix = value.strip().partition('/')
+    family, bits, offset = socket.AF_INET, 32, 0
+    if ':' in addr:
+        family, bits, offset = socket.AF_INET6, 128, IPV6
+    try:
+        packed = socket.inet_pton(family, addr.encode('ascii'))
+        prefix = int(prefix) if prefix else bits
+    except (socket.error, ValueError, UnicodeError):
+        raise ValueError('not an address: %r' % (value,))
+    if not 0 <= prefix <= bits:
+        raise ValueError('invalid prefix length: %r' % (value,))
+
+    hosts = (1 << (bits - prefix)) - 1
+    start = int(binascii.hexlify(packed), 16) & ~hosts
+    return offset + start, offset + start + hosts, prefix
+
+
+def parse_portrange(value):
+    """Parse a port, or a range like 1000-2000, into (start, end, size)."""
+    if isinstance(value, (int, long)) and not isinstance(value, bool):
+        start = end = value
+    elif isinstance(value, basestring):
+        first, _, last = value.strip().partition('-')
+        try:
+            start = int(first)
+            end = int(last) if last else start
+        except ValueError:
+            raise ValueError('not a port range: %r' % (value,))
+    else:
+        raise ValueError('not a port range: %r' % (value,))
+
+    if not 0 <= start <= end <= 65535:
+        raise ValueError('not a port range: %r' % (value,))
+    return start, end, end - start + 1
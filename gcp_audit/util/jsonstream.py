@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Parse the items of a JSON listing one at a time, as it is read.
+
+A page of a listing is an object with the items in one array member,
+next to a few small ones like nextPageToken. Parsing the whole page at
+once builds every item before the first one can be audited, which takes
+several times the size of the JSON text. Here only the item being
+parsed, and a chunk of the input, are held in memory.
+"""
+
+import json
+import re
+
+CHUNK_SIZE = 1 << 16
+
+_decoder = json.JSONDecoder()
+WHITESPACE = ' \t\n\r'
+_whitespace = re.compile('[%s]*' % WHITESPACE)
+
+
+class _Reader(object):
+    """A buffer over a file, that values are decoded from."""
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        # the offset of buf in the file
+        self.offset = 0
+        self.eof = False
+
+    def fill(self, size):
+        data = self.f.read(size)
+        if not data:
+            self.eof = True
+        self.offset += self.pos
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+
+    def peek(self):
+        """Skip whitespace and return the next character, '' at the end."""
+        c = self.buf[self.pos:self.pos + 1]
+        if c and c not in WHITESPACE:
+            return c
+        while True:
+            self.pos = _whitespace.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos:self.pos + 1]
+            self.fill(self.chunk_size)
+
+    def expect(self, chars):
+        c = self.peek()
+        if not c or c not in chars:
+            raise ValueError('expected %s at byte %d' % (
+                ' or '.join(repr(c) for c in chars), self.offset + self.pos))
+        self.pos += 1
+        return c
+
+    def members(self):
+        """Yield the name of each member of an object. The value of each
+        is to be read before the next name.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+
+        while True:
+            name = self.value()
+            if not isinstance(name, basestring):
+                raise ValueError('expected a member name at byte %d'
+                                 % (self.offset + self.pos))
+            self.expect(':')
+            yield name
+            if self.expect(',}') == '}':
+                return
+
+    def elements(self):
+        """Yield the elements of an array."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+    def value(self):
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if self.eof:
+                    raise
+                end = None
+            # a number that ends the buffer may go on in the next chunk
+            if end is not None and (end < len(self.buf) or self.eof):
+                self.pos = end
+                return value
+            # read more at a time for a value that does not fit, so that
+            # it is decoded a few times at most
+            self.fill(size)
+            size *= 2
+
+
+def iter_items(f, key='items', rest=None, chunk_size=CHUNK_SIZE):
+    """Yield the elements of the array `key` of the JSON object in f.
+
+    If `key` holds an object instead, as in the aggregated lists of the
+    compute API, the values of its members are yielded. The other members
+    of the object are added to the dict `rest`, if given, once all items
+    were yielded. Raises ValueError if f does not hold a JSON object.
+    """
+    reader = _Reader(f, chunk_size)
+    for name in reader.members():
+        if name == key and reader.peek() == '[':
+            for item in reader.elements():
+                yield item
+        elif name == key and reader.peek() == '{':
+            for _ in reader.members():
+                yield reader.value()
+        else:
+            value = reader.value()
+            if rest is not None:
+                rest[name] = value
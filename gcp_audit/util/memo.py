@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Remember rule results for objects that look the same to the rules."""
+
+from operator import itemgetter
+
+STRINGS = frozenset([str, unicode])
+
+_MISSING = object()
+
+
+def read_keys(rule):
+    """Return the sorted top-level keys a rule reads, or None if a filter
+    is matched against the whole object.
+    """
+    keys = set()
+    for f in rule['filters']:
+        if not isinstance(f['filter'], dict):
+            return None
+        keys.update(f['filter'])
+    return tuple(sorted(keys))
+
+
+def freeze(value):
+    """Turn a JSON value into a hashable one that equals another only if
+    the values are equal and of the same types, so 1, 1.0 and True stay
+    apart. Dicts are compared regardless of their order.
+    """
+    kind = value.__class__
+    if kind in STRINGS:
+        return value
+    elif kind is list:
+        return (list, tuple([freeze(v) for v in value]))
+    elif kind is dict:
+        return (dict, frozenset([(k, freeze(v))
+                                 for k, v in value.iteritems()]))
+    return (kind, value)
+
+
+class RuleMemo(object):
+    """Remembers which rules of a category matched objects that are the
+    same in the keys those rules read.
+
+    The results of each rule are remembered by the values of the
+    top-level keys its filters name, together with the other rules that
+    read the same keys. Objects that only differ in other keys, like their
+    name, id, selfLink or creationTimestamp, are only evaluated once by
+    the rules that do not read those keys, even if another rule does.
+    Rules that filter the whole object are run every time.
+
+    Results are kept in two generations of size / 2 entries. A result
+    found in the old one moves to the new one, and the old one is dropped
+    when the new one is full, so only results that were not used for at
+    least size / 2 lookups are forgotten.
+    """
+
+    def __init__(self, index, name, size=10000):
+        self.index = index
+        self.rules = index.rules
+        self.name = name
+        self.size = max(size // 2, 1)
+        self.recent = {}
+        self.old = {}
+
+        self.memoized = []
+        self.other = []
+        groups = {}
+        for position, (rule, match) in enumerate(index.rules):
+            rule_keys = read_keys(rule)
+            if rule_keys is None:
+                self.other.append((position, rule, match))
+            else:
+                groups.setdefault(rule_keys, []).append((position, rule,
+                                                         match))
+                self.memoized.append((position, rule, match))
+        self.keys = sorted(set(k for keys in groups for k in keys))
+        # (getter of the values of the keys a group of rules reads out of
+        # the values of all keys, the rules)
+        self.groups = [(itemgetter(*[self.keys.index(k) for k in keys]),
+                        entries)
+                       for keys, entries in sorted(groups.iteritems())]
+
+    def candidates(self, obj):
+        return self.index.candidates(obj)
+
+    def match(self, obj, run):
+        """Return the (rule, match) pairs of the rules matching obj, and
+        whether the results of all rules were remembered, or None if the
+        object can't be looked up.
+
+        run(obj, rule, match) tells whether a rule matches obj.
+        """
+        if obj.__class__ is not dict or not self.memoized:
+            return [(rule, match) for rule, match in self.candidates(obj)
+                    if run(obj, rule, match)], None
+
+        values = [freeze(obj.get(k, _MISSING)) for k in self.keys]
+        matched = []
+        hit = True
+        for group, (getter, entries) in enumerate(self.groups):
+            key = (group, getter(values))
+
+            found = self.recent.get(key)
+            if found is None:
+                found = self.old.get(key)
+                if found is None:
+                    hit = False
+                    found = _run(obj, entries, run)
+                if len(self.recent) >= self.size:
+                    self.old = self.recent
+                    self.recent = {}
+                self.recent[key] = found
+            matched.extend(found)
+
+        if self.other:
+            matched.extend(_run(obj, self.other, run))
+        matched.sort()
+        return [(rule, match) for _, rule, match in matched], hit
+
+
+def _run(obj, entries, run):
+    return tuple([entry for entry in entries
+                  if run(obj, entry[1], entry[2])])
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Combine the results files of several runs into one report.
+
+Results files must be in the json or jsonl format, optionally gzipped.
+A finding that is in more than one file is reported once, with the data
+of its latest occurrence.
+"""
+
+import datetime
+import json
+
+from assets import open_export
+
+FIELDS = ('time', 'project', 'check', 'object', 'rule')
+_TIME_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+
+
+def parse_time(value):
+    for fmt in _TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError('invalid time: %r' % (value,))
+
+
+def read_findings(path):
+    """Yield the findings of a json or jsonl results file."""
+    with open_export(path) as f:
+        data = f.read()
+
+    start = data.lstrip()[:1]
+    if not start:
+        return
+    if start == '[':
+        findings = json.loads(data)
+    elif start == '{':
+        findings = []
+        for lineno, line in enumerate(data.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                findings.append(json.loads(line))
+            except ValueError as e:
+                raise ValueError('%s:%d: %s' % (path, lineno, e))
+    else:
+        raise ValueError('%s is not a json or jsonl results file' % path)
+
+    for finding in findings:
+        if not isinstance(finding, dict) or \
+                not all(field in finding for field in FIELDS):
+            raise ValueError('%s: not a finding: %r' % (path, finding))
+        finding['time'] = parse_time(finding['time'])
+        yield finding
+
+
+def finding_key(finding):
+    return (finding['project'], finding['check'], finding['object'],
+            finding['rule'], finding.get('status'))
+
+
+def merge(paths):
+    """Return the findings of all results files, without duplicates,
+    sorted by project, check, object and rule.
+    """
+    findings = {}
+    for path in paths:
+        for finding in read_findings(path):
+            key = finding_key(finding)
+            seen = findings.get(key)
+            if seen is None or finding['time'] >= seen['time']:
+                findings[key] = finding
+    return [findings[key] for key in sorted(findings,
+                                            key=lambda k: map(unicode, k))]
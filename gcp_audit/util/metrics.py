@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Counters and timings of a run, to find out where the time goes.
+
+Nothing is recorded until enable() is called. Until then every hook
+returns right away, so they can stay in the hot paths.
+
+Stats are kept per (kind, name, project):
+
+- api: one API method, with the calls, errors, seconds and response
+  bytes of each project
+- cache: API responses served from the response cache
+- stage: the other steps of a run, like create_service, loadrules and
+  write
+- rule: the objects a rule was evaluated on, and how many matched
+- memo: the rule results of a category looked up in its memo, and how
+  many were found
+"""
+
+import json
+import os
+import threading
+import time
+
+KINDS = ('api', 'cache', 'stage', 'rule', 'memo')
+
+enabled = False
+stats = {}
+
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class Stat(object):
+
+    __slots__ = ('count', 'errors', 'matches', 'seconds', 'max', 'bytes')
+
+    def __init__(self):
+        self.count = self.errors = self.matches = self.bytes = 0
+        self.seconds = self.max = 0.0
+
+    def to_dict(self):
+        return dict((k, getattr(self, k)) for k in self.__slots__)
+
+
+def enable():
+    """Start recording, after the engine is installed."""
+    global enabled, _local
+
+    # a local made before gevent patched threading would be shared by
+    # all greenlets
+    _local = threading.local()
+    enabled = True
+
+
+def reset():
+    global enabled
+
+    enabled = False
+    stats.clear()
+
+
+def clock():
+    """The start time to pass to record, if enabled."""
+    return time.time() if enabled else 0
+
+
+def set_project(project):
+    """Attribute the API calls of this thread to a project."""
+    if enabled:
+        _local.project = project
+
+
+def record(kind, name, start, count=1, errors=0, matches=0, nbytes=0,
+           project=None):
+    """Add to the stats of a name, timed from start unless it is None."""
+    if not enabled:
+        return
+
+    seconds = time.time() - start if start else 0.0
+    if kind == 'api' and project is None:
+        project = getattr(_local, 'project', None)
+
+    with _lock:
+        stat = stats.get((kind, name, project))
+        if stat is None:
+            stat = stats[kind, name, project] = Stat()
+        stat.count += count
+        stat.errors += errors
+        stat.matches += matches
+        stat.bytes += nbytes
+        stat.seconds += seconds
+        stat.max = max(stat.max, seconds)
+
+
+def totals(kind, by='name'):
+    """Sum up the stats of a kind per name or per project."""
+    res = {}
+    with _lock:
+        items = [(key, stat) for key, stat in stats.items()
+                 if key[0] == kind]
+
+    for (_, name, project), stat in items:
+        key = name if by == 'name' else project
+        total = res.setdefault(key, Stat())
+        total.count += stat.count
+        total.errors += stat.errors
+        total.matches += stat.matches
+        total.bytes += stat.bytes
+        total.seconds += stat.seconds
+        total.max = max(total.max, stat.max)
+    return res
+
+
+def to_json():
+    with _lock:
+        items = sorted(stats.items(), key=lambda (key, _): map(unicode, key))
+
+    res = dict((kind, []) for kind in KINDS)
+    for (kind, name, project), stat in items:
+        entry = stat.to_dict()
+        entry['name'] = name
+        if project is not None:
+            entry['project'] = project
+        res[kind].append(entry)
+    return res
+
+
+def load(data):
+    """Add the stats of another run, as written by to_json."""
+    with _lock:
+        for kind in KINDS:
+            for entry in data.get(kind, []):
+                key = (kind, entry['name'], entry.get('project'))
+                stat = stats.get(key)
+                if stat is None:
+                    stat = stats[key] = Stat()
+                for field in ('count', 'errors', 'matches', 'seconds',
+                              'bytes'):
+                    setattr(stat, field,
+                            getattr(stat, field) + entry.get(field, 0))
+                stat.max = max(stat.max, entry.get('max', 0.0))
+
+
+def _escape(value):
+    return unicode(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def to_prometheus():
+    """Format the stats for the Prometheus node exporter textfile collector."""
+    counts = {'api': 'requests_total', 'cache': 'hits_total',
+              'stage': 'calls_total', 'rule': 'objects_total'}
+    fields = [('errors', 'errors_total'), ('matches', 'matches_total'),
+              ('seconds', 'seconds_total'), ('bytes', 'bytes_total')]
+    data = to_json()
+    lines = []
+
+    for kind in KINDS:
+        if kind == 'memo':
+            suffixes = [('count', 'lookups_total'), ('matches', 'hits_total')]
+        else:
+            suffixes = [('count', counts[kind])] + fields
+        for field, suffix in suffixes:
+            samples = [entry for entry in data[kind] if entry[field]]
+            if not samples:
+                continue
+            metric = 'gcp_audit_%s_%s' % (kind, suffix)
+            lines.append('# TYPE %s counter' % metric)
+            for entry in samples:
+                labels = 'name="%s"' % _escape(entry['name'])
+                if 'project' in entry:
+                    labels += ',project="%s"' % _escape(entry['project'])
+                lines.append('%s{%s} %r' % (metric, labels, entry[field]))
+
+    return u'\n'.join(lines) + u'\n'
+
+
+def write(path):
+    """Write the stats as a Prometheus textfile if path ends in .prom,
+    else as JSON. The file is replaced at once, so that a collector never
+    reads half of it.
+    """
+    if path.endswith('.prom'):
+        data = to_prometheus().encode('utf-8')
+    else:
+        data = json.dumps(to_json(), indent=2, sort_keys=True)
+
+    tmp = '%s.tmp' % path
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.rename(tmp, path)
+
+
+def summary(top=10):
+    """Return the lines of a table of the API methods, stages, rules and
+    rule memos, and of the projects that spent the most time in API calls.
+    """
+    lines = []
+
+    def table(header, rows):
+        if rows:
+            lines.append('')
+            lines.append(header)
+            lines.extend(rows)
+
+    api, cached = totals('api'), totals('cache')
+    table('%8s %7s %7s %9s %8s %9s  %s' % ('calls', 'errors', 'cached',
+                                           'seconds', 'avg ms', 'MB',
+                                           'API method'),
+          ['%8d %7d %7d %9.2f %8.1f %9.2f  %s' %
+           (s.count, s.errors, cached.get(name, Stat()).count, s.seconds,
+            1000 * s.seconds / max(s.count, 1), s.bytes / 1048576.0, name)
+           for name, s in sorted((name, api.get(name, Stat()))
+                                 for name in set(api) | set(cached))])
+
+    table('%8s %9s %8s  %s' % ('calls', 'seconds', 'max ms', 'stage'),
+          ['%8d %9.2f %8.1f  %s' % (s.count, s.seconds, 1000 * s.max, name)
+           for name, s in sorted(totals('stage').items())])
+
+    table('%8s %7s %9s %8s  %s' % ('objects', 'matches', 'seconds', 'avg us',
+                                   'rule'),
+          ['%8d %7d %9.2f %8.1f  %s' %
+           (s.count, s.matches, s.seconds,
+            1e6 * s.seconds / max(s.count, 1), name)
+           for name, s in sorted(totals('rule').items())])
+
+    table('%8s %8s %6s  %s' % ('lookups', 'hits', 'hit %', 'memo'),
+          ['%8d %8d %6.1f  %s' % (s.count, s.matches,
+                                  100.0 * s.matches / max(s.count, 1), name)
+           for name, s in sorted(totals('memo').items())])
+
+    projects = sorted(totals('api', by='project').items(),
+                      key=lambda (_, s): -s.seconds)
+    table('%8s %7s %9s %9s  %s' % ('calls', 'errors', 'seconds', 'MB',
+                                   'project (most API time)'),
+          ['%8d %7d %9.2f %9.2f  %s' % (s.count, s.errors, s.seconds,
+                                        s.bytes / 1048576.0, project)
+           for project, s in projects[:top]])
+
+    return lines
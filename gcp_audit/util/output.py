@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import datetime
+import gzip
+import json
+import os
+import threading
+
+
+class Sink(object):
+    """Writes findings to a single, buffered file handle.
+
+    Findings are flushed every `flush_every` records and when the sink is
+    closed. Writes are serialized, so several threads can share a sink.
+    """
+
+    mode = 'ab'
+
+    def __init__(self, path, compress=False, flush_every=100):
+        if compress:
+            self.f = gzip.open(path, self.mode)
+        else:
+            self.f = open(path, self.mode)
+        self.lock = threading.Lock()
+        self.flush_every = flush_every
+        self.pending = 0
+        self.closed = False
+        self.begin()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def begin(self):
+        pass
+
+    def end(self):
+        pass
+
+    def format(self, finding):
+        raise NotImplementedError
+
+    def write(self, project, check, name, rule, obj, status=None,
+              time=None):
+        finding = {'time': time or datetime.datetime.now(),
+                   'project': project,
+                   'check': check,
+                   'object': name,
+                   'rule': rule['name'],
+                   'data': obj}
+        if status:
+            finding['status'] = status
+        with self.lock:
+            data = self.format(finding)
+            if isinstance(data, unicode):
+                data = data.encode('utf-8')
+            self.f.write(data)
+            self.pending += 1
+            if self.pending >= self.flush_every:
+                self.f.flush()
+                self.pending = 0
+
+    def sync(self):
+        """Write the findings so far to disk, and return the file size."""
+        with self.lock:
+            self.f.flush()
+            os.fsync(self.f.fileno())
+            self.pending = 0
+            return os.fstat(self.f.fileno()).st_size
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.end()
+            self.f.close()
+            self.closed = True
+
+
+class TextSink(Sink):
+    """The original, human readable report format."""
+
+    def format(self, finding):
+        return (finding['time'].ctime()
+                + ": Project: " + finding['project']
+                + " | Object: " + finding['object']
+                + " | Matches rule: " + finding['rule']
+                + (" | Status: " + finding['status']
+                   if 'status' in finding else "")
+                + "\n" + json.dumps(finding['data']) + "\n\n")
+
+
+class JsonLinesSink(Sink):
+    """One JSON document per finding and line."""
+
+    def format(self, finding):
+        return json.dumps(dict(finding, time=finding['time'].isoformat())) \
+            + "\n"
+
+
+class JsonSink(Sink):
+    """A single JSON array of all findings of a run."""
+
+    mode = 'wb'
+
+    def begin(self):
+        self.f.write('[')
+        self.separator = '\n'
+
+    def end(self):
+        self.f.write(']\n')
+
+    def format(self, finding):
+        data = self.separator + json.dumps(
+            dict(finding, time=finding['time'].isoformat()))
+        self.separator = ',\n'
+        return data
+
+
+sinks = {
+    'text': TextSink,
+    'jsonl': JsonLinesSink,
+    'json': JsonSink
+}
+
+
+def open_sink(path, format='text', compress=False):
+    return sinks[format](path, compress=compress)
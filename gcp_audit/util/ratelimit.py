@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import random
+import socket
+import ssl
+import threading
+import time
+
+try:
+    from httplib2 import HttpLib2Error
+except ImportError:
+    HttpLib2Error = socket.error
+
+
+class TokenBucket(object):
+    """An adaptive token bucket, shared by all threads calling one API.
+
+    The bucket refills at `rate` tokens per second up to `burst` tokens.
+    When the API reports that a quota was exceeded the rate is halved, and
+    every successful call raises it a little again, up to `max_rate`, so
+    the rate settles just below the quota (additive increase,
+    multiplicative decrease).
+
+    A bucket without a rate lets every call through until the first quota
+    error, then starts from half the rate it saw calls being made at, and
+    has no upper bound to climb back to.
+    """
+
+    def __init__(self, rate=None, burst=None, min_rate=0.5):
+        self.max_rate = self.rate = float(rate) if rate else None
+        self.min_rate = min_rate
+        self.burst = burst
+        self.capacity = burst or max(1.0, self.rate or 1.0)
+        self.tokens = self.capacity
+        self.updated = self.window = time.time()
+        self.calls = 0
+        self.seen = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _count(self, now, tokens):
+        if now - self.window >= 1:
+            self.seen = self.calls / (now - self.window)
+            self.window = now
+            self.calls = 0
+        self.calls += tokens
+
+    def _set_rate(self, rate):
+        self._refill(time.time())
+        self.rate = rate
+        if not self.burst:
+            self.capacity = max(1.0, rate)
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` calls may be made."""
+        while True:
+            with self.lock:
+                if self.rate is None:
+                    self._count(time.time(), tokens)
+                    return
+                self._refill(time.time())
+                # a batch larger than the bucket may take it below zero
+                if self.tokens >= min(tokens, self.capacity):
+                    self.tokens -= tokens
+                    return
+                wait = (min(tokens, self.capacity) - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self):
+        with self.lock:
+            if self.rate is None:
+                now = time.time()
+                seen = max(self.seen, self.calls / max(1.0, now - self.window))
+                self.updated = now
+                self.tokens = 0.0
+                self.rate = seen
+            self._set_rate(max(self.min_rate, self.rate / 2))
+
+    def succeeded(self):
+        with self.lock:
+            if self.rate is None:
+                return
+            rate = self.rate + max(self.min_rate, self.rate) / 100
+            if self.max_rate:
+                rate = min(self.max_rate, rate)
+            self._set_rate(rate)
+
+
+class RateLimiter(object):
+    """Hands out one TokenBucket per API service."""
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, service):
+        with self.lock:
+            if service not in self.buckets:
+                self.buckets[service] = TokenBucket(self.rate, self.burst)
+            return self.buckets[service]
+
+
+def status(exception):
+    return getattr(getattr(exception, 'resp', None), 'status', None)
+
+
+def quota_exceeded(exception):
+    code = status(exception)
+    content = getattr(exception, 'content', None) or ''
+    return code == 429 or \
+        (code == 403 and 'ratelimitexceeded' in content.lower())
+
+
+def retryable(exception):
+    """Quota errors, server errors and transport errors are retried.
+
+    Anything else without an HTTP status, such as an expired credential or
+    a bug, would fail the same way again.
+    """
+    code = status(exception)
+    if code is None:
+        return isinstance(exception,
+                          (socket.error, ssl.SSLError, HttpLib2Error))
+    return code >= 500 or quota_exceeded(exception)
+
+
+def backoff(attempt, base=0.5, cap=32.0):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import collections
+
+ANY = object()
+
+
+def filter_requirements(filter, matchtype, path=(), matchtypes=None):
+    """Return the (path, literal) pairs an object needs to match a filter.
+
+    A filter can only match when every key it names exists, except for
+    count filters, which treat missing keys as empty lists. Exact string
+    values are returned as literals, other values as ANY. Lists are not
+    descended into, as their elements are matched in several ways.
+    """
+    if matchtype == 'count' or not isinstance(filter, dict):
+        return []
+
+    res = []
+    for k, v in filter.iteritems():
+        keytype = matchtypes.get(k, matchtype) if matchtypes else matchtype
+        if isinstance(v, dict) and v:
+            res.extend(filter_requirements(v, matchtype, path + (k,),
+                                           matchtypes))
+        elif keytype == 'count':
+            continue
+        elif keytype == 'exact' and isinstance(v, basestring):
+            res.append((path + (k,), v))
+        else:
+            res.append((path + (k,), ANY))
+    return res
+
+
+def rule_requirements(rule):
+    """Return the requirements every object matching a rule fulfills.
+
+    Only rules that combine their filters with 'and' are narrowed down,
+    as any single filter failing makes the whole rule fail.
+    """
+    if rule.get('filtercondition', 'and') != 'and':
+        return []
+
+    res = []
+    for f in rule['filters']:
+        res.extend(filter_requirements(f['filter'], f['matchtype'],
+                                       matchtypes=f.get('matchtypes')))
+    return res
+
+
+def satisfied(obj, path, literal):
+    value = obj
+    for key in path:
+        # other types are left to the filter itself
+        if not isinstance(value, dict):
+            return True
+        if key not in value:
+            return False
+        value = value[key]
+
+    if literal is ANY:
+        return True
+    elif isinstance(value, list):
+        # an empty list leaves the match as it was
+        return not value or literal in value
+    elif isinstance(value, basestring):
+        return value == literal
+    return True
+
+
+class RuleIndex(object):
+    """Narrows down the compiled rules that can match an object.
+
+    Rules are grouped by the set of top-level keys they require. Within a
+    group, rules with an exact top-level literal are looked up by the
+    object's value for that key, and the remaining nested keys and
+    literals are checked before the rule itself runs. Candidates are
+    always returned in the original rule order.
+
+    For a handful of rules, running them all is cheaper than the lookups,
+    so categories with fewer than `min_rules` rules are not indexed.
+    """
+
+    def __init__(self, rules, min_rules=8):
+        self.rules = rules
+        self.groups = []
+
+        if len(rules) < min_rules:
+            return
+
+        groups = collections.OrderedDict()
+        for position, (rule, match) in enumerate(rules):
+            requirements = rule_requirements(rule)
+            keys = frozenset(path[0] for path, _ in requirements)
+            plain, by_literal = groups.setdefault(keys, ([], {}))
+
+            literals = [(path[0], literal) for path, literal in requirements
+                        if len(path) == 1 and literal is not ANY]
+            checks = [(path, literal) for path, literal in requirements
+                      if len(path) > 1 or literal is not ANY]
+            entry = (position, rule, match, checks)
+
+            if literals:
+                key, literal = literals[0]
+                by_literal.setdefault(key, {}) \
+                    .setdefault(literal, []).append(entry)
+            else:
+                plain.append(entry)
+
+        self.groups = groups.items()
+
+    def candidates(self, obj):
+        if not self.groups or not isinstance(obj, dict):
+            return self.rules
+
+        res = []
+        for keys, (plain, by_literal) in self.groups:
+            if not keys.issubset(obj):
+                continue
+
+            entries = list(plain)
+            for key, literals in by_literal.iteritems():
+                entries.extend(_lookup(literals, obj[key]))
+
+            for position, rule, match, checks in entries:
+                for path, literal in checks:
+                    if not satisfied(obj, path, literal):
+                        break
+                else:
+                    res.append((position, rule, match))
+
+        res.sort()
+        return [(rule, match) for _, rule, match in res]
+
+
+def _lookup(literals, value):
+    if isinstance(value, basestring):
+        return literals.get(value, [])
+    elif isinstance(value, list) and value:
+        res = []
+        for e in set(e for e in value if isinstance(e, basestring)):
+            res.extend(literals.get(e, []))
+        return res
+    # an empty list or another type can't be ruled out
+    return [entry for entries in literals.itervalues() for entry in entries]
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import collections
+import sys
+import threading
+
+
+class Unit(object):
+    """A single (project, check) piece of work."""
+
+    def __init__(self, project, check):
+        self.project = project
+        self.check = check
+        self.result = None
+        self.exc_info = None
+        self.cancelled = False
+        self.done = threading.Event()
+
+
+class Scheduler(object):
+    """Runs units on a bounded pool of worker threads.
+
+    At most `per_project` units of the same project run at the same time,
+    and results are handed back in submission order, so the output of a
+    parallel run is identical to the output of a serial one.
+
+    After stop(), no more units are started. The units already running
+    still finish and are handed back, the others are not.
+
+    With `keep_workers`, the worker threads wait for the units of the
+    next run instead of exiting, so whatever they keep per thread, like
+    API connections, is reused.
+    """
+
+    def __init__(self, func, workers=1, per_project=None, keep_workers=False):
+        self.func = func
+        self.workers = max(1, workers)
+        self.per_project = per_project or self.workers
+        self.keep_workers = keep_workers
+        self.cond = threading.Condition()
+        self.pending = collections.deque()
+        self.running = collections.defaultdict(int)
+        self.threads = []
+        self.stopped = False
+
+    def stop(self):
+        """Stop starting units. Safe to call from a signal handler."""
+        self.stopped = True
+
+    def run(self, units):
+        """Yield (unit, result, exc_info) for each (project, check) pair."""
+        units = [Unit(project, check) for project, check in units]
+
+        if self.workers == 1:
+            for unit in units:
+                if self.stopped:
+                    return
+                self._execute(unit)
+                yield unit, unit.result, unit.exc_info
+            return
+
+        with self.cond:
+            self.pending.extend(units)
+            self.cond.notify_all()
+
+        if self.keep_workers:
+            self.threads = [t for t in self.threads if t.is_alive()]
+            missing = self.workers - len(self.threads)
+        else:
+            missing = min(self.workers, len(units))
+        for _ in range(missing):
+            worker = threading.Thread(target=self._worker)
+            worker.daemon = True
+            worker.start()
+            self.threads.append(worker)
+
+        for unit in units:
+            # wait with a timeout, so that signals are still delivered
+            while not unit.done.is_set():
+                if self.stopped and self._cancel(unit):
+                    break
+                unit.done.wait(0.5)
+            if not unit.cancelled:
+                yield unit, unit.result, unit.exc_info
+
+    def _cancel(self, unit):
+        """Drop the units not started yet, and tell if unit was one."""
+        with self.cond:
+            for pending in self.pending:
+                pending.cancelled = True
+            self.pending.clear()
+            self.cond.notify_all()
+        return unit.cancelled
+
+    def _execute(self, unit):
+        try:
+            unit.result = self.func(unit.project, unit.check)
+        except Exception:
+            unit.exc_info = sys.exc_info()
+        unit.done.set()
+
+    def _next(self):
+        with self.cond:
+            while (self.pending or self.keep_workers) and not self.stopped:
+                for unit in self.pending:
+                    if self.running[unit.project] < self.per_project:
+                        self.pending.remove(unit)
+                        self.running[unit.project] += 1
+                        return unit
+                self.cond.wait()
+            return None
+
+    def _worker(self):
+        while True:
+            unit = self._next()
+            if unit is None:
+                return
+
+            self._execute(unit)
+
+            with self.cond:
+                self.running[unit.project] -= 1
+                self.cond.notify_all()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import hashlib
+
+_MASK = (1 << 64) - 1
+
+
+def parse_shard(spec):
+    """Parse a shard like 0/4 into (index, count)."""
+    try:
+        index, count = [int(part) for part in spec.split('/')]
+    except ValueError:
+        raise ValueError("invalid shard '%s', expected INDEX/COUNT" % spec)
+    if not 0 <= index < count:
+        raise ValueError("invalid shard '%s', INDEX must be between 0 and "
+                         "COUNT - 1" % spec)
+    return index, count
+
+
+def shard_of(project, count):
+    """Return the shard, out of count, that audits a project.
+
+    This is a jump consistent hash (Lamping and Veach) of the project ID:
+    going from N to N + 1 shards only moves 1 / (N + 1) of the projects,
+    all of them to the new shard.
+    """
+    if isinstance(project, unicode):
+        project = project.encode('utf-8')
+    key = int(hashlib.sha1(project).hexdigest()[:16], 16)
+
+    shard, j = -1, 0
+    while j < count:
+        shard = j
+        key = (key * 2862933555777941757 + 1) & _MASK
+        j = int((shard + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return shard
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-2017 Spotify AB.
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import hashlib
+import json
+import sqlite3
+import threading
+
+NEW = 'new'
+PRESENT = 'present'
+RESOLVED = 'resolved'
+
+
+def digest(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True)).hexdigest()
+
+
+# Fields that tell apart the objects without a selfLink or id, like the
+# default object ACLs of the buckets of a project, or the roles of an IAM
+# member.
+KEY_FIELDS = ('bucket', 'entity', 'member', 'role', 'condition')
+
+
+def object_key(obj, descfield):
+    for field in ('selfLink', 'id'):
+        if field in obj:
+            return obj[field]
+
+    fields = [(field, obj[field]) for field in sorted(set(KEY_FIELDS) |
+                                                      set([descfield]))
+              if field in obj]
+    if fields == [(descfield, obj[descfield])]:
+        return obj[descfield]
+    return json.dumps(fields, sort_keys=True)
+
+
+def incomplete(obj, failed):
+    """Whether an object, or the bucket it belongs to, could not be fully
+    listed.
+    """
+    return bool(failed) and obj is not None and \
+        (obj.get('bucket') in failed or obj.get('selfLink') in failed)
+
+
+class SnapshotStore(object):
+    """Remembers the objects of each (project, check) between runs.
+
+    For every object the store keeps a hash of the object and of the rules
+    it was evaluated against, plus the rules it matched, so unchanged
+    objects need not be evaluated again. Matching objects are stored in
+    full, so that findings that went away can still be reported.
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS objects ('
+                            'project TEXT, "check" TEXT, key TEXT, '
+                            'digest TEXT, findings TEXT, data TEXT, '
+                            'PRIMARY KEY (project, "check", key))')
+
+    def load(self, project, check):
+        with self.lock:
+            rows = self.db.execute('SELECT key, digest, findings, data '
+                                   'FROM objects WHERE project = ? '
+                                   'AND "check" = ?', (project, check))
+            return dict((key, (objdigest, json.loads(findings),
+                               data and json.loads(data)))
+                        for key, objdigest, findings, data in rows)
+
+    def save(self, project, check, objects):
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM objects WHERE project = ? '
+                            'AND "check" = ?', (project, check))
+            self.db.executemany(
+                'INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?)',
+                ((project, check, key, objdigest, json.dumps(findings),
+                  obj and json.dumps(obj))
+                 for key, (objdigest, findings, obj) in objects.iteritems()))
+
+    def audit(self, project, check, objects, rules, evaluate, descfield,
+              failed=None):
+        """Evaluate objects against rules, reusing results where possible.
+
+        `rules` is the list of (rule, match) pairs of the check, and
+        `evaluate` returns the rules an object matches. Returns a list of
+        (obj, rule, status) findings, where status tells whether a finding
+        is new, still present or resolved since the previous run.
+
+        `failed` is filled, while `objects` are listed, with the buckets
+        whose objects could not be, the selfLinks of the objects that could
+        only be in part, and the names of the rules that could not be
+        evaluated. Their findings are not resolved, and the store keeps the
+        previous run of a unit with failures.
+        """
+        ruleset = digest([rule for rule, _ in rules])
+        positions = dict((id(rule), i) for i, (rule, _) in enumerate(rules))
+        previous = self.load(project, check)
+        current = {}
+        res = []
+
+        for obj in objects:
+            key = object_key(obj, descfield)
+            objdigest = digest([ruleset, obj])
+            if key in current:
+                # the same key twice, tell the objects apart by content
+                key = '%s %s' % (key, digest(obj))
+            old = previous.pop(key, None)
+            old_names = set(name for _, name in old[1]) if old else set()
+
+            if old and old[0] == objdigest:
+                matched = [rules[position][0] for position, _ in old[1]]
+            else:
+                matched = evaluate(obj)
+
+            findings = [(positions[id(rule)], rule['name'])
+                        for rule in matched]
+            current[key] = (objdigest, findings, obj if findings else None)
+
+            for rule in matched:
+                status = PRESENT if rule['name'] in old_names else NEW
+                res.append((obj, rule, status))
+
+            if incomplete(obj, failed):
+                continue
+            names = set(name for _, name in findings) | (failed or set())
+            for _, name in old[1] if old else []:
+                if name not in names:
+                    res.append((obj, {'name': name}, RESOLVED))
+
+        # objects that are gone resolve all of their findings
+        for key, (_, findings, obj) in previous.iteritems():
+            if incomplete(obj, failed):
+                continue
+            for _, name in findings:
+                if not failed or name not in failed:
+                    res.append((obj, {'name': name}, RESOLVED))
+
+        if not failed:
+            self.save(project, check, current)
+        return res
@@ -49,6 +49,7 @@ setup(
     keywords='security gcp google-cloud-platform',
     packages=find_packages(),
     install_requires=['termcolor', 'google-api-python-client', 'PyYAML'],
+    extras_require={'async': ['gevent']},
     include_package_data=True,
     entry_points={
         'console_scripts': [